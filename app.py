@@ -4,27 +4,129 @@ Meu Bairro Melhor - Aplicação Principal
 Foco na lógica e funcionalidades
 """
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, make_response
+import click
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, make_response, abort, stream_with_context, send_file
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from datetime import datetime, timedelta
+import atexit
+import base64
+import binascii
+import csv
+import hashlib
+import json
+import math
 import os
+import queue
+import re
+import selectors
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlencode
 import requests
-from sqlalchemy import func, case
+from requests.adapters import HTTPAdapter
+try:
+    import fcntl
+except ImportError:
+    # Windows: o limite do Nominatim passa a valer apenas por processo
+    fcntl = None
+try:
+    import orjson
+except ImportError:
+    # Opcional: sem orjson as respostas colunares usam o json da biblioteca padrão
+    orjson = None
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # Opcional: sem pyarrow a exportação em Parquet fica indisponível
+    pyarrow = None
+try:
+    from gevent import monkey as gevent_monkey
+except ImportError:
+    # Opcional: sem gevent o /stream só funciona no servidor de desenvolvimento
+    gevent_monkey = None
+from sqlalchemy import event, func, case, inspect, text, literal_column, and_, or_, bindparam, select
+from sqlalchemy.orm import Session, joinedload, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, LongTable, TableStyle, PageBreak
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import colors
 from reportlab.lib.units import inch
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-from io import BytesIO
+from io import StringIO
 
 # Criar aplicação Flask
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or 'sua-chave-secreta-aqui-mude-em-producao'
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL') or 'sqlite:///meu_bairro_melhor.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# A partir deste zoom o mapa recebe propostas individuais em vez de agrupamentos
+app.config['MAP_CLUSTER_ZOOM'] = int(os.environ.get('MAP_CLUSTER_ZOOM', 15))
+# Cache dos tiles GeoJSON do mapa (compartilhado entre os workers do gunicorn)
+app.config['TILE_CACHE_DIR'] = os.environ.get('TILE_CACHE_DIR') or os.path.join(app.instance_path, 'tiles')
+app.config['TILE_MAX_AGE'] = int(os.environ.get('TILE_MAX_AGE', 60))
+# Serviços de geocodificação (URLs configuráveis para testes com um servidor local)
+app.config['VIACEP_URL'] = os.environ.get('VIACEP_URL') or 'https://viacep.com.br/ws/{cep}/json/'
+app.config['NOMINATIM_URL'] = os.environ.get('NOMINATIM_URL') or 'https://nominatim.openstreetmap.org/search'
+app.config['NOMINATIM_INTERVALO'] = float(os.environ.get('NOMINATIM_INTERVALO', 1.0))
+app.config['GEOCODE_TIMEOUT'] = float(os.environ.get('GEOCODE_TIMEOUT', 5))
+# Tempo máximo que uma requisição espera pela geocodificação antes de responder
+app.config['GEOCODE_ORCAMENTO'] = float(os.environ.get('GEOCODE_ORCAMENTO', 3))
+# Lotes: consultas externas iniciadas por requisição e tempo máximo de espera (abaixo do
+# timeout de 30 s do gunicorn); o que passar disso volta como pendente para reenvio
+app.config['GEOCODE_LOTE_CONSULTAS'] = int(os.environ.get('GEOCODE_LOTE_CONSULTAS', 15))
+app.config['GEOCODE_LOTE_ORCAMENTO'] = float(os.environ.get('GEOCODE_LOTE_ORCAMENTO', 20))
+# Contador de votos write-behind (experimental, desligado): deltas acumulados num buffer e
+# aplicados em lote. Não mostrou ganho em scripts/bench_votos.py, nem no SQLite nem no PostgreSQL
+app.config['VOTOS_WRITE_BEHIND'] = os.environ.get('VOTOS_WRITE_BEHIND', '').lower() in ('1', 'true', 'sim')
+app.config['VOTOS_FLUSH_INTERVALO'] = float(os.environ.get('VOTOS_FLUSH_INTERVALO', 2))
+app.config['VOTOS_BUFFER_PATH'] = os.environ.get('VOTOS_BUFFER_PATH') or os.path.join(app.instance_path, 'votos_pendentes.db')
+# Eventos ao vivo (SSE): as páginas só abrem o EventSource com SSE_ATIVO, ligado apenas quando
+# há um serviço de stream gevent no ar; SSE_URL aponta para ele se estiver em outro domínio
+app.config['SSE_ATIVO'] = os.environ.get('SSE_ATIVO', '').lower() in ('1', 'true', 'sim')
+app.config['SSE_URL'] = os.environ.get('SSE_URL', '').rstrip('/')
+# Duração máxima de cada conexão SSE (0 = sem limite)
+app.config['SSE_DURACAO'] = float(os.environ.get('SSE_DURACAO', 0))
+# Domínio do serviço de stream gevent para as exportações quando não há nginx na frente
+# (Procfile/Railway): os workers sync redirecionam /relatorios/exportar para ele
+app.config['EXPORTACAO_URL'] = os.environ.get('EXPORTACAO_URL', '').rstrip('/')
+# Validade (s) do link assinado com que o serviço de stream aceita a exportação sem o cookie
+app.config['EXPORTACAO_TOKEN_VALIDADE'] = int(os.environ.get('EXPORTACAO_TOKEN_VALIDADE', 300))
+app.config['EVENTOS_SOCKET_DIR'] = os.environ.get('EVENTOS_SOCKET_DIR') or os.path.join(app.instance_path, 'eventos')
+# Cache dos relatórios em PDF, indexado pela versão dos dados
+app.config['RELATORIO_CACHE_DIR'] = os.environ.get('RELATORIO_CACHE_DIR') or os.path.join(app.instance_path, 'relatorios')
+# Por quanto tempo (s) um PDF desatualizado ainda é servido enquanto o novo é gerado
+app.config['RELATORIO_PDF_MAX_IDADE'] = float(os.environ.get('RELATORIO_PDF_MAX_IDADE', 600))
+# Espera (s) após uma escrita antes de o despachante da fila regenerar os PDFs (0 = não regenerar)
+app.config['RELATORIO_PDF_ATRASO'] = float(os.environ.get('RELATORIO_PDF_ATRASO', 30))
+# Fila de relatórios: PDFs renderizados em processos separados dos workers web
+app.config['RELATORIOS_PROCESSOS'] = int(os.environ.get('RELATORIOS_PROCESSOS', 2))
+app.config['RELATORIOS_TAREFAS_POR_USUARIO'] = int(os.environ.get('RELATORIOS_TAREFAS_POR_USUARIO', 3))
+app.config['RELATORIOS_RETENCAO_HORAS'] = float(os.environ.get('RELATORIOS_RETENCAO_HORAS', 24))
+app.config['RELATORIOS_MAX_ARTEFATOS'] = int(os.environ.get('RELATORIOS_MAX_ARTEFATOS', 200))
+app.config['RELATORIOS_TEMPO_MAXIMO'] = float(os.environ.get('RELATORIOS_TEMPO_MAXIMO', 600))
+# Intervalo (s) entre os sinais de vida do despachante. Sem sinal por 3 intervalos ele é dado como
+# parado: as páginas voltam a gerar o PDF direto e as tarefas dele voltam para a fila
+app.config['RELATORIOS_BATIMENTO'] = float(os.environ.get('RELATORIOS_BATIMENTO', 10))
+# Sem o comando processar-relatorios, o próprio processo web despacha a fila (só com um processo web).
+# Desligado por padrão; o servidor de desenvolvimento liga
+app.config['RELATORIOS_WORKER_EMBUTIDO'] = os.environ.get('RELATORIOS_WORKER_EMBUTIDO', '').lower() in ('1', 'true', 'sim')
 
 # Inicializar extensões
 db = SQLAlchemy(app)
@@ -73,11 +175,14 @@ class Proposal(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
-    category = db.Column(db.String(50), db.ForeignKey('category.id'), nullable=False)
+    # active_history: o valor antigo é carregado mesmo com o objeto expirado,
+    # para que EstatisticaProposta saiba de qual par categoria/status descontar
+    category = db.column_property(db.Column(db.String(50), db.ForeignKey('category.id'), nullable=False),
+                                  active_history=True)
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
     address = db.Column(db.String(300), nullable=False)
-    status = db.Column(db.String(20), default='pending')
+    status = db.column_property(db.Column(db.String(20), default='pending'), active_history=True)
     priority = db.Column(db.String(10), default='medium')
     votes_count = db.Column(db.Integer, default=0)
     comments_count = db.Column(db.Integer, default=0)
@@ -89,6 +194,16 @@ class Proposal(db.Model):
     author = db.relationship('User', backref='proposals')
     category_obj = db.relationship('Category', backref='proposals')
     
+    # Índices para os filtros e ordenações usados nas listagens e relatórios
+    __table_args__ = (
+        db.Index('ix_proposal_category_status_created', 'category', 'status', 'created_at'),
+        db.Index('ix_proposal_status_created', 'status', 'created_at'),
+        db.Index('ix_proposal_created_id', 'created_at', 'id'),
+        db.Index('ix_proposal_votes_count', 'votes_count'),
+        # Também cobre a contagem por autor com janela de datas (usuarios_mais_ativos)
+        db.Index('ix_proposal_author_created', 'author_id', 'created_at'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -118,7 +233,12 @@ class Vote(db.Model):
     user = db.relationship('User', backref='votes')
     proposal = db.relationship('Proposal', backref='votes')
     
-    __table_args__ = (db.UniqueConstraint('proposal_id', 'user_id', name='unique_vote'),)
+    __table_args__ = (
+        db.UniqueConstraint('proposal_id', 'user_id', name='unique_vote'),
+        # Cobre "em quais propostas este usuário votou" sem ler a tabela
+        db.Index('ix_vote_user_proposal', 'user_id', 'proposal_id'),
+        db.Index('ix_vote_user_created', 'user_id', 'created_at'),
+    )
 
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -132,6 +252,19 @@ class Comment(db.Model):
     user = db.relationship('User', backref='comments', lazy='joined')
     proposal = db.relationship('Proposal', backref='comments')
     
+    __table_args__ = (
+        db.Index('ix_comment_proposal_created', 'proposal_id', 'created_at'),
+        db.Index('ix_comment_user_created', 'user_id', 'created_at'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'content': self.content,
+            'author_name': self.author_name,
+            'created_at': self.created_at.isoformat()
+        }
+    
     @property
     def author_name(self):
         try:
@@ -141,13 +274,214 @@ class Comment(db.Model):
         except Exception:
             return 'Usuário Anônimo'
 
+class GeocodeCache(db.Model):
+    """Cache persistente das consultas ao ViaCEP e ao Nominatim"""
+    chave = db.Column(db.String(400), primary_key=True)
+    resultado = db.Column(db.Text, nullable=False)
+    expira_em = db.Column(db.DateTime, nullable=False)
+    descartar_em = db.Column(db.DateTime, nullable=False, index=True)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class EstatisticaProposta(db.Model):
+    """Quantidade de propostas por categoria e status, mantida pelos eventos de Proposal"""
+    category = db.Column(db.String(50), primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+class Logradouro(db.Model):
+    """Base local de CEPs e logradouros importada de CSV (autocompletar sem serviço externo)"""
+    id = db.Column(db.Integer, primary_key=True)
+    cep = db.Column(db.String(8), nullable=False, index=True)
+    logradouro = db.Column(db.String(200), nullable=False)
+    bairro = db.Column(db.String(120))
+    cidade = db.Column(db.String(120), nullable=False)
+    estado = db.Column(db.String(2), nullable=False)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    # Textos normalizados (minúsculas, sem acentos) para busca por prefixo
+    chave = db.Column(db.String(200), nullable=False, index=True)
+    chave_nome = db.Column(db.String(200), nullable=False, index=True)
+    chave_cidade = db.Column(db.String(120), nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_logradouro_cidade_estado', 'chave_cidade', 'estado'),
+    )
+    
+    @property
+    def endereco_completo(self):
+        return f"{self.logradouro}, {self.bairro}, {self.cidade} - {self.estado}"
+    
+    def to_dict(self):
+        return {
+            'cep': f"{self.cep[:5]}-{self.cep[5:]}",
+            'logradouro': self.logradouro,
+            'bairro': self.bairro or '',
+            'cidade': self.cidade,
+            'estado': self.estado,
+            'endereco_completo': self.endereco_completo,
+            'latitude': self.latitude,
+            'longitude': self.longitude
+        }
+
+class TarefaRelatorio(db.Model):
+    """Relatório enfileirado para geração fora da requisição (ver processar-relatorios)"""
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    tipo = db.Column(db.String(20), nullable=False)
+    # Parâmetros do relatório em JSON (dias de atividade ou filtros do personalizado)
+    parametros = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(20), nullable=False, default='pendente')
+    arquivo = db.Column(db.String(300))
+    erro = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # Renovado pelo despachante enquanto gera a tarefa; vencido, a tarefa volta para a fila
+    batimento_em = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_tarefa_relatorio_status_created', 'status', 'created_at'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'tipo': self.tipo,
+            'status': self.status,
+            'erro': self.erro,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'status_url': url_for('status_tarefa_relatorio', id=self.id),
+            'download_url': url_for('baixar_tarefa_relatorio', id=self.id) if self.status == 'concluida' else None
+        }
+
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
 
+# ===== CLIENTE HTTP DE GEOCODIFICAÇÃO =====
+
+class Disjuntor:
+    """Circuit breaker: depois de `limite_falhas` falhas seguidas recusa chamadas
+    por `espera` segundos e então deixa passar uma chamada de teste."""
+
+    def __init__(self, nome, limite_falhas=5, espera=30):
+        self.nome = nome
+        self.limite_falhas = limite_falhas
+        self.espera = espera
+        self.falhas = 0
+        self.aberto_ate = 0.0
+        self._testando = False
+        self._lock = threading.Lock()
+
+    @property
+    def estado(self):
+        if self.falhas < self.limite_falhas:
+            return 'fechado'
+        return 'meio-aberto' if time.monotonic() >= self.aberto_ate else 'aberto'
+
+    def permitir(self):
+        with self._lock:
+            if self.falhas < self.limite_falhas:
+                return True
+            if time.monotonic() >= self.aberto_ate and not self._testando:
+                self._testando = True
+                return True
+            return False
+
+    def sucesso(self):
+        with self._lock:
+            self.falhas = 0
+            self._testando = False
+
+    def falha(self):
+        with self._lock:
+            self.falhas += 1
+            self._testando = False
+            if self.falhas >= self.limite_falhas:
+                self.aberto_ate = time.monotonic() + self.espera
+
+def criar_sessao_geocodificacao():
+    """Sessão HTTP com conexões keep-alive reaproveitadas entre consultas"""
+    sessao = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    sessao.mount('https://', adaptador)
+    sessao.mount('http://', adaptador)
+    sessao.headers['User-Agent'] = 'MeuBairroMelhor/1.0'
+    return sessao
+
+sessao_geocodificacao = criar_sessao_geocodificacao()
+disjuntor_viacep = Disjuntor('viacep')
+disjuntor_nominatim = Disjuntor('nominatim')
+
+# Consultas externas rodam fora da thread da requisição
+executor_geocodificacao = ThreadPoolExecutor(max_workers=4, thread_name_prefix='geocodificacao')
+# Lotes usam um executor separado para não atrasar as buscas interativas
+executor_lotes = ThreadPoolExecutor(max_workers=4, thread_name_prefix='geocodificacao-lote')
+_consultas_em_andamento = {}
+_consultas_lock = threading.Lock()
+_nominatim_lock = threading.Lock()
+_nominatim_ultimo = 0.0
+
+def aguardar_limite_nominatim():
+    """Respeitar a política do Nominatim (1 requisição por segundo).
+    
+    O horário da próxima vaga fica num arquivo com flock, compartilhado por
+    todos os workers da máquina; a espera acontece fora do lock.
+    """
+    global _nominatim_ultimo
+    intervalo = app.config['NOMINATIM_INTERVALO']
+
+    with _nominatim_lock:
+        if fcntl is None:
+            agora = time.time()
+            vaga = max(agora, _nominatim_ultimo + intervalo)
+            _nominatim_ultimo = vaga
+        else:
+            os.makedirs(app.instance_path, exist_ok=True)
+            with open(os.path.join(app.instance_path, 'nominatim.ratelimit'), 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                try:
+                    ultimo = float(f.read() or 0)
+                except ValueError:
+                    ultimo = 0.0
+                agora = time.time()
+                vaga = max(agora, ultimo + intervalo)
+                f.seek(0)
+                f.truncate()
+                f.write(repr(vaga))
+                f.flush()
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    if vaga > agora:
+        time.sleep(vaga - agora)
+
+def consultar_uma_vez(chave, funcao, executor=None):
+    """Single-flight: consultas idênticas simultâneas compartilham o mesmo Future"""
+    with _consultas_lock:
+        futuro = _consultas_em_andamento.get(chave)
+        if futuro is not None:
+            return futuro
+
+        def executar():
+            try:
+                with app.app_context():
+                    try:
+                        return funcao()
+                    finally:
+                        db.session.remove()
+            finally:
+                with _consultas_lock:
+                    _consultas_em_andamento.pop(chave, None)
+
+        futuro = (executor or executor_geocodificacao).submit(executar)
+        _consultas_em_andamento[chave] = futuro
+        return futuro
+
 # ===== FUNÇÕES DE BUSCA =====
 
-def buscar_cep(cep):
+def consultar_viacep(cep):
     """Buscar dados do CEP usando ViaCEP"""
     try:
         # Limpar CEP (remover caracteres não numéricos)
@@ -156,8 +490,20 @@ def buscar_cep(cep):
         if len(cep_limpo) != 8:
             return {'erro': 'CEP deve ter 8 dígitos'}
         
-        url = f"https://viacep.com.br/ws/{cep_limpo}/json/"
-        response = requests.get(url, timeout=10)
+        if not disjuntor_viacep.permitir():
+            return {'erro': 'ViaCEP indisponível no momento, tente novamente em instantes'}
+        
+        url = app.config['VIACEP_URL'].format(cep=cep_limpo)
+        try:
+            response = sessao_geocodificacao.get(url, timeout=app.config['GEOCODE_TIMEOUT'])
+        except requests.exceptions.RequestException:
+            disjuntor_viacep.falha()
+            raise
+        
+        if response.status_code >= 500 or response.status_code == 429:
+            disjuntor_viacep.falha()
+        else:
+            disjuntor_viacep.sucesso()
         
         if response.status_code == 200:
             data = response.json()
@@ -182,10 +528,13 @@ def buscar_cep(cep):
     except Exception as e:
         return {'erro': f'Erro inesperado: {str(e)}'}
 
-def buscar_endereco(endereco):
+def consultar_nominatim(endereco):
     """Buscar coordenadas do endereço usando Nominatim"""
     try:
-        url = "https://nominatim.openstreetmap.org/search"
+        if not disjuntor_nominatim.permitir():
+            return {'erro': 'Nominatim indisponível no momento, tente novamente em instantes'}
+        
+        url = app.config['NOMINATIM_URL']
         params = {
             'q': f"{endereco}, Brasil",
             'format': 'json',
@@ -193,11 +542,18 @@ def buscar_endereco(endereco):
             'addressdetails': 1,
             'countrycodes': 'br'
         }
-        headers = {
-            'User-Agent': 'MeuBairroMelhor/1.0'
-        }
         
-        response = requests.get(url, params=params, headers=headers, timeout=10)
+        aguardar_limite_nominatim()
+        try:
+            response = sessao_geocodificacao.get(url, params=params, timeout=app.config['GEOCODE_TIMEOUT'])
+        except requests.exceptions.RequestException:
+            disjuntor_nominatim.falha()
+            raise
+        
+        if response.status_code >= 500 or response.status_code == 429:
+            disjuntor_nominatim.falha()
+        else:
+            disjuntor_nominatim.sucesso()
         
         if response.status_code == 200:
             data = response.json()
@@ -227,40 +583,1175 @@ def buscar_endereco(endereco):
     except Exception as e:
         return {'erro': f'Erro inesperado: {str(e)}'}
 
+# ===== CACHE DE GEOCODIFICAÇÃO =====
+
+GEOCODE_TTL_CEP = timedelta(days=30)
+GEOCODE_TTL_ENDERECO = timedelta(days=7)
+GEOCODE_TTL_NEGATIVO = timedelta(hours=1)
+# Depois de expirar, o resultado ainda é servido enquanto uma nova consulta roda em segundo plano
+GEOCODE_JANELA_STALE = timedelta(days=30)
+GEOCODE_LRU_TAMANHO = 2048
+
+# Respostas "não encontrado" também são guardadas, por pouco tempo
+GEOCODE_ERROS_NEGATIVOS = ('CEP não encontrado', 'Endereço não encontrado')
+
+_geocode_lru = OrderedDict()
+_geocode_lock = threading.Lock()
+
+# Contadores por processo (cada worker do gunicorn tem os seus)
+estatisticas_geocodificacao = {
+    'hit_memoria': 0,
+    'hit_banco': 0,
+    'hit_stale': 0,
+    'miss': 0,
+    'revalidacoes': 0,
+    'estouro_orcamento': 0
+}
+
+def normalizar_texto(texto):
+    """Minúsculas, sem acentos e com espaços simples - usado como chave de cache"""
+    sem_acentos = unicodedata.normalize('NFKD', texto)
+    sem_acentos = ''.join(c for c in sem_acentos if not unicodedata.combining(c))
+    return ' '.join(sem_acentos.lower().split())
+
+def _contar(evento):
+    with _geocode_lock:
+        estatisticas_geocodificacao[evento] += 1
+
+def _lru_obter(chave):
+    with _geocode_lock:
+        entrada = _geocode_lru.get(chave)
+        if entrada is not None:
+            _geocode_lru.move_to_end(chave)
+        return entrada
+
+def _lru_gravar(chave, entrada):
+    with _geocode_lock:
+        _geocode_lru[chave] = entrada
+        _geocode_lru.move_to_end(chave)
+        while len(_geocode_lru) > GEOCODE_LRU_TAMANHO:
+            _geocode_lru.popitem(last=False)
+
+def _gravar_geocodificacao(chave, resultado, ttl):
+    """Guardar um resultado nos dois níveis; erros de conexão não são guardados"""
+    if resultado.get('sucesso'):
+        agora = datetime.utcnow()
+        entrada = (resultado, agora + ttl, agora + ttl + GEOCODE_JANELA_STALE)
+    elif resultado.get('erro') in GEOCODE_ERROS_NEGATIVOS:
+        agora = datetime.utcnow()
+        entrada = (resultado, agora + GEOCODE_TTL_NEGATIVO, agora + GEOCODE_TTL_NEGATIVO)
+    else:
+        return
+
+    _lru_gravar(chave, entrada)
+
+    try:
+        db.session.merge(GeocodeCache(
+            chave=chave,
+            resultado=json.dumps(resultado, ensure_ascii=False),
+            expira_em=entrada[1],
+            descartar_em=entrada[2]
+        ))
+        db.session.commit()
+    except Exception as e:
+        # Outro worker pode ter gravado a mesma chave ao mesmo tempo
+        db.session.rollback()
+        app.logger.warning(f'Não foi possível gravar o cache de geocodificação: {str(e)}')
+
+def _consultar_e_gravar(chave, consultar, ttl, executor=None):
+    """Consulta externa (single-flight, no executor) que já grava o resultado no cache"""
+    def tarefa():
+        resultado = consultar()
+        _gravar_geocodificacao(chave, resultado, ttl)
+        return resultado
+    return consultar_uma_vez(chave, tarefa, executor)
+
+def obter_geocodificacao(chave, consultar, ttl, esperar=True, externo=True):
+    """Consultar o cache em memória, depois o banco e só então o serviço externo.
+    
+    Resultados expirados dentro de GEOCODE_JANELA_STALE são devolvidos na hora
+    enquanto a consulta externa é refeita em segundo plano. Numa falta, a
+    requisição espera no máximo GEOCODE_ORCAMENTO segundos; se o serviço
+    demorar mais, a consulta continua e o resultado fica no cache.
+    
+    Com esperar=False uma falta devolve o Future da consulta (usado nos lotes);
+    com externo=False devolve None, sem consultar nem revalidar.
+    """
+    agora = datetime.utcnow()
+
+    entrada = _lru_obter(chave)
+    evento = 'hit_memoria'
+
+    if entrada is None:
+        registro = db.session.get(GeocodeCache, chave)
+        if registro is not None:
+            entrada = (json.loads(registro.resultado), registro.expira_em, registro.descartar_em)
+            _lru_gravar(chave, entrada)
+            evento = 'hit_banco'
+
+    if entrada is not None:
+        resultado, expira_em, descartar_em = entrada
+        if agora < expira_em:
+            _contar(evento)
+            return resultado
+        if agora < descartar_em:
+            _contar('hit_stale')
+            if externo:
+                _contar('revalidacoes')
+                _consultar_e_gravar(chave, consultar, ttl)
+            return resultado
+
+    if not externo:
+        return None
+
+    _contar('miss')
+    if not esperar:
+        return _consultar_e_gravar(chave, consultar, ttl, executor_lotes)
+
+    futuro = _consultar_e_gravar(chave, consultar, ttl)
+    try:
+        return futuro.result(timeout=app.config['GEOCODE_ORCAMENTO'])
+    except FuturesTimeoutError:
+        _contar('estouro_orcamento')
+        return {'erro': 'A consulta está demorando, tente novamente em instantes'}
+
+def limpar_cache_geocodificacao():
+    """Remover do banco entradas que nem como stale servem mais"""
+    try:
+        GeocodeCache.query.filter(GeocodeCache.descartar_em < datetime.utcnow()).delete()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning(f'Não foi possível limpar o cache de geocodificação: {str(e)}')
+
+def buscar_cep(cep, esperar=True, externo=True):
+    """Buscar dados do CEP (base local, depois cache e ViaCEP)"""
+    cep_limpo = ''.join(filter(str.isdigit, cep))
+
+    if len(cep_limpo) != 8:
+        return {'erro': 'CEP deve ter 8 dígitos'}
+
+    resultado = buscar_cep_local(cep_limpo)
+    if resultado is not None:
+        return resultado
+
+    return obter_geocodificacao(f'cep:{cep_limpo}', lambda: consultar_viacep(cep_limpo), GEOCODE_TTL_CEP,
+                                esperar, externo)
+
+def buscar_endereco(endereco, esperar=True, externo=True):
+    """Buscar coordenadas do endereço (base local, depois cache e Nominatim)"""
+    resultado = buscar_endereco_local(endereco)
+    if resultado is not None:
+        return resultado
+
+    chave = f'endereco:{normalizar_texto(endereco)}'
+    return obter_geocodificacao(chave, lambda: consultar_nominatim(endereco), GEOCODE_TTL_ENDERECO,
+                                esperar, externo)
+
+# ===== GEOCODIFICAÇÃO EM LOTE =====
+
+GEOCODE_LOTE_MAXIMO = 1000
+GEOCODE_ERRO_VALOR_INVALIDO = 'Valor deve ser um texto não vazio'
+
+def situacao_geocodificacao(resultado):
+    """Classificar o resultado de buscar_cep/buscar_endereco para o relatório do lote"""
+    if resultado.get('sucesso'):
+        return 'ok'
+    if resultado.get('erro') in GEOCODE_ERROS_NEGATIVOS:
+        return 'nao_encontrado'
+    if resultado.get('erro') in ('CEP deve ter 8 dígitos', GEOCODE_ERRO_VALOR_INVALIDO):
+        return 'invalido'
+    return 'erro'
+
+def geocodificar_lote(ceps=(), enderecos=(), max_consultas=None, orcamento=None):
+    """Resolver um lote de CEPs e endereços, gerando (indice, item) na ordem em que ficam prontos.
+    
+    Entradas repetidas são consultadas uma vez só. Acertos da base local e do
+    cache saem imediatamente; as faltas vão em paralelo para o executor dos
+    lotes, respeitando o limite do Nominatim em consultar_nominatim().
+    
+    No máximo `max_consultas` faltas são consultadas e a espera por elas dura
+    até `orcamento` segundos. O resto sai com status 'pendente': consultas já
+    iniciadas continuam e gravam no cache, então reenviar os pendentes depois
+    devolve o resultado sem esperar.
+    """
+    prazo = time.monotonic() + orcamento if orcamento is not None else None
+    entradas = [('cep', valor) for valor in ceps] + [('endereco', valor) for valor in enderecos]
+
+    # Agrupar índices pela chave normalizada da consulta
+    grupos = {}
+    for indice, (tipo, valor) in enumerate(entradas):
+        # null, números e listas não viram consultas ("None", "123")
+        if not isinstance(valor, str) or not valor.strip():
+            resultado = {'erro': GEOCODE_ERRO_VALOR_INVALIDO}
+            item = {'tipo': tipo, 'entrada': valor, 'status': situacao_geocodificacao(resultado)}
+            item.update(resultado)
+            yield indice, item
+            continue
+        
+        valor = valor.strip()
+        if tipo == 'cep':
+            chave = ('cep', ''.join(filter(str.isdigit, valor)))
+        else:
+            chave = ('endereco', normalizar_texto(valor))
+        grupos.setdefault(chave, (valor, []))[1].append(indice)
+
+    def itens(chave, resultado):
+        for indice in grupos[chave][1]:
+            tipo, valor = entradas[indice]
+            item = {'tipo': tipo, 'entrada': valor, 'status': situacao_geocodificacao(resultado)}
+            item.update(resultado)
+            yield indice, item
+
+    def adiados(chaves):
+        for chave in chaves:
+            for indice in grupos[chave][1]:
+                tipo, valor = entradas[indice]
+                yield indice, {'tipo': tipo, 'entrada': valor, 'status': 'pendente'}
+
+    pendentes = {}
+    fora_do_limite = []
+    for chave, (valor, _) in grupos.items():
+        # Acabadas as consultas do lote, só o cache responde
+        externo = max_consultas is None or len(pendentes) < max_consultas
+        if not chave[1]:
+            # Sem dígitos ou só pontuação: não sobra nada para consultar
+            resultado = {'erro': 'CEP deve ter 8 dígitos' if chave[0] == 'cep' else GEOCODE_ERRO_VALOR_INVALIDO}
+        elif chave[0] == 'cep':
+            resultado = buscar_cep(valor, esperar=False, externo=externo)
+        else:
+            resultado = buscar_endereco(valor, esperar=False, externo=externo)
+
+        if isinstance(resultado, Future):
+            pendentes[resultado] = chave
+        elif resultado is None:
+            fora_do_limite.append(chave)
+        else:
+            yield from itens(chave, resultado)
+
+    restante = None if prazo is None else max(prazo - time.monotonic(), 0)
+    try:
+        for futuro in as_completed(pendentes, timeout=restante):
+            chave = pendentes.pop(futuro)
+            try:
+                resultado = futuro.result()
+            except Exception as e:
+                resultado = {'erro': f'Erro inesperado: {str(e)}'}
+            yield from itens(chave, resultado)
+    except FuturesTimeoutError:
+        pass
+
+    yield from adiados(list(pendentes.values()) + fora_do_limite)
+
+# ===== BASE LOCAL DE LOGRADOUROS =====
+
+# Tipos de logradouro ignorados na busca pelo nome ("paulista" encontra "Avenida Paulista")
+TIPOS_LOGRADOURO = (
+    'rua', 'avenida', 'av', 'travessa', 'alameda', 'praca', 'rodovia', 'estrada',
+    'largo', 'viela', 'via', 'ladeira', 'beco', 'passagem', 'parque', 'vila'
+)
+
+# Nomes de coluna aceitos no CSV (formato do ViaCEP/Correios e variações comuns)
+COLUNAS_LOGRADOURO = {
+    'cep': ('cep',),
+    'logradouro': ('logradouro', 'endereco', 'rua'),
+    'bairro': ('bairro',),
+    'cidade': ('cidade', 'localidade', 'municipio'),
+    'estado': ('estado', 'uf'),
+    'latitude': ('latitude', 'lat'),
+    'longitude': ('longitude', 'lon', 'lng')
+}
+
+PREPOSICOES_LOGRADOURO = ('da', 'de', 'do', 'das', 'dos')
+
+def nome_sem_tipo(chave):
+    """Remover o tipo do logradouro (e a preposição seguinte) de um texto já normalizado"""
+    partes = chave.split(' ', 1)
+    if len(partes) == 2 and partes[0].rstrip('.') in TIPOS_LOGRADOURO:
+        chave = partes[1]
+        partes = chave.split(' ', 1)
+        if len(partes) == 2 and partes[0] in PREPOSICOES_LOGRADOURO:
+            chave = partes[1]
+    return chave
+
+def filtro_prefixo(coluna, prefixo):
+    """Comparação por faixa, que usa o índice B-tree tanto no SQLite quanto no PostgreSQL"""
+    return and_(coluna >= prefixo, coluna < prefixo + '\uffff')
+
+def importar_logradouros(arquivo, tamanho_lote=5000):
+    """Carregar um CSV de CEPs/logradouros na base local.
+    
+    Cidades presentes no arquivo são substituídas por inteiro, então importar
+    o mesmo arquivo de novo não duplica registros. Retorna o total importado.
+    """
+    primeira_linha = arquivo.readline()
+    arquivo.seek(0)
+    delimitador = ';' if primeira_linha.count(';') > primeira_linha.count(',') else ','
+    leitor = csv.DictReader(arquivo, delimiter=delimitador)
+    
+    cabecalho = {nome.strip().lower(): nome for nome in leitor.fieldnames or []}
+    colunas = {}
+    for campo, nomes in COLUNAS_LOGRADOURO.items():
+        colunas[campo] = next((cabecalho[n] for n in nomes if n in cabecalho), None)
+    faltando = [c for c in ('cep', 'logradouro', 'cidade', 'estado') if colunas[c] is None]
+    if faltando:
+        raise ValueError(f'Colunas obrigatórias ausentes no CSV: {", ".join(faltando)}')
+    
+    def valor(linha, campo):
+        coluna = colunas[campo]
+        return (linha.get(coluna) or '').strip() if coluna else ''
+    
+    def coordenada(linha, campo):
+        try:
+            return float(valor(linha, campo).replace(',', '.'))
+        except ValueError:
+            return None
+    
+    cidades_limpas = set()
+    lote = []
+    total = 0
+    
+    for linha in leitor:
+        cep = ''.join(filter(str.isdigit, valor(linha, 'cep')))
+        nome = valor(linha, 'logradouro')
+        cidade = valor(linha, 'cidade')
+        estado = valor(linha, 'estado').upper()
+        if len(cep) != 8 or not nome or not cidade or len(estado) != 2:
+            continue
+        
+        chave_cidade = normalizar_texto(cidade)
+        if (chave_cidade, estado) not in cidades_limpas:
+            Logradouro.query.filter_by(chave_cidade=chave_cidade, estado=estado).delete()
+            cidades_limpas.add((chave_cidade, estado))
+        
+        chave = normalizar_texto(nome)
+        lote.append({
+            'cep': cep,
+            'logradouro': nome,
+            'bairro': valor(linha, 'bairro'),
+            'cidade': cidade,
+            'estado': estado,
+            'latitude': coordenada(linha, 'latitude'),
+            'longitude': coordenada(linha, 'longitude'),
+            'chave': chave,
+            'chave_nome': nome_sem_tipo(chave),
+            'chave_cidade': chave_cidade
+        })
+        
+        if len(lote) >= tamanho_lote:
+            db.session.execute(Logradouro.__table__.insert(), lote)
+            total += len(lote)
+            lote = []
+    
+    if lote:
+        db.session.execute(Logradouro.__table__.insert(), lote)
+        total += len(lote)
+    
+    db.session.commit()
+    return total
+
+@app.cli.command('importar-logradouros')
+@click.argument('caminho', type=click.Path(exists=True, dir_okay=False))
+def comando_importar_logradouros(caminho):
+    """Importar um CSV de CEPs e logradouros para a base local"""
+    with open(caminho, encoding='utf-8-sig', newline='') as arquivo:
+        try:
+            total = importar_logradouros(arquivo)
+        except ValueError as e:
+            db.session.rollback()
+            raise click.ClickException(str(e))
+    click.echo(f'{total} logradouros importados')
+
+def autocompletar_logradouros(texto, cidade=None, limite=10):
+    """Logradouros cujo nome, nome sem o tipo ou CEP começa com o texto digitado"""
+    digitos = ''.join(filter(str.isdigit, texto))
+    prefixo = normalizar_texto(texto)
+    
+    if digitos and len(digitos) >= 5 and not prefixo.strip('- 0123456789'):
+        buscas = [(Logradouro.cep, digitos)]
+    elif len(prefixo) >= 3:
+        buscas = [(Logradouro.chave, prefixo), (Logradouro.chave_nome, nome_sem_tipo(prefixo))]
+    else:
+        return []
+    
+    # Uma consulta por índice, cada uma já na ordem do índice e com LIMIT, para que
+    # prefixos curtos não obriguem o banco a ordenar milhares de logradouros
+    encontrados = {}
+    for coluna, valor in buscas:
+        query = Logradouro.query.filter(filtro_prefixo(coluna, valor))
+        if cidade:
+            query = query.filter(Logradouro.chave_cidade == normalizar_texto(cidade))
+        for registro in query.order_by(coluna).limit(limite):
+            encontrados.setdefault(registro.id, registro)
+    
+    return sorted(encontrados.values(), key=lambda r: (r.chave_nome, r.cep))[:limite]
+
+def buscar_cep_local(cep_limpo):
+    """Resultado no formato do ViaCEP a partir da base local, ou None"""
+    registro = Logradouro.query.filter_by(cep=cep_limpo).first()
+    if registro is None:
+        return None
+    
+    resultado = registro.to_dict()
+    resultado['sucesso'] = True
+    return resultado
+
+def buscar_endereco_local(endereco):
+    """Resultado no formato do Nominatim a partir da base local, ou None.
+    
+    Só responde quando o logradouro é conhecido e tem coordenadas; o texto é
+    o mesmo montado por endereco_completo ("Rua, Bairro, Cidade - UF").
+    """
+    partes = [normalizar_texto(p) for p in re.split(r',|\s-\s', endereco) if p.strip()]
+    if not partes:
+        return None
+    
+    nome = re.sub(r'\s+\d+$', '', partes[0])  # ignorar o número da casa
+    query = Logradouro.query.filter(
+        Logradouro.latitude.isnot(None),
+        or_(Logradouro.chave == nome, Logradouro.chave_nome == nome_sem_tipo(nome))
+    )
+    
+    # Qualquer trecho depois do logradouro pode ser a cidade; só filtra se for uma cidade importada
+    trechos = [p for p in partes[1:] if len(p) > 2]
+    if trechos:
+        cidades = [c for (c,) in db.session.query(Logradouro.chave_cidade)
+                   .filter(Logradouro.chave_cidade.in_(trechos)).distinct()]
+        if cidades:
+            query = query.filter(Logradouro.chave_cidade.in_(cidades))
+    
+    registros = query.limit(5).all()
+    if not registros:
+        return None
+    
+    return {
+        'sucesso': True,
+        'resultados': [{
+            'endereco': r.endereco_completo,
+            'latitude': r.latitude,
+            'longitude': r.longitude,
+            'tipo': 'logradouro',
+            'importancia': 1
+        } for r in registros]
+    }
+
+# ===== BUSCA TEXTUAL =====
+
+# Documento indexado no PostgreSQL - a mesma expressão é usada no índice GIN e
+# nas consultas para que o planejador consiga aproveitar o índice
+DOCUMENTO_BUSCA_PG = (
+    "to_tsvector('pt_unaccent'::regconfig, "
+    "coalesce(title, '') || ' ' || coalesce(description, '') || ' ' || coalesce(address, ''))"
+)
+
+def configurar_busca_textual(reconstruir=False):
+    """Criar o índice de texto completo das propostas (FTS5 no SQLite, GIN no PostgreSQL)"""
+    dialeto = db.engine.dialect.name
+
+    try:
+        if dialeto == 'sqlite':
+            existente = db.session.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'proposal_fts'"
+            )).first()
+
+            # Tabela FTS5 com conteúdo externo: guarda apenas o índice, o texto fica em proposal.
+            # remove_diacritics permite buscar "iluminacao" e encontrar "Iluminação"
+            db.session.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS proposal_fts USING fts5("
+                "title, description, address, content='proposal', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2')"
+            ))
+
+            # Gatilhos mantêm o índice sincronizado em inserções, edições e exclusões
+            db.session.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS proposal_fts_ai AFTER INSERT ON proposal BEGIN "
+                "INSERT INTO proposal_fts(rowid, title, description, address) "
+                "VALUES (new.id, new.title, new.description, new.address); END"
+            ))
+            db.session.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS proposal_fts_ad AFTER DELETE ON proposal BEGIN "
+                "INSERT INTO proposal_fts(proposal_fts, rowid, title, description, address) "
+                "VALUES ('delete', old.id, old.title, old.description, old.address); END"
+            ))
+            db.session.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS proposal_fts_au AFTER UPDATE OF title, description, address ON proposal BEGIN "
+                "INSERT INTO proposal_fts(proposal_fts, rowid, title, description, address) "
+                "VALUES ('delete', old.id, old.title, old.description, old.address); "
+                "INSERT INTO proposal_fts(rowid, title, description, address) "
+                "VALUES (new.id, new.title, new.description, new.address); END"
+            ))
+
+            # Indexar propostas que já existiam antes da criação do índice
+            if reconstruir or not existente:
+                db.session.execute(text("INSERT INTO proposal_fts(proposal_fts) VALUES ('rebuild')"))
+
+        elif dialeto == 'postgresql':
+            # Configuração portuguesa sem acentos (unaccent + stemmer português)
+            db.session.execute(text("CREATE EXTENSION IF NOT EXISTS unaccent"))
+            db.session.execute(text(
+                "DO $$ BEGIN "
+                "IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'pt_unaccent') THEN "
+                "CREATE TEXT SEARCH CONFIGURATION pt_unaccent (COPY = portuguese); "
+                "ALTER TEXT SEARCH CONFIGURATION pt_unaccent "
+                "ALTER MAPPING FOR hword, hword_part, word WITH unaccent, portuguese_stem; "
+                "END IF; END $$"
+            ))
+            # Índice de expressão: o PostgreSQL o atualiza sozinho a cada INSERT/UPDATE
+            db.session.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_proposal_busca ON proposal USING GIN ({DOCUMENTO_BUSCA_PG})"
+            ))
+
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning(f'Não foi possível configurar a busca textual: {str(e)}')
+
+# Peso de cada coluna na relevância das buscas no SQLite
+PESOS_BUSCA_FTS = (('title', 10), ('address', 5), ('description', 1))
+
+def _ids_fts(expressao):
+    return select(literal_column('rowid')).select_from(text('proposal_fts'))\
+        .where(literal_column('proposal_fts').op('MATCH')(bindparam(None, expressao)))
+
+def aplicar_busca_textual(query, search):
+    """Filtrar propostas pelo índice de texto completo, ordenando por relevância.
+    
+    Retorna (query, relevancia): relevancia é a expressão da ordem, menor para
+    as propostas mais relevantes, ou None quando não há ranking. Ela depende
+    só do texto de cada proposta (nada de estatísticas do conjunto, como no
+    bm25), então serve de chave para a paginação por cursor.
+    """
+    # Apenas palavras: evita erros de sintaxe nas expressões FTS5/tsquery
+    termos = re.findall(r'\w+', search)
+    if not termos:
+        return query, None
+
+    dialeto = db.engine.dialect.name
+
+    if dialeto == 'sqlite':
+        # Busca por prefixo em cada termo para funcionar enquanto o usuário digita
+        expressao = ' '.join(f'"{termo}"*' for termo in termos)
+        # Cada termo soma o peso das colunas em que aparece: título e endereço valem mais que a descrição
+        relevancia = -sum(
+            case((Proposal.id.in_(_ids_fts(f'{coluna} : "{termo}"*')), peso), else_=0)
+            for termo in termos for coluna, peso in PESOS_BUSCA_FTS
+        )
+        query = query.filter(Proposal.id.in_(_ids_fts(expressao)))
+        return query.order_by(relevancia, Proposal.id.desc()), relevancia
+
+    if dialeto == 'postgresql':
+        expressao = ' & '.join(f'{termo}:*' for termo in termos)
+        documento = literal_column(DOCUMENTO_BUSCA_PG)
+        consulta = func.to_tsquery(literal_column("'pt_unaccent'::regconfig"), expressao)
+        # ts_rank (sem normalização) só olha o próprio documento
+        relevancia = -func.ts_rank(documento, consulta)
+
+        query = query.filter(documento.op('@@')(consulta))
+        return query.order_by(relevancia, Proposal.id.desc()), relevancia
+
+    # Outros bancos: busca simples por substring
+    return query.filter(
+        Proposal.title.contains(search) |
+        Proposal.description.contains(search) |
+        Proposal.address.contains(search)
+    ), None
+
+def filtrar_propostas(category='all', status='all', search='', priority='all', com_relevancia=False):
+    """Montar a query de propostas com os filtros da listagem.
+    
+    Com com_relevancia=True retorna (query, relevancia) para paginar_por_cursor.
+    """
+    # Autor e categoria vêm no mesmo SELECT - os cartões e a API usam ambos
+    query = Proposal.query.options(
+        joinedload(Proposal.author),
+        joinedload(Proposal.category_obj)
+    )
+
+    if category != 'all':
+        query = query.filter(Proposal.category == category)
+
+    if status != 'all':
+        query = query.filter(Proposal.status == status)
+
+    if priority != 'all':
+        query = query.filter(Proposal.priority == priority)
+
+    relevancia = None
+    if search:
+        query, relevancia = aplicar_busca_textual(query, search)
+
+    return (query, relevancia) if com_relevancia else query
+
+# ===== BUSCA GEOGRÁFICA =====
+
+RAIO_TERRA_KM = 6371.0088
+
+def configurar_indice_espacial(reconstruir=False):
+    """Criar o índice espacial das propostas (R*Tree no SQLite, GiST no PostgreSQL)"""
+    dialeto = db.engine.dialect.name
+
+    try:
+        if dialeto == 'sqlite':
+            existente = db.session.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'proposal_rtree'"
+            )).first()
+
+            # Cada proposta é um retângulo degenerado (ponto) no R*Tree
+            db.session.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS proposal_rtree "
+                "USING rtree(id, min_lat, max_lat, min_lng, max_lng)"
+            ))
+            db.session.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS proposal_rtree_ai AFTER INSERT ON proposal BEGIN "
+                "INSERT INTO proposal_rtree VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude); END"
+            ))
+            db.session.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS proposal_rtree_ad AFTER DELETE ON proposal BEGIN "
+                "DELETE FROM proposal_rtree WHERE id = old.id; END"
+            ))
+            db.session.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS proposal_rtree_au AFTER UPDATE OF latitude, longitude ON proposal BEGIN "
+                "UPDATE proposal_rtree SET min_lat = new.latitude, max_lat = new.latitude, "
+                "min_lng = new.longitude, max_lng = new.longitude WHERE id = new.id; END"
+            ))
+
+            if reconstruir or not existente:
+                db.session.execute(text("DELETE FROM proposal_rtree"))
+                db.session.execute(text(
+                    "INSERT INTO proposal_rtree SELECT id, latitude, latitude, longitude, longitude FROM proposal"
+                ))
+
+        elif dialeto == 'postgresql':
+            # Tipos geométricos nativos - não exige a extensão PostGIS
+            db.session.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_proposal_ponto ON proposal USING GIST (point(longitude, latitude))"
+            ))
+
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning(f'Não foi possível configurar o índice espacial: {str(e)}')
+
+def calcular_area(latitude, longitude, raio_km):
+    """Retângulo (lat_min, lat_max, lng_min, lng_max) que contém o círculo do raio.
+    
+    Usa a mesma esfera de distancia_haversine(): com outra medida do grau o
+    retângulo fica menor que o círculo e corta os pontos da borda.
+    """
+    angulo = raio_km / RAIO_TERRA_KM
+    delta_lat = math.degrees(angulo)
+    # Maior variação de longitude sobre o círculo; perto dos polos ele contém todas
+    seno = math.sin(min(angulo, math.pi / 2)) / max(math.cos(math.radians(latitude)), 1e-12)
+    delta_lng = math.degrees(math.asin(seno)) if seno < 1 else 180.0
+
+    return (latitude - delta_lat, latitude + delta_lat,
+            longitude - delta_lng, longitude + delta_lng)
+
+def filtrar_por_area(query, lat_min, lat_max, lng_min, lng_max):
+    """Restringir propostas a um retângulo usando o índice espacial do banco"""
+    dialeto = db.engine.dialect.name
+
+    if dialeto == 'sqlite':
+        area = text(
+            "SELECT id FROM proposal_rtree "
+            "WHERE max_lat >= :lat_min AND min_lat <= :lat_max "
+            "AND max_lng >= :lng_min AND min_lng <= :lng_max"
+        ).bindparams(lat_min=lat_min, lat_max=lat_max, lng_min=lng_min, lng_max=lng_max)\
+         .columns(id=db.Integer).subquery('area')
+
+        # O R*Tree guarda floats de 32 bits: a margem extra é removida pelo filtro exato abaixo
+        query = query.join(area, area.c.id == Proposal.id)
+
+    elif dialeto == 'postgresql':
+        ponto = func.point(Proposal.longitude, Proposal.latitude)
+        caixa = func.box(func.point(lng_min, lat_min), func.point(lng_max, lat_max))
+        query = query.filter(ponto.op('<@')(caixa))
+
+    return query.filter(
+        Proposal.latitude.between(lat_min, lat_max),
+        Proposal.longitude.between(lng_min, lng_max)
+    )
+
+def distancia_haversine(lat1, lng1, lat2, lng2):
+    """Distância em km entre dois pontos pela fórmula de Haversine"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    delta_phi = math.radians(lat2 - lat1)
+    delta_lambda = math.radians(lng2 - lng1)
+
+    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
+    return 2 * RAIO_TERRA_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def agrupar_propostas(query, zoom, tamanho_px=64):
+    """Agrupar propostas em células de grade para exibição em zoom baixo.
+    
+    A célula tem `tamanho_px` pixels no zoom pedido (um tile do Leaflet tem 256px
+    e cobre 360/2^zoom graus). A agregação é feita no banco, então o volume
+    devolvido depende do número de células e não do número de propostas.
+    """
+    celula = 360.0 / (2 ** zoom) * tamanho_px / 256
+
+    def indice_celula(coluna, deslocamento):
+        # Coordenadas deslocadas para valores positivos: no SQLite o CAST trunca como floor
+        valor = (coluna + deslocamento) / celula
+        if db.engine.dialect.name == 'sqlite':
+            return func.cast(valor, db.Integer)
+        return func.floor(valor)
+
+    celula_y = indice_celula(Proposal.latitude, 90).label('celula_y')
+    celula_x = indice_celula(Proposal.longitude, 180).label('celula_x')
+
+    linhas = query.order_by(None).with_entities(
+        celula_y,
+        celula_x,
+        Proposal.category,
+        Proposal.status,
+        func.count(Proposal.id),
+        func.sum(Proposal.latitude),
+        func.sum(Proposal.longitude)
+    ).group_by(celula_y, celula_x, Proposal.category, Proposal.status).all()
+
+    clusters = {}
+    for cy, cx, categoria, status, total, soma_lat, soma_lng in linhas:
+        cluster = clusters.setdefault((int(cy), int(cx)), {
+            'id': f'{zoom}:{int(cx)}:{int(cy)}',
+            'count': 0,
+            'soma_lat': 0.0,
+            'soma_lng': 0.0,
+            'por_categoria': {},
+            'por_status': {}
+        })
+        cluster['count'] += total
+        cluster['soma_lat'] += soma_lat
+        cluster['soma_lng'] += soma_lng
+        cluster['por_categoria'][categoria] = cluster['por_categoria'].get(categoria, 0) + total
+        cluster['por_status'][status] = cluster['por_status'].get(status, 0) + total
+
+    resultado = []
+    for cluster in clusters.values():
+        # Centroide das propostas da célula, não o centro geométrico da célula
+        cluster['latitude'] = cluster.pop('soma_lat') / cluster['count']
+        cluster['longitude'] = cluster.pop('soma_lng') / cluster['count']
+        resultado.append(cluster)
+
+    return resultado
+
+# ===== PAGINAÇÃO POR CURSOR =====
+
+def codificar_cursor(dados):
+    """Gerar cursor opaco (base64 de JSON) para a próxima requisição"""
+    bruto = json.dumps(dados, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(bruto).decode('ascii').rstrip('=')
+
+def decodificar_cursor(cursor):
+    """Ler um cursor gerado por codificar_cursor; ValueError se for inválido"""
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        dados = json.loads(bruto)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('Cursor inválido')
+
+    if not isinstance(dados, dict):
+        raise ValueError('Cursor inválido')
+    return dados
+
+def paginar_por_cursor(query, cursor=None, per_page=12, relevancia=None):
+    """Paginar propostas sem OFFSET nem COUNT, com o cursor na chave da ordem.
+    
+    Sem busca a ordem é (created_at, id) decrescente: novas propostas entram
+    sempre antes da primeira página. Em buscas (relevancia de
+    aplicar_busca_textual) a ordem é relevancia crescente e id decrescente; a
+    relevância de uma proposta não muda quando outras são inseridas, então os
+    cursores já entregues continuam válidos nos dois casos.
+    """
+    dados = decodificar_cursor(cursor) if cursor else {}
+    anterior = dados.get('d') == 'prev'
+
+    if relevancia is None:
+        chave, crescente = Proposal.created_at, False
+        ler_chave, gravar_chave = datetime.fromisoformat, datetime.isoformat
+    else:
+        chave, crescente = relevancia, True
+        ler_chave, gravar_chave = float, float
+
+    query = query.order_by(None).add_columns(chave)
+
+    if dados:
+        try:
+            valor = ler_chave(dados['c'])
+            proposal_id = int(dados['i'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('Cursor inválido')
+
+        # Empates na chave são desfeitos pelo id, sempre decrescente
+        depois, antes = (chave > valor, chave < valor) if crescente else (chave < valor, chave > valor)
+        if anterior:
+            query = query.filter(or_(antes, and_(chave == valor, Proposal.id > proposal_id)))
+        else:
+            query = query.filter(or_(depois, and_(chave == valor, Proposal.id < proposal_id)))
+
+    ordem = [chave.asc() if crescente else chave.desc(), Proposal.id.desc()]
+    ordem_inversa = [chave.desc() if crescente else chave.asc(), Proposal.id.asc()]
+
+    if anterior:
+        # Voltar uma página: percorrer na ordem inversa a partir do cursor e inverter
+        linhas = query.order_by(*ordem_inversa).limit(per_page + 1).all()
+        has_prev = len(linhas) > per_page
+        linhas = list(reversed(linhas[:per_page]))
+        has_next = True
+    else:
+        linhas = query.order_by(*ordem).limit(per_page + 1).all()
+        has_next = len(linhas) > per_page
+        linhas = linhas[:per_page]
+        has_prev = bool(dados)
+
+    next_cursor = prev_cursor = None
+    if linhas and has_next:
+        ultima, valor = linhas[-1]
+        next_cursor = codificar_cursor({'d': 'next', 'c': gravar_chave(valor), 'i': ultima.id})
+    if linhas and has_prev:
+        primeira, valor = linhas[0]
+        prev_cursor = codificar_cursor({'d': 'prev', 'c': gravar_chave(valor), 'i': primeira.id})
+
+    return {
+        'items': [proposta for proposta, _ in linhas],
+        'has_next': next_cursor is not None,
+        'has_prev': prev_cursor is not None,
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor
+    }
+
+def paginar_comentarios(proposal_id, cursor=None, per_page=20):
+    """Comentários de uma proposta do mais novo para o mais antigo, em ordem (created_at, id).
+    
+    Usa o índice ix_comment_proposal_created. Comentários novos entram antes da
+    primeira página, então o cursor continua válido enquanto chegam comentários.
+    Retorna (comentarios, next_cursor).
+    """
+    query = Comment.query.filter(Comment.proposal_id == proposal_id)
+
+    if cursor:
+        dados = decodificar_cursor(cursor)
+        try:
+            criado_em = datetime.fromisoformat(dados['c'])
+            comment_id = int(dados['i'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('Cursor inválido')
+
+        query = query.filter(or_(
+            Comment.created_at < criado_em,
+            and_(Comment.created_at == criado_em, Comment.id < comment_id)
+        ))
+
+    itens = query.order_by(Comment.created_at.desc(), Comment.id.desc()).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(itens) > per_page:
+        itens = itens[:per_page]
+        next_cursor = codificar_cursor({'c': itens[-1].created_at.isoformat(), 'i': itens[-1].id})
+
+    return itens, next_cursor
+
+def contar_aproximado(query, limite=1000):
+    """Contar propostas parando em `limite` - retorna (total, exato)"""
+    ids = query.order_by(None).with_entities(Proposal.id).limit(limite + 1).subquery()
+    total = db.session.query(func.count()).select_from(ids).scalar()
+    return min(total, limite), total <= limite
+
+# ===== FORMATO COLUNAR =====
+
+MIMETYPE_COLUNAR = 'application/vnd.meubairro.colunar+json'
+
+def colunas_compactas(*campos_texto):
+    """Colunas na ordem esperada por montar_colunas (texto opcional no final)"""
+    return (Proposal.id, Proposal.latitude, Proposal.longitude, Proposal.category,
+            Proposal.status, Proposal.priority, Proposal.votes_count, Proposal.comments_count,
+            *[getattr(Proposal, campo) for campo in campos_texto])
+
+def quer_formato_colunar():
+    """O cliente pediu o formato colunar (?formato=colunar ou cabeçalho Accept)"""
+    if request.args.get('formato') == 'colunar':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', MIMETYPE_COLUNAR]) == MIMETYPE_COLUNAR
+
+def montar_colunas(linhas, campos_texto=()):
+    """Converter linhas de colunas_compactas() em arrays por coluna.
+    
+    Categoria, status e prioridade viram índices inteiros nos dicionários
+    enviados junto; textos longos (descrição, endereço, autor) ficam de fora e
+    são buscados sob demanda em /api/proposals/<id>.
+    """
+    ids, lats, lngs, votos, comentarios = [], [], [], [], []
+    categorias, status, prioridades = {}, {}, {}
+    codigos_categoria, codigos_status, codigos_prioridade = [], [], []
+    textos = [[] for _ in campos_texto]
+
+    for linha in linhas:
+        ids.append(linha[0])
+        # 6 casas decimais ~ 10 cm, suficiente para o mapa
+        lats.append(round(linha[1], 6))
+        lngs.append(round(linha[2], 6))
+        codigos_categoria.append(categorias.setdefault(linha[3], len(categorias)))
+        codigos_status.append(status.setdefault(linha[4], len(status)))
+        codigos_prioridade.append(prioridades.setdefault(linha[5], len(prioridades)))
+        votos.append(linha[6])
+        comentarios.append(linha[7])
+        for coluna, valor in zip(textos, linha[8:]):
+            coluna.append(valor)
+
+    colunas = {
+        'id': ids,
+        'lat': lats,
+        'lng': lngs,
+        'category': codigos_categoria,
+        'status': codigos_status,
+        'priority': codigos_prioridade,
+        'votes_count': votos,
+        'comments_count': comentarios
+    }
+    colunas.update(zip(campos_texto, textos))
+
+    # 'quantidade' é o número de linhas enviadas; quem tiver o total da consulta acrescenta 'total'
+    return {
+        'formato': 'colunar',
+        'quantidade': len(ids),
+        'dicionarios': {
+            'category': list(categorias),
+            'status': list(status),
+            'priority': list(prioridades)
+        },
+        'colunas': colunas
+    }
+
+def codificar_json(dados):
+    """Serializar para bytes com orjson quando disponível"""
+    if orjson is not None:
+        return orjson.dumps(dados)
+    return json.dumps(dados, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def resposta_colunar(dados):
+    response = app.response_class(codificar_json(dados), mimetype=MIMETYPE_COLUNAR)
+    response.headers['Vary'] = 'Accept'
+    return response
+
+# ===== STREAMING NDJSON =====
+
+MIMETYPE_NDJSON = 'application/x-ndjson'
+
+def quer_ndjson():
+    """O cliente pediu NDJSON (?formato=ndjson ou cabeçalho Accept)"""
+    if request.args.get('formato') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', MIMETYPE_NDJSON]) == MIMETYPE_NDJSON
+
+def transmitir_ndjson(query, tamanho_lote=1000):
+    """Resposta NDJSON (uma proposta por linha) lida do banco em lotes.
+    
+    yield_per usa cursor do lado do servidor no PostgreSQL; assim a memória do
+    worker fica limitada ao lote atual, independente do tamanho da tabela.
+    """
+    linhas = query.order_by(None)\
+        .outerjoin(User, User.id == Proposal.author_id)\
+        .with_entities(
+            Proposal.id, Proposal.title, Proposal.description, Proposal.category,
+            Proposal.latitude, Proposal.longitude, Proposal.address, Proposal.status,
+            Proposal.priority, Proposal.votes_count, Proposal.comments_count,
+            User.name, Proposal.created_at, Proposal.updated_at
+        ).yield_per(tamanho_lote)
+
+    def gerar():
+        # Lido uma vez: o buffer só guarda as propostas votadas desde a última descarga
+        pendentes = votos_pendentes()
+        lote = []
+        for p in linhas:
+            lote.append(codificar_json({
+                'id': p.id,
+                'title': p.title,
+                'description': p.description,
+                'category': p.category,
+                'latitude': float(p.latitude),
+                'longitude': float(p.longitude),
+                'address': p.address,
+                'status': p.status,
+                'priority': p.priority,
+                'votes_count': max(0, p.votes_count + pendentes.get(p.id, 0)),
+                'comments_count': p.comments_count,
+                'author_name': p.name or 'Anônimo',
+                'created_at': p.created_at.isoformat(),
+                'updated_at': p.updated_at.isoformat()
+            }))
+            if len(lote) >= tamanho_lote:
+                yield b'\n'.join(lote) + b'\n'
+                lote = []
+        if lote:
+            yield b'\n'.join(lote) + b'\n'
+
+    return app.response_class(stream_with_context(gerar()), mimetype=MIMETYPE_NDJSON)
+
+# ===== EXPORTAÇÃO DE PROPOSTAS =====
+
+# formato -> (mimetype, extensão do arquivo)
+FORMATOS_EXPORTACAO = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': (MIMETYPE_NDJSON, 'jsonl'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet')
+}
+CAMPOS_EXPORTACAO = ('id', 'title', 'description', 'category', 'category_name', 'address',
+                     'latitude', 'longitude', 'status', 'priority', 'votes_count',
+                     'comments_count', 'author_name', 'created_at', 'updated_at')
+
+def formatos_exportacao_disponiveis():
+    return [formato for formato in FORMATOS_EXPORTACAO if formato != 'parquet' or pyarrow is not None]
+
+def lotes_exportacao(filtros, tamanho_lote=1000):
+    """Propostas filtradas em lotes de tuplas na ordem de CAMPOS_EXPORTACAO.
+    
+    yield_per mantém só um lote em memória (cursor do lado do servidor no
+    PostgreSQL); autor e categoria vêm no mesmo SELECT, sem consultas por linha.
+    """
+    linhas = filtrar_propostas_relatorio(filtros)\
+        .outerjoin(User, User.id == Proposal.author_id)\
+        .outerjoin(Category, Category.id == Proposal.category)\
+        .order_by(Proposal.id)\
+        .with_entities(
+            Proposal.id, Proposal.title, Proposal.description, Proposal.category, Category.name,
+            Proposal.address, Proposal.latitude, Proposal.longitude, Proposal.status,
+            Proposal.priority, Proposal.votes_count, Proposal.comments_count,
+            func.coalesce(User.name, 'Anônimo'), Proposal.created_at, Proposal.updated_at
+        ).yield_per(tamanho_lote)
+    
+    lote = []
+    for linha in linhas:
+        lote.append(tuple(linha))
+        if len(lote) >= tamanho_lote:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+def _texto_exportacao(valor):
+    return valor.isoformat() if isinstance(valor, datetime) else valor
+
+def exportar_csv(lotes):
+    saida = StringIO()
+    escritor = csv.writer(saida)
+    escritor.writerow(CAMPOS_EXPORTACAO)
+    # O cabeçalho sai antes da primeira consulta: o download começa na hora
+    yield saida.getvalue().encode('utf-8')
+    
+    for lote in lotes:
+        saida.seek(0)
+        saida.truncate()
+        escritor.writerows([_texto_exportacao(valor) for valor in linha] for linha in lote)
+        yield saida.getvalue().encode('utf-8')
+
+def exportar_jsonl(lotes):
+    for lote in lotes:
+        yield b''.join(
+            codificar_json({campo: _texto_exportacao(valor) for campo, valor in zip(CAMPOS_EXPORTACAO, linha)}) + b'\n'
+            for linha in lote
+        )
+
+class _SaidaEmPedacos:
+    """Arquivo só de escrita para o ParquetWriter; os bytes são recolhidos a cada lote"""
+    
+    def __init__(self):
+        self.pedacos = []
+        self.posicao = 0
+        self.closed = False
+    
+    def write(self, dados):
+        self.pedacos.append(bytes(dados))
+        self.posicao += len(dados)
+        return len(dados)
+    
+    def tell(self):
+        return self.posicao
+    
+    def writable(self):
+        return True
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        self.closed = True
+    
+    def recolher(self):
+        dados = b''.join(self.pedacos)
+        self.pedacos = []
+        return dados
+
+def exportar_parquet(lotes):
+    """Parquet com um row group por lote; só o rodapé (metadados) espera o fim"""
+    texto, inteiro, real = pyarrow.string(), pyarrow.int32(), pyarrow.float64()
+    tipos = {'id': pyarrow.int64(), 'latitude': real, 'longitude': real,
+             'votes_count': inteiro, 'comments_count': inteiro,
+             'created_at': pyarrow.timestamp('us'), 'updated_at': pyarrow.timestamp('us')}
+    esquema = pyarrow.schema([(campo, tipos.get(campo, texto)) for campo in CAMPOS_EXPORTACAO])
+    
+    saida = _SaidaEmPedacos()
+    escritor = pyarrow.parquet.ParquetWriter(saida, esquema)
+    for lote in lotes:
+        colunas = [pyarrow.array(valores, type=campo.type) for valores, campo in zip(zip(*lote), esquema)]
+        escritor.write_batch(pyarrow.record_batch(colunas, schema=esquema))
+        yield saida.recolher()
+    escritor.close()
+    yield saida.recolher()
+
+def resposta_exportacao(filtros, formato):
+    """Download das propostas filtradas gerado enquanto é enviado, com memória constante"""
+    mimetype, extensao = FORMATOS_EXPORTACAO[formato]
+    exportar = {'csv': exportar_csv, 'jsonl': exportar_jsonl, 'parquet': exportar_parquet}[formato]
+    
+    response = app.response_class(stream_with_context(exportar(lotes_exportacao(filtros))), mimetype=mimetype)
+    response.headers['Content-Disposition'] = \
+        f'attachment; filename="propostas_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extensao}"'
+    response.headers['Cache-Control'] = 'private, no-store'
+    # Nginx: repassar cada pedaço ao cliente sem acumular a resposta
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 # ===== ROTAS PRINCIPAIS =====
 
 @app.route('/')
 def index():
     """Página principal - lista de propostas"""
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     category = request.args.get('category', 'all')
     status = request.args.get('status', 'all')
     search = request.args.get('search', '')
     
     # Construir query
-    query = Proposal.query
+    query, relevancia = filtrar_propostas(category, status, search, com_relevancia=True)
     
-    if category != 'all':
-        query = query.filter(Proposal.category == category)
+    try:
+        pagina = paginar_por_cursor(query, cursor, per_page=12, relevancia=relevancia)
+    except ValueError:
+        pagina = paginar_por_cursor(query, None, per_page=12, relevancia=relevancia)
     
-    if status != 'all':
-        query = query.filter(Proposal.status == status)
+    aplicar_votos_pendentes(pagina['items'])
     
-    if search:
-        query = query.filter(
-            Proposal.title.contains(search) |
-            Proposal.description.contains(search) |
-            Proposal.address.contains(search)
-        )
+    voted_ids = set()
+    if current_user.is_authenticated:
+        voted_ids = votos_do_usuario(current_user.id, [p.id for p in pagina['items']])
     
-    proposals = query.order_by(Proposal.created_at.desc()).paginate(
-        page=page, per_page=12, error_out=False
-    )
+    # "Carregar mais": devolver apenas os cartões da próxima página
+    if request.args.get('parcial'):
+        return render_template('proposals/_cards.html',
+                             proposals=pagina['items'],
+                             voted_ids=voted_ids,
+                             next_cursor=pagina['next_cursor'],
+                             parcial=True)
     
+    total, total_exato = contar_aproximado(query)
     categories = Category.query.all()
     
     return render_template('index.html', 
-                         proposals=proposals, 
+                         proposals=pagina['items'], 
+                         voted_ids=voted_ids,
+                         next_cursor=pagina['next_cursor'],
+                         total=total,
+                         total_exato=total_exato,
                          categories=categories,
                          current_category=category,
                          current_status=status,
@@ -269,7 +1760,7 @@ def index():
 @app.route('/mapa')
 def mapa():
     """Página do mapa interativo"""
-    proposals = Proposal.query.all()
+    # As propostas são carregadas pelo mapa via /api/map-proposals
     categories_raw = Category.query.all()
     
     # Converter categorias para dicionários antes de passar para o template
@@ -280,47 +1771,28 @@ def mapa():
         'color': cat.color
     } for cat in categories_raw]
     
-    return render_template('mapa.html', proposals=proposals, categories=categories)
+    return render_template('mapa.html', categories=categories)
 
 @app.route('/dashboard')
 @login_required
 def dashboard():
     """Dashboard com relatórios"""
-    total_proposals = Proposal.query.count()
-    
-    # Converter lista de tuplas em dicionário com valores padrão
-    proposals_by_status_raw = db.session.query(
-        Proposal.status, 
-        db.func.count(Proposal.id)
-    ).group_by(Proposal.status).all()
-    
-    # Inicializar com valores padrão
-    proposals_by_status = {
-        'pending': 0,
-        'approved': 0,
-        'in_progress': 0,
-        'completed': 0,
-        'rejected': 0
-    }
-    
-    # Atualizar com valores reais do banco
-    for status, count in proposals_by_status_raw:
-        proposals_by_status[status] = count
+    resumo = resumo_estatisticas()
     
-    # Categorias - converter para dicionário
-    proposals_by_category_raw = db.session.query(
-        Category.name,
-        db.func.count(Proposal.id)
-    ).join(Proposal).group_by(Category.name).all()
-    proposals_by_category = dict(proposals_by_category_raw)
+    # Categorias - nome -> total de propostas
+    proposals_by_category = {}
+    for category in Category.query.order_by(Category.id):
+        total = sum(resumo['por_categoria'].get(category.id, {}).values())
+        if total:
+            proposals_by_category[category.name] = total
     
     recent_proposals = Proposal.query.order_by(
         Proposal.created_at.desc()
     ).limit(5).all()
     
     return render_template('dashboard.html',
-                         total_proposals=total_proposals,
-                         proposals_by_status=proposals_by_status,
+                         total_proposals=resumo['total_propostas'],
+                         proposals_by_status=resumo['por_status'],
                          proposals_by_category=proposals_by_category,
                          recent_proposals=recent_proposals)
 
@@ -328,15 +1800,10 @@ def dashboard():
 def proposta_detalhes(id):
     """Página de detalhes de uma proposta"""
     proposal = Proposal.query.get_or_404(id)
+    aplicar_votos_pendentes([proposal])
     
-    # Buscar todos os comentários da proposta
-    comments = Comment.query.filter_by(proposal_id=id).order_by(Comment.created_at.desc()).all()
-    
-    # Sincronizar contador de comentários com a contagem real
-    real_comments_count = Comment.query.filter_by(proposal_id=id).count()
-    if proposal.comments_count != real_comments_count:
-        proposal.comments_count = real_comments_count
-        db.session.commit()
+    # Só a primeira página de comentários; o restante vem de /api/proposals/<id>/comments
+    comments, comments_cursor = paginar_comentarios(id)
     
     # Verificar se o usuário já votou
     user_voted = False
@@ -350,6 +1817,7 @@ def proposta_detalhes(id):
     return render_template('proposta_detalhes.html',
                          proposal=proposal,
                          comments=comments,
+                         comments_cursor=comments_cursor,
                          user_voted=user_voted)
 
 # ===== AUTENTICAÇÃO =====
@@ -448,29 +1916,393 @@ def criar_proposta():
     categories = Category.query.all()
     return render_template('proposals/criar.html', categories=categories)
 
-@app.route('/votar/<int:proposal_id>', methods=['POST'])
-@login_required
-def votar(proposal_id):
-    try:
-        proposal = Proposal.query.get_or_404(proposal_id)
+# ===== CONTADORES DESNORMALIZADOS =====
+
+# comments_count e votes_count são ajustados no mesmo flush que grava o comentário/voto;
+# páginas de leitura nunca recontam nem gravam
+def _ajustar_contador(connection, coluna, proposal_id, delta):
+    atual = getattr(Proposal, coluna)
+    connection.execute(
+        Proposal.__table__.update()
+        .where(Proposal.id == proposal_id)
+        .values({coluna: case((atual + delta < 0, 0), else_=atual + delta)})
+    )
+
+@event.listens_for(Comment, 'after_insert')
+def contar_comentario_inserido(mapper, connection, comment):
+    _ajustar_contador(connection, 'comments_count', comment.proposal_id, 1)
+
+@event.listens_for(Comment, 'after_delete')
+def contar_comentario_removido(mapper, connection, comment):
+    _ajustar_contador(connection, 'comments_count', comment.proposal_id, -1)
+
+# alternar_voto() usa SQL direto e ajusta votes_count por conta própria;
+# estes eventos cobrem votos gravados ou removidos pelo ORM
+@event.listens_for(Vote, 'after_insert')
+def contar_voto_inserido(mapper, connection, vote):
+    _ajustar_contador(connection, 'votes_count', vote.proposal_id, 1)
+
+@event.listens_for(Vote, 'after_delete')
+def contar_voto_removido(mapper, connection, vote):
+    _ajustar_contador(connection, 'votes_count', vote.proposal_id, -1)
+
+# Propostas raramente mudam de categoria/status, então manter esta tabela é
+# barato e os relatórios não precisam varrer a tabela de propostas
+def _somar_estatistica(connection, category, status, delta):
+    inserir = pg_insert if connection.dialect.name == 'postgresql' else sqlite_insert
+    tabela = EstatisticaProposta.__table__
+    connection.execute(
+        inserir(tabela)
+        .values(category=category, status=status, total=delta)
+        .on_conflict_do_update(index_elements=['category', 'status'],
+                               set_={'total': tabela.c.total + delta})
+    )
+
+@event.listens_for(Proposal, 'after_insert')
+def contar_proposta_inserida(mapper, connection, proposal):
+    _somar_estatistica(connection, proposal.category, proposal.status, 1)
+
+@event.listens_for(Proposal, 'after_delete')
+def contar_proposta_removida(mapper, connection, proposal):
+    _somar_estatistica(connection, proposal.category, proposal.status, -1)
+
+@event.listens_for(Proposal, 'after_update')
+def contar_proposta_alterada(mapper, connection, proposal):
+    estado = inspect(proposal)
+    categoria = estado.attrs.category.history
+    status = estado.attrs.status.history
+    if not (categoria.has_changes() or status.has_changes()):
+        return
+    
+    categoria_antiga = (categoria.deleted or [proposal.category])[0]
+    status_antigo = (status.deleted or [proposal.status])[0]
+    _somar_estatistica(connection, categoria_antiga, status_antigo, -1)
+    _somar_estatistica(connection, proposal.category, proposal.status, 1)
+
+def reconstruir_estatisticas():
+    """Recalcular EstatisticaProposta a partir da tabela de propostas"""
+    EstatisticaProposta.query.delete()
+    db.session.execute(
+        EstatisticaProposta.__table__.insert().from_select(
+            ['category', 'status', 'total'],
+            select(Proposal.category, Proposal.status, func.count())
+            .group_by(Proposal.category, Proposal.status)
+        )
+    )
+    db.session.commit()
+
+def resumo_estatisticas():
+    """Totais gerais em duas consultas, independente do tamanho das tabelas.
+    
+    As contagens por categoria/status vêm de EstatisticaProposta; usuários,
+    comentários e votos são COUNT(*) simples, que o banco responde pelo menor
+    índice de cada tabela.
+    """
+    por_status = dict.fromkeys(('pending', 'approved', 'in_progress', 'completed', 'rejected'), 0)
+    por_categoria = {}
+    for linha in EstatisticaProposta.query.filter(EstatisticaProposta.total > 0):
+        por_status[linha.status] = por_status.get(linha.status, 0) + linha.total
+        por_categoria.setdefault(linha.category, {})[linha.status] = linha.total
+    
+    total_usuarios, total_comentarios, total_votos = db.session.query(
+        select(func.count()).select_from(User).scalar_subquery(),
+        select(func.count()).select_from(Comment).scalar_subquery(),
+        select(func.count()).select_from(Vote).scalar_subquery()
+    ).one()
+    
+    return {
+        'total_propostas': sum(por_status.values()),
+        'por_status': por_status,
+        'por_categoria': por_categoria,
+        'total_usuarios': total_usuarios,
+        'total_comentarios': total_comentarios,
+        'total_votos': total_votos
+    }
+
+def reconciliar_contadores():
+    """Corrigir em lote os contadores que divergirem das tabelas de comentários e votos.
+    
+    Também reconstrói EstatisticaProposta. Retorna quantas propostas foram
+    corrigidas em cada contador.
+    """
+    # Com write-behind, nenhum voto pode estar entre o commit e o registro do
+    # delta durante a recontagem, nem uma descarga em andamento: o voto seria
+    # contado pela recontagem e de novo quando o delta chegasse ao contador
+    with trava_contadores_votos(exclusiva=True):
+        if app.config['VOTOS_WRITE_BEHIND']:
+            _descarregar_votos()
         
-        existing_vote = Vote.query.filter_by(
-            proposal_id=proposal_id,
-            user_id=current_user.id
+        corrigidas = {}
+        for coluna, modelo in (('comments_count', Comment), ('votes_count', Vote)):
+            real = select(func.count()).where(modelo.proposal_id == Proposal.id).scalar_subquery()
+            resultado = db.session.execute(
+                Proposal.__table__.update()
+                .where(func.coalesce(getattr(Proposal, coluna), -1) != real)
+                .values({coluna: real})
+            )
+            corrigidas[coluna] = resultado.rowcount
+        
+        db.session.commit()
+    
+    reconstruir_estatisticas()
+    return corrigidas
+
+@app.cli.command('reconciliar-contadores')
+def comando_reconciliar_contadores():
+    """Recontar comments_count, votes_count e as estatísticas por categoria/status"""
+    corrigidas = reconciliar_contadores()
+    click.echo(f"Comentários: {corrigidas['comments_count']} propostas corrigidas")
+    click.echo(f"Votos: {corrigidas['votes_count']} propostas corrigidas")
+
+# ===== CONTADOR DE VOTOS (WRITE-BEHIND) =====
+
+# O buffer é um arquivo SQLite separado (WAL), compartilhado pelos workers da máquina,
+# para que votos numa proposta popular não disputem a linha dela no banco principal
+_buffer_votos = threading.local()
+_descarga_votos_pid = None
+_descarga_votos_lock = threading.Lock()
+
+def conexao_buffer_votos():
+    """Conexão com o buffer de votos pendentes (uma por thread e por processo)"""
+    conexao = getattr(_buffer_votos, 'conexao', None)
+    if conexao is None or _buffer_votos.pid != os.getpid():
+        caminho = app.config['VOTOS_BUFFER_PATH']
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        conexao = sqlite3.connect(caminho, timeout=10, isolation_level=None)
+        conexao.execute('PRAGMA journal_mode=WAL')
+        conexao.execute('PRAGMA synchronous=NORMAL')
+        conexao.execute(
+            'CREATE TABLE IF NOT EXISTS votos_pendentes '
+            '(proposal_id INTEGER PRIMARY KEY, delta INTEGER NOT NULL)'
+        )
+        _buffer_votos.conexao = conexao
+        _buffer_votos.pid = os.getpid()
+    return conexao
+
+@contextmanager
+def trava_contadores_votos(exclusiva=False):
+    """Lock entre os processos da máquina: votos e descargas compartilham, a recontagem é exclusiva.
+    
+    Sem write-behind não há buffer e o lock não é necessário. Sem fcntl
+    (Windows) a recontagem não é protegida contra votos simultâneos.
+    """
+    if fcntl is None or not app.config['VOTOS_WRITE_BEHIND']:
+        yield
+        return
+    
+    caminho = f"{app.config['VOTOS_BUFFER_PATH']}.lock"
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    with open(caminho, 'a') as trava:
+        fcntl.flock(trava, fcntl.LOCK_EX if exclusiva else fcntl.LOCK_SH)
+        yield
+
+def registrar_delta_voto(proposal_id, delta):
+    """Acumular um +1/-1 no buffer; a thread de descarga aplica no banco depois"""
+    conexao_buffer_votos().execute(
+        'INSERT INTO votos_pendentes (proposal_id, delta) VALUES (?, ?) '
+        'ON CONFLICT(proposal_id) DO UPDATE SET delta = delta + excluded.delta',
+        (proposal_id, delta)
+    )
+    iniciar_descarga_votos()
+
+def votos_pendentes(ids=None):
+    """Deltas ainda não aplicados em votes_count, por proposta.
+    
+    Sem ids devolve o buffer inteiro, que só tem as propostas votadas desde a
+    última descarga; usado nas respostas que listam o mapa todo.
+    """
+    if not app.config['VOTOS_WRITE_BEHIND']:
+        return {}
+    if ids is not None:
+        ids = list(ids)
+        if not ids:
+            return {}
+    
+    try:
+        if ids is None:
+            return dict(conexao_buffer_votos().execute(
+                'SELECT proposal_id, delta FROM votos_pendentes'
+            ).fetchall())
+        marcadores = ', '.join('?' * len(ids))
+        return dict(conexao_buffer_votos().execute(
+            f'SELECT proposal_id, delta FROM votos_pendentes WHERE proposal_id IN ({marcadores})', ids
+        ).fetchall())
+    except sqlite3.Error as e:
+        app.logger.warning(f'Não foi possível ler o buffer de votos: {str(e)}')
+        return {}
+
+def aplicar_votos_pendentes(propostas):
+    """Somar os deltas pendentes ao votes_count carregado, sem marcar as propostas como alteradas.
+    
+    O delta somado fica guardado na proposta até ela ser recarregada do banco,
+    então chamar de novo na mesma sessão não soma o mesmo voto duas vezes.
+    """
+    pendentes = votos_pendentes(p.id for p in propostas)
+    for proposta in propostas:
+        # Ler votes_count primeiro: se estiver expirado, o recarregamento zera o delta guardado
+        votes_count = proposta.votes_count or 0
+        anterior = proposta.__dict__.get('_delta_votos', 0)
+        delta = pendentes.get(proposta.id, 0)
+        if delta != anterior:
+            set_committed_value(proposta, 'votes_count', max(0, votes_count - anterior + delta))
+            proposta.__dict__['_delta_votos'] = delta
+    return propostas
+
+@event.listens_for(Proposal, 'load')
+@event.listens_for(Proposal, 'refresh')
+def esquecer_delta_votos(proposta, context, atributos=None):
+    """votes_count recarregado do banco não inclui mais o delta somado antes"""
+    # Cargas parciais (ex.: colunas ainda não lidas de uma proposta já na sessão) não mexem em votes_count
+    if atributos is None or 'votes_count' in atributos:
+        proposta.__dict__.pop('_delta_votos', None)
+
+def aplicar_votos_pendentes_colunas(resposta):
+    """O mesmo que aplicar_votos_pendentes() para uma resposta de montar_colunas()"""
+    pendentes = votos_pendentes()
+    if pendentes:
+        colunas = resposta['colunas']
+        colunas['votes_count'] = [max(0, votos + pendentes.get(proposta_id, 0))
+                                  for proposta_id, votos in zip(colunas['id'], colunas['votes_count'])]
+    return resposta
+
+def descarregar_votos():
+    """Aplicar todos os deltas do buffer em Proposal.votes_count numa única transação.
+    
+    O buffer fica travado (BEGIN IMMEDIATE) até o banco principal confirmar a
+    atualização, e só então os deltas são apagados: descargas de workers
+    diferentes acontecem uma de cada vez, na ordem em que os votos chegaram, e
+    se o banco principal falhar os deltas continuam no buffer.
+    """
+    with trava_contadores_votos():
+        return _descarregar_votos()
+
+def _descarregar_votos():
+    conexao = conexao_buffer_votos()
+    conexao.execute('BEGIN IMMEDIATE')
+    try:
+        deltas = conexao.execute('SELECT proposal_id, delta FROM votos_pendentes WHERE delta != 0').fetchall()
+        if deltas:
+            # Sem piso em zero: o -1 de um voto pode chegar ao buffer antes do +1
+            # (duas abas do mesmo usuário), e a soma só fecha se nada for descartado
+            db.session.execute(
+                Proposal.__table__.update()
+                .where(Proposal.id == bindparam('b_id'))
+                .values(votes_count=Proposal.votes_count + bindparam('b_delta')),
+                [{'b_id': proposal_id, 'b_delta': delta} for proposal_id, delta in deltas]
+            )
+            db.session.commit()
+        conexao.execute('DELETE FROM votos_pendentes')
+        conexao.execute('COMMIT')
+    except Exception:
+        db.session.rollback()
+        conexao.execute('ROLLBACK')
+        raise
+    
+    return len(deltas)
+
+def _laco_descarga_votos():
+    while True:
+        time.sleep(app.config['VOTOS_FLUSH_INTERVALO'])
+        _descarregar_votos_com_contexto()
+
+def _descarregar_votos_com_contexto():
+    with app.app_context():
+        try:
+            descarregar_votos()
+        except Exception as e:
+            app.logger.warning(f'Erro ao descarregar votos pendentes: {str(e)}')
+        finally:
+            db.session.remove()
+
+def iniciar_descarga_votos():
+    """Subir a thread de descarga neste processo (após o fork de cada worker do gunicorn)"""
+    global _descarga_votos_pid
+    if _descarga_votos_pid == os.getpid():
+        return
+    with _descarga_votos_lock:
+        if _descarga_votos_pid == os.getpid():
+            return
+        _descarga_votos_pid = os.getpid()
+        threading.Thread(target=_laco_descarga_votos, name='descarga-votos', daemon=True).start()
+        atexit.register(_descarregar_votos_com_contexto)
+
+def alternar_voto(proposal_id, user_id):
+    """Votar ou retirar o voto de forma atômica, sem ler-modificar-gravar em Python.
+    
+    DELETE ... RETURNING e INSERT ... ON CONFLICT DO NOTHING RETURNING dizem
+    quem realmente mudou a tabela de votos; só então votes_count é ajustado
+    com UPDATE votes_count = votes_count ± 1, na mesma transação curta.
+    Com VOTOS_WRITE_BEHIND o voto é gravado na hora, mas o ajuste do contador
+    vai para o buffer de votos pendentes. Retorna (votou, votes_count).
+    """
+    # O voto e o registro do delta no buffer não podem ser separados pela recontagem
+    with trava_contadores_votos():
+        removido = db.session.execute(
+            Vote.__table__.delete()
+            .where(Vote.proposal_id == proposal_id, Vote.user_id == user_id)
+            .returning(Vote.id)
         ).first()
         
-        if existing_vote:
-            db.session.delete(existing_vote)
-            proposal.votes_count = max(0, proposal.votes_count - 1)
-            voted = False
+        if removido is not None:
+            votou = False
+            ajuste = -1
+        else:
+            inserir = pg_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+            inserido = db.session.execute(
+                inserir(Vote.__table__)
+                .values(proposal_id=proposal_id, user_id=user_id)
+                .on_conflict_do_nothing(index_elements=['proposal_id', 'user_id'])
+                .returning(Vote.id)
+            ).first()
+            votou = True
+            # Sem linha inserida: uma requisição simultânea do mesmo usuário já votou
+            ajuste = 1 if inserido is not None else 0
+        
+        if ajuste and app.config['VOTOS_WRITE_BEHIND']:
+            db.session.commit()
+            try:
+                registrar_delta_voto(proposal_id, ajuste)
+                proposta = db.session.get(Proposal, proposal_id)
+                return votou, aplicar_votos_pendentes([proposta])[0].votes_count
+            except sqlite3.Error as e:
+                # Buffer indisponível: ajustar o contador diretamente
+                app.logger.warning(f'Buffer de votos indisponível: {str(e)}')
+        
+        if ajuste:
+            votes_count = db.session.execute(
+                Proposal.__table__.update()
+                .where(Proposal.id == proposal_id)
+                .values(votes_count=case((Proposal.votes_count + ajuste < 0, 0),
+                                         else_=Proposal.votes_count + ajuste))
+                .returning(Proposal.votes_count)
+            ).scalar()
         else:
-            vote = Vote(proposal_id=proposal_id, user_id=current_user.id)
-            db.session.add(vote)
-            proposal.votes_count += 1
-            voted = True
+            votes_count = db.session.query(Proposal.votes_count).filter_by(id=proposal_id).scalar()
+            votes_count += votos_pendentes([proposal_id]).get(proposal_id, 0)
         
         db.session.commit()
-        return jsonify({'success': True, 'voted': voted, 'votes_count': proposal.votes_count})
+        return votou, votes_count
+
+def votos_do_usuario(user_id, proposal_ids=None):
+    """IDs das propostas (entre proposal_ids, ou todas) em que o usuário votou, numa consulta só"""
+    query = db.session.query(Vote.proposal_id).filter(Vote.user_id == user_id)
+    if proposal_ids is not None:
+        proposal_ids = list(proposal_ids)
+        if not proposal_ids:
+            return set()
+        query = query.filter(Vote.proposal_id.in_(proposal_ids))
+    return {proposal_id for (proposal_id,) in query}
+
+@app.route('/votar/<int:proposal_id>', methods=['POST'])
+@login_required
+def votar(proposal_id):
+    if db.session.query(Proposal.id).filter_by(id=proposal_id).first() is None:
+        abort(404)
+    
+    try:
+        voted, votes_count = alternar_voto(proposal_id, current_user.id)
+        publicar_evento_proposta(proposal_id, 'voto', {'proposal_id': proposal_id, 'votes_count': votes_count})
+        return jsonify({'success': True, 'voted': voted, 'votes_count': votes_count})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': f'Erro ao votar: {str(e)}'}), 500
@@ -493,23 +2325,20 @@ def comentar(proposal_id):
             content=content.strip()
         )
         
+        # comments_count é incrementado pelo evento after_insert de Comment
         db.session.add(comment)
-        db.session.flush()  # Garante que o comentário tenha ID antes de contar
-        
-        # Recalcular contador de comentários baseado na contagem real
-        proposal.comments_count = Comment.query.filter_by(proposal_id=proposal_id).count()
-        
         db.session.commit()
         
+        publicar_evento_proposta(proposal_id, 'comentario', {
+            'proposal_id': proposal_id,
+            'comment': comment.to_dict(),
+            'comments_count': proposal.comments_count
+        })
+        
         return jsonify({
             'success': True, 
             'message': 'Comentário adicionado com sucesso!',
-            'comment': {
-                'id': comment.id,
-                'content': comment.content,
-                'author_name': comment.author_name,
-                'created_at': comment.created_at.isoformat()
-            },
+            'comment': comment.to_dict(),
             'comments_count': proposal.comments_count
         })
     except Exception as e:
@@ -526,88 +2355,652 @@ def api_proposals():
     status = request.args.get('status', 'all')
     search = request.args.get('search', '')
     
-    query = Proposal.query
+    query, relevancia = filtrar_propostas(category, status, search, com_relevancia=True)
     
-    if category != 'all':
-        query = query.filter(Proposal.category == category)
+    # Modo cursor (?cursor= na primeira página): sem OFFSET e sem COUNT(*)
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        try:
+            pagina = paginar_por_cursor(query, cursor, per_page=12, relevancia=relevancia)
+        except ValueError:
+            return jsonify({'erro': 'Cursor inválido'}), 400
+        
+        aplicar_votos_pendentes(pagina['items'])
+        
+        if quer_formato_colunar():
+            linhas = [(p.id, p.latitude, p.longitude, p.category, p.status, p.priority,
+                       p.votes_count, p.comments_count, p.title) for p in pagina['items']]
+            resposta = montar_colunas(linhas, campos_texto=('title',))
+        else:
+            resposta = {'proposals': [p.to_dict() for p in pagina['items']]}
+        
+        resposta.update({
+            'next_cursor': pagina['next_cursor'],
+            'prev_cursor': pagina['prev_cursor'],
+            'has_next': pagina['has_next'],
+            'has_prev': pagina['has_prev']
+        })
+        
+        # Total aproximado apenas quando solicitado (?total=1)
+        if request.args.get('total', 0, type=int):
+            total, total_exato = contar_aproximado(query)
+            resposta['approximate_total'] = total
+            resposta['total_is_exact'] = total_exato
+        
+        if quer_formato_colunar():
+            return resposta_colunar(resposta)
+        return jsonify(resposta)
+    
+    proposals = query.order_by(Proposal.created_at.desc()).paginate(
+        page=page, per_page=12, error_out=False
+    )
+    aplicar_votos_pendentes(proposals.items)
+    
+    if quer_formato_colunar():
+        linhas = [(p.id, p.latitude, p.longitude, p.category, p.status, p.priority,
+                   p.votes_count, p.comments_count, p.title) for p in proposals.items]
+        resposta = montar_colunas(linhas, campos_texto=('title',))
+        resposta.update({
+            'total': proposals.total,
+            'pages': proposals.pages,
+            'current_page': proposals.page,
+            'has_next': proposals.has_next,
+            'has_prev': proposals.has_prev
+        })
+        return resposta_colunar(resposta)
+    
+    return jsonify({
+        'proposals': [{
+            'id': p.id,
+            'title': p.title,
+            'description': p.description,
+            'category': p.category,
+            'latitude': float(p.latitude),
+            'longitude': float(p.longitude),
+            'address': p.address,
+            'status': p.status,
+            'priority': p.priority,
+            'votes_count': p.votes_count,
+            'comments_count': p.comments_count,
+            'author_name': p.author.name,
+            'created_at': p.created_at.isoformat(),
+            'updated_at': p.created_at.isoformat()
+        } for p in proposals.items],
+        'total': proposals.total,
+        'pages': proposals.pages,
+        'current_page': proposals.page,
+        'has_next': proposals.has_next,
+        'has_prev': proposals.has_prev
+    })
+
+@app.route('/api/meus-votos')
+def api_meus_votos():
+    """Propostas em que o usuário logado votou, como lista ordenada de IDs.
+    
+    ?ids=1,2,3 limita a consulta a uma página de propostas. A resposta muda
+    apenas quando o usuário vota, então o navegador pode guardá-la e
+    revalidar pelo ETag.
+    """
+    proposal_ids = None
+    if request.args.get('ids'):
+        try:
+            proposal_ids = [int(i) for i in request.args['ids'].split(',') if i][:1000]
+        except ValueError:
+            return jsonify({'erro': 'ids deve ser uma lista de números separados por vírgula'}), 400
+    
+    ids = []
+    if current_user.is_authenticated:
+        ids = sorted(votos_do_usuario(current_user.id, proposal_ids))
+    
+    user_id = current_user.id if current_user.is_authenticated else 0
+    etag = hashlib.sha1(f'{user_id}:{ids}'.encode()).hexdigest()
+    
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = jsonify({'ids': ids})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Vary'] = 'Cookie'
+    return response
+
+@app.route('/api/categories')
+def api_categories():
+    """API para listar categorias"""
+    categories = Category.query.all()
+    return jsonify([{
+        'id': c.id,
+        'name': c.name,
+        'icon': c.icon,
+        'color': c.color
+    } for c in categories])
+
+@app.route('/api/map-proposals')
+def api_map_proposals():
+    """API específica para o mapa.
+    
+    Sem parâmetros retorna todas as propostas. Com ?bbox=oeste,sul,leste,norte
+    retorna apenas a área visível e, abaixo de MAP_CLUSTER_ZOOM (?zoom=),
+    agrupamentos com contagem por categoria e status. Com ?formato=ndjson as
+    propostas são transmitidas uma por linha, sem agrupamento.
+    """
+    category = request.args.get('category', 'all')
+    status = request.args.get('status', 'all')
+    priority = request.args.get('priority', 'all')
+    search = request.args.get('search', '')
+    bbox = request.args.get('bbox')
+    zoom = request.args.get('zoom', type=int)
+    
+    query = filtrar_propostas(category, status, search, priority)
+    
+    if bbox:
+        try:
+            oeste, sul, leste, norte = [float(valor) for valor in bbox.split(',')]
+        except ValueError:
+            return jsonify({'erro': 'bbox deve ser oeste,sul,leste,norte'}), 400
+        query = filtrar_por_area(query, sul, norte, oeste, leste)
+    
+    if quer_ndjson():
+        return transmitir_ndjson(query)
+    
+    if zoom is not None and zoom < app.config['MAP_CLUSTER_ZOOM']:
+        clusters = agrupar_propostas(query, zoom)
+        return jsonify({
+            'modo': 'clusters',
+            'clusters': clusters,
+            'total': sum(cluster['count'] for cluster in clusters)
+        })
+    
+    if quer_formato_colunar():
+        # Apenas as colunas usadas pelos marcadores, sem carregar objetos do ORM
+        linhas = query.order_by(None).with_entities(*colunas_compactas()).all()
+        resposta = aplicar_votos_pendentes_colunas(montar_colunas(linhas))
+        resposta['modo'] = 'pontos'
+        resposta['total'] = resposta['quantidade']  # sem paginação: todas as propostas do filtro
+        return resposta_colunar(resposta)
+    
+    proposals = aplicar_votos_pendentes(query.all())
+    return jsonify({
+        'modo': 'pontos',
+        'proposals': [{
+            'id': p.id,
+            'title': p.title,
+            'description': p.description,
+            'category': p.category,
+            'latitude': float(p.latitude),
+            'longitude': float(p.longitude),
+            'address': p.address,
+            'status': p.status,
+            'priority': p.priority,
+            'votes_count': p.votes_count,
+            'comments_count': p.comments_count,
+            'author_name': p.author.name if p.author else 'Anônimo',
+            'created_at': p.created_at.isoformat(),
+            'updated_at': p.updated_at.isoformat()
+        } for p in proposals],
+        'total': len(proposals)
+    })
+
+# ===== TILES DO MAPA =====
+
+TILE_ZOOM_MAXIMO = 20
+LATITUDE_MAXIMA_MERCATOR = 85.05112878
+
+def limites_tile(z, x, y):
+    """Retângulo (lat_min, lat_max, lng_min, lng_max) de um tile XYZ (Web Mercator)"""
+    n = 2 ** z
+    lng_min = x / n * 360.0 - 180.0
+    lng_max = (x + 1) / n * 360.0 - 180.0
+    lat_max = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    lat_min = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return lat_min, lat_max, lng_min, lng_max
+
+def tile_do_ponto(latitude, longitude, z):
+    """Coordenadas (x, y) do tile que contém o ponto no zoom z"""
+    n = 2 ** z
+    latitude = max(-LATITUDE_MAXIMA_MERCATOR, min(LATITUDE_MAXIMA_MERCATOR, latitude))
+    lat_rad = math.radians(latitude)
+    x = int((longitude + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(lat_rad)) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+def caminho_tile(z, x, y):
+    return os.path.join(app.config['TILE_CACHE_DIR'], str(z), str(x), str(y))
+
+def gerar_tile(z, x, y, category='all', status='all', priority='all', search=''):
+    """Montar o GeoJSON de um tile: agrupamentos em zoom baixo, pontos a partir de MAP_CLUSTER_ZOOM"""
+    query = filtrar_propostas(category, status, search, priority)
+    query = filtrar_por_area(query, *limites_tile(z, x, y))
+
+    features = []
+    if z < app.config['MAP_CLUSTER_ZOOM']:
+        for cluster in agrupar_propostas(query, z):
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [cluster['longitude'], cluster['latitude']]},
+                'properties': {
+                    'cluster': True,
+                    'id': cluster['id'],
+                    'count': cluster['count'],
+                    'por_categoria': cluster['por_categoria'],
+                    'por_status': cluster['por_status']
+                }
+            })
+    else:
+        # Sem votos/comentários: os tiles só mudam quando a proposta é criada ou muda de status
+        colunas = query.order_by(None).with_entities(
+            Proposal.id, Proposal.title, Proposal.address, Proposal.category,
+            Proposal.status, Proposal.priority, Proposal.latitude, Proposal.longitude
+        )
+        for p in colunas:
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [p.longitude, p.latitude]},
+                'properties': {
+                    'id': p.id,
+                    'title': p.title,
+                    'address': p.address,
+                    'category': p.category,
+                    'status': p.status,
+                    'priority': p.priority
+                }
+            })
+
+    return json.dumps({'type': 'FeatureCollection', 'features': features},
+                      ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def marcador_invalidacao_tiles(z):
+    return os.path.join(app.config['TILE_CACHE_DIR'], str(z), '.invalidado')
+
+def invalidar_tiles(pontos):
+    """Descartar do cache os tiles (em todos os zooms) que contêm os pontos informados"""
+    for z in range(TILE_ZOOM_MAXIMO + 1):
+        # Marca a invalidação antes de apagar: tiles gerados antes dela não são gravados.
+        # Um marcador por zoom, para não criar diretórios de tiles que nunca foram pedidos
+        marcador = marcador_invalidacao_tiles(z)
+        try:
+            os.makedirs(os.path.dirname(marcador), exist_ok=True)
+            with open(marcador, 'w'):
+                pass
+        except OSError as e:
+            app.logger.warning(f'Não foi possível marcar a invalidação do zoom {z}: {str(e)}')
+        
+        for x, y in {tile_do_ponto(latitude, longitude, z) for latitude, longitude in pontos}:
+            diretorio = caminho_tile(z, x, y)
+            try:
+                nomes = os.listdir(diretorio)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                app.logger.warning(f'Não foi possível invalidar o tile {diretorio}: {str(e)}')
+                continue
+            for nome in nomes:
+                if nome.endswith('.json'):
+                    try:
+                        os.remove(os.path.join(diretorio, nome))
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        app.logger.warning(f'Não foi possível invalidar o tile {diretorio}: {str(e)}')
+
+@event.listens_for(Proposal, 'after_insert')
+@event.listens_for(Proposal, 'after_delete')
+def registrar_tiles_proposta(mapper, connection, proposal):
+    session = object_session(proposal)
+    if session is not None:
+        session.info.setdefault('tiles_invalidos', set()).add((proposal.latitude, proposal.longitude))
+
+@event.listens_for(Proposal, 'after_update')
+def registrar_tiles_proposta_alterada(mapper, connection, proposal):
+    estado = inspect(proposal)
+    campos = ('latitude', 'longitude', 'status', 'category', 'priority', 'title', 'address')
+    if not any(estado.attrs[campo].history.has_changes() for campo in campos):
+        return
+
+    tiles = object_session(proposal).info.setdefault('tiles_invalidos', set())
+    tiles.add((proposal.latitude, proposal.longitude))
+
+    # Se a proposta mudou de lugar, o tile antigo também precisa ser descartado
+    latitudes = estado.attrs.latitude.history.deleted or [proposal.latitude]
+    longitudes = estado.attrs.longitude.history.deleted or [proposal.longitude]
+    tiles.add((latitudes[0], longitudes[0]))
+
+@event.listens_for(Session, 'after_commit')
+def invalidar_tiles_apos_commit(session):
+    # Só depois do commit: antes disso outro worker poderia regravar o tile com dados antigos
+    pontos = session.info.pop('tiles_invalidos', None)
+    if pontos:
+        invalidar_tiles(pontos)
+
+@event.listens_for(Session, 'after_rollback')
+def descartar_tiles_apos_rollback(session):
+    session.info.pop('tiles_invalidos', None)
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>')
+def tile_propostas(z, x, y):
+    """Tile GeoJSON das propostas com cache em disco e ETag forte"""
+    if z > TILE_ZOOM_MAXIMO or x >= 2 ** z or y >= 2 ** z:
+        abort(404)
+
+    filtros = {
+        'category': request.args.get('category', 'all'),
+        'status': request.args.get('status', 'all'),
+        'priority': request.args.get('priority', 'all')
+    }
+    search = request.args.get('search', '')
+
+    if search:
+        # Buscas textuais são muito variadas para valer a pena guardar
+        corpo = gerar_tile(z, x, y, search=search, **filtros)
+    else:
+        diretorio = caminho_tile(z, x, y)
+        variante = hashlib.sha1(urlencode(sorted(filtros.items())).encode('utf-8')).hexdigest()[:16]
+        arquivo = os.path.join(diretorio, f'{variante}.json')
+
+        try:
+            with open(arquivo, 'rb') as f:
+                corpo = f.read()
+        except FileNotFoundError:
+            inicio = time.time()
+            corpo = gerar_tile(z, x, y, **filtros)
+
+            try:
+                os.makedirs(diretorio, exist_ok=True)
+                marcador = marcador_invalidacao_tiles(z)
+                # Uma proposta deste zoom mudou enquanto o tile era gerado: não gravar dados antigos
+                if not os.path.exists(marcador) or os.path.getmtime(marcador) < inicio:
+                    temporario = f'{arquivo}.{os.getpid()}.tmp'
+                    with open(temporario, 'wb') as f:
+                        f.write(corpo)
+                    os.replace(temporario, arquivo)
+            except OSError as e:
+                app.logger.warning(f'Não foi possível gravar o tile {arquivo}: {str(e)}')
+
+    response = make_response(corpo)
+    response.headers['Content-Type'] = 'application/geo+json'
+    response.headers['Cache-Control'] = f"public, max-age={app.config['TILE_MAX_AGE']}"
+    response.set_etag(hashlib.sha1(corpo).hexdigest())
+    return response.make_conditional(request)
+
+@app.route('/api/proposals/<int:id>')
+def api_proposal(id):
+    """API com os dados completos de uma proposta (usada pelo mapa ao selecionar um ponto)"""
+    proposal = Proposal.query.options(joinedload(Proposal.author)).get_or_404(id)
+    aplicar_votos_pendentes([proposal])
+    return jsonify(proposal.to_dict())
+
+# ===== EVENTOS AO VIVO (SSE) =====
+
+# Áreas do mapa são assinadas em tiles deste zoom (~10 km)
+SSE_ZOOM_AREA = 12
+SSE_MAXIMO_TILES = 64
+SSE_INTERVALO_PING = 15
+# Canal do LISTEN/NOTIFY e limite do payload (o PostgreSQL aceita até 8000 bytes)
+EVENTOS_CANAL_POSTGRES = 'meu_bairro_eventos'
+EVENTOS_NOTIFY_MAXIMO = 7900
+
+class CentralEventos:
+    """Pub/sub dos eventos ao vivo.
+    
+    Dentro do processo cada assinante tem uma fila. Entre os workers do
+    gunicorn os eventos vão por datagramas Unix: cada processo com assinantes
+    escuta um socket em EVENTOS_SOCKET_DIR e quem publica envia para todos os
+    sockets do diretório. Sem AF_UNIX (Windows) vale só o processo atual.
+    
+    Com PostgreSQL os eventos vão por LISTEN/NOTIFY, que também alcança um
+    serviço de stream em outra máquina (ex.: serviço separado no Railway).
+    """
+
+    def __init__(self):
+        self._assinantes = {}
+        self._lock = threading.Lock()
+        self._pid_escuta = None
+
+    def assinar(self, canais):
+        fila = queue.Queue(maxsize=100)
+        with self._lock:
+            for canal in canais:
+                self._assinantes.setdefault(canal, set()).add(fila)
+        self._escutar()
+        return fila
+
+    def cancelar(self, fila, canais):
+        with self._lock:
+            for canal in canais:
+                filas = self._assinantes.get(canal)
+                if filas is not None:
+                    filas.discard(fila)
+                    if not filas:
+                        del self._assinantes[canal]
+
+    def entregar(self, evento):
+        """Repassar um evento às filas deste processo"""
+        with self._lock:
+            filas = set()
+            for canal in evento['canais']:
+                filas.update(self._assinantes.get(canal, ()))
+        for fila in filas:
+            try:
+                fila.put_nowait(evento)
+            except queue.Full:
+                pass  # cliente lento demais perde o evento, não segura quem publica
+
+    def publicar(self, canais, tipo, dados):
+        evento = {'canais': canais, 'tipo': tipo, 'dados': dados}
+        if db.engine.dialect.name == 'postgresql':
+            self._notificar(evento)
+            return
+        if not hasattr(socket, 'AF_UNIX'):
+            self.entregar(evento)
+            return
+
+        diretorio = app.config['EVENTOS_SOCKET_DIR']
+        try:
+            nomes = os.listdir(diretorio)
+        except FileNotFoundError:
+            return  # nenhum processo com assinantes
+
+        mensagem = codificar_json(evento)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            for nome in nomes:
+                if not nome.endswith('.sock'):
+                    continue
+                caminho = os.path.join(diretorio, nome)
+                try:
+                    sock.sendto(mensagem, caminho)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Worker que morreu sem apagar o socket
+                    try:
+                        os.unlink(caminho)
+                    except OSError:
+                        pass
+                except OSError as e:
+                    app.logger.warning(f'Evento não entregue a {nome}: {str(e)}')
+
+    def _notificar(self, evento):
+        mensagem = codificar_json(evento).decode('utf-8')
+        if len(mensagem.encode('utf-8')) > EVENTOS_NOTIFY_MAXIMO:
+            # Comentário longo demais para o NOTIFY: segue só a contagem
+            dados = {chave: valor for chave, valor in evento['dados'].items() if chave != 'comment'}
+            mensagem = codificar_json({**evento, 'dados': dados}).decode('utf-8')
+        with db.engine.begin() as conexao:
+            conexao.execute(text('SELECT pg_notify(:canal, :mensagem)'),
+                            {'canal': EVENTOS_CANAL_POSTGRES, 'mensagem': mensagem})
+
+    def _escutar(self):
+        """Abrir o socket deste processo na primeira assinatura (após o fork)"""
+        postgres = db.engine.dialect.name == 'postgresql'
+        if self._pid_escuta == os.getpid() or not (postgres or hasattr(socket, 'AF_UNIX')):
+            return
+        with self._lock:
+            if self._pid_escuta == os.getpid():
+                return
+            self._pid_escuta = os.getpid()
+
+            if postgres:
+                threading.Thread(target=self._receber_postgres, args=(db.engine,), name='eventos', daemon=True).start()
+                return
+
+            diretorio = app.config['EVENTOS_SOCKET_DIR']
+            os.makedirs(diretorio, exist_ok=True)
+            caminho = os.path.join(diretorio, f'{os.getpid()}.sock')
+            if os.path.exists(caminho):
+                os.unlink(caminho)
+
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(caminho)
+            atexit.register(lambda: os.path.exists(caminho) and os.unlink(caminho))
+            threading.Thread(target=self._receber, args=(sock,), name='eventos', daemon=True).start()
+
+    def _receber(self, sock):
+        while True:
+            try:
+                evento = json.loads(sock.recv(262144))
+            except ValueError:
+                continue
+            self.entregar(evento)
+
+    def _receber_postgres(self, engine):
+        """LISTEN numa conexão própria, fora do pool; reconecta se ela cair"""
+        while True:
+            conexao = None
+            try:
+                conexao = engine.raw_connection()
+                conexao.detach()
+                dbapi = conexao.dbapi_connection
+                dbapi.autocommit = True
+                with dbapi.cursor() as cursor:
+                    cursor.execute(f'LISTEN {EVENTOS_CANAL_POSTGRES}')
+                
+                with selectors.DefaultSelector() as seletor:
+                    seletor.register(dbapi, selectors.EVENT_READ)
+                    while True:
+                        if not seletor.select(timeout=SSE_INTERVALO_PING):
+                            continue
+                        dbapi.poll()
+                        while dbapi.notifies:
+                            notificacao = dbapi.notifies.pop(0)
+                            try:
+                                evento = json.loads(notificacao.payload)
+                            except ValueError:
+                                continue
+                            self.entregar(evento)
+            except Exception as e:
+                app.logger.warning(f'Escuta de eventos no PostgreSQL interrompida: {str(e)}')
+                if conexao is not None:
+                    try:
+                        conexao.close()
+                    except Exception:
+                        pass
+                time.sleep(5)
+
+central_eventos = CentralEventos()
+
+def canais_da_proposta(proposal_id, latitude, longitude):
+    x, y = tile_do_ponto(latitude, longitude, SSE_ZOOM_AREA)
+    return [f'proposta:{proposal_id}', f'area:{x}/{y}']
+
+def publicar_evento_proposta(proposal_id, tipo, dados):
+    """Avisar os assinantes da proposta e da área do mapa; falhas nunca afetam quem publica"""
+    try:
+        ponto = db.session.query(Proposal.latitude, Proposal.longitude).filter_by(id=proposal_id).first()
+        if ponto is not None:
+            central_eventos.publicar(canais_da_proposta(proposal_id, *ponto), tipo, dados)
+    except Exception as e:
+        app.logger.warning(f'Não foi possível publicar o evento {tipo}: {str(e)}')
+
+def servidor_assincrono():
+    """Se o servidor aguenta conexões paradas: workers gevent ou o servidor de
+    desenvolvimento (uma thread por conexão). Workers sync do gunicorn, não."""
+    if gevent_monkey is not None and gevent_monkey.is_module_patched('socket'):
+        return True
+    return (request.environ.get('wsgi.multithread', False)
+            and not request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'))
+
+@app.route('/stream')
+def stream_eventos():
+    """Server-Sent Events com votos e comentários novos.
+    
+    ?proposta=<id> assina uma proposta; ?area=oeste,sul,leste,norte assina as
+    propostas de uma região do mapa. Só é servido por workers gevent (serviço
+    de stream): num worker sync cada cliente prenderia um processo inteiro,
+    então a resposta é 204, que faz o EventSource parar de reconectar.
+    """
+    if not servidor_assincrono():
+        return '', 204
+    
+    canais = []
+    
+    proposta = request.args.get('proposta', type=int)
+    if proposta:
+        canais.append(f'proposta:{proposta}')
+    
+    area = request.args.get('area')
+    if area:
+        try:
+            oeste, sul, leste, norte = [float(valor) for valor in area.split(',')]
+        except ValueError:
+            return jsonify({'erro': 'area deve ser oeste,sul,leste,norte'}), 400
+        
+        x_min, y_min = tile_do_ponto(norte, oeste, SSE_ZOOM_AREA)
+        x_max, y_max = tile_do_ponto(sul, leste, SSE_ZOOM_AREA)
+        if (x_max - x_min + 1) * (y_max - y_min + 1) > SSE_MAXIMO_TILES:
+            return jsonify({'erro': 'Área grande demais para acompanhar ao vivo'}), 400
+        canais.extend(f'area:{x}/{y}' for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1))
     
-    if status != 'all':
-        query = query.filter(Proposal.status == status)
+    if not canais:
+        return jsonify({'erro': 'Informe proposta ou area'}), 400
     
-    if search:
-        query = query.filter(
-            Proposal.title.contains(search) |
-            Proposal.description.contains(search) |
-            Proposal.address.contains(search)
-        )
+    fila = central_eventos.assinar(canais)
+    duracao = app.config['SSE_DURACAO']
     
-    proposals = query.order_by(Proposal.created_at.desc()).paginate(
-        page=page, per_page=12, error_out=False
-    )
+    # Sem stream_with_context: a conexão com o banco é devolvida antes do streaming
+    def gerar():
+        try:
+            yield 'retry: 3000\n\n'
+            fim = time.monotonic() + duracao if duracao else None
+            while fim is None or time.monotonic() < fim:
+                espera = SSE_INTERVALO_PING
+                if fim is not None:
+                    espera = min(espera, max(0.0, fim - time.monotonic()))
+                try:
+                    evento = fila.get(timeout=espera)
+                except queue.Empty:
+                    yield ': ping\n\n'
+                    continue
+                yield f"event: {evento['tipo']}\ndata: {json.dumps(evento['dados'], ensure_ascii=False)}\n\n"
+        finally:
+            central_eventos.cancelar(fila, canais)
     
-    return jsonify({
-        'proposals': [{
-            'id': p.id,
-            'title': p.title,
-            'description': p.description,
-            'category': p.category,
-            'latitude': float(p.latitude),
-            'longitude': float(p.longitude),
-            'address': p.address,
-            'status': p.status,
-            'priority': p.priority,
-            'votes_count': p.votes_count,
-            'comments_count': p.comments_count,
-            'author_name': p.author.name,
-            'created_at': p.created_at.isoformat(),
-            'updated_at': p.created_at.isoformat()
-        } for p in proposals.items],
-        'total': proposals.total,
-        'pages': proposals.pages,
-        'current_page': proposals.page,
-        'has_next': proposals.has_next,
-        'has_prev': proposals.has_prev
-    })
-
-@app.route('/api/categories')
-def api_categories():
-    """API para listar categorias"""
-    categories = Category.query.all()
-    return jsonify([{
-        'id': c.id,
-        'name': c.name,
-        'icon': c.icon,
-        'color': c.color
-    } for c in categories])
-
-@app.route('/api/map-proposals')
-def api_map_proposals():
-    """API específica para o mapa - retorna todas as propostas"""
-    proposals = Proposal.query.all()
-    return jsonify({
-        'proposals': [{
-            'id': p.id,
-            'title': p.title,
-            'description': p.description,
-            'category': p.category,
-            'latitude': float(p.latitude),
-            'longitude': float(p.longitude),
-            'address': p.address,
-            'status': p.status,
-            'priority': p.priority,
-            'votes_count': p.votes_count,
-            'comments_count': p.comments_count,
-            'author_name': p.author.name if p.author else 'Anônimo',
-            'created_at': p.created_at.isoformat(),
-            'updated_at': p.updated_at.isoformat()
-        } for p in proposals],
-        'total': len(proposals)
-    })
+    response = app.response_class(gerar(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Eventos públicos, sem cookies: o serviço de stream pode estar em outro domínio (SSE_URL)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
 
 # ===== INICIALIZAÇÃO =====
 
 # ===== ENDPOINTS DE API PARA BUSCA =====
 
+@app.route('/api/proposals/<int:id>/comments')
+def api_proposal_comments(id):
+    """Comentários de uma proposta paginados por cursor (?cursor=)"""
+    if db.session.query(Proposal.id).filter_by(id=id).first() is None:
+        abort(404)
+    
+    try:
+        comments, next_cursor = paginar_comentarios(id, request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'erro': 'Cursor inválido'}), 400
+    
+    return jsonify({
+        'comments': [c.to_dict() for c in comments],
+        'next_cursor': next_cursor,
+        'has_next': next_cursor is not None
+    })
+
 @app.route('/api/buscar-cep', methods=['POST'])
 def api_buscar_cep():
     """API para buscar dados do CEP"""
@@ -632,32 +3025,142 @@ def api_buscar_endereco():
     resultado = buscar_endereco(endereco)
     return jsonify(resultado)
 
+@app.route('/api/geocodificar-lote', methods=['POST'])
+@login_required
+def api_geocodificar_lote():
+    """Geocodificar listas de CEPs e endereços de uma vez.
+    
+    Corpo: {"ceps": [...], "enderecos": [...]}. Com ?formato=ndjson (ou Accept)
+    cada item é enviado assim que fica pronto; senão a resposta traz todos os
+    itens na ordem da entrada.
+    
+    Cada requisição inicia no máximo GEOCODE_LOTE_CONSULTAS consultas externas
+    e espera até GEOCODE_LOTE_ORCAMENTO segundos. Itens não resolvidos saem com
+    status 'pendente' e a resposta JSON traz em "pendentes" um corpo pronto
+    para reenviar em seguida.
+    """
+    data = request.get_json(silent=True) or {}
+    ceps = data.get('ceps') or []
+    enderecos = data.get('enderecos') or []
+    
+    if not isinstance(ceps, list) or not isinstance(enderecos, list):
+        return jsonify({'erro': 'ceps e enderecos devem ser listas'}), 400
+    if not ceps and not enderecos:
+        return jsonify({'erro': 'Informe ceps ou enderecos'}), 400
+    if len(ceps) + len(enderecos) > GEOCODE_LOTE_MAXIMO:
+        return jsonify({'erro': f'Máximo de {GEOCODE_LOTE_MAXIMO} itens por lote'}), 400
+    
+    lote = geocodificar_lote(ceps, enderecos, max_consultas=app.config['GEOCODE_LOTE_CONSULTAS'],
+                             orcamento=app.config['GEOCODE_LOTE_ORCAMENTO'])
+    
+    if quer_ndjson():
+        def gerar():
+            for indice, item in lote:
+                item['indice'] = indice
+                yield codificar_json(item) + b'\n'
+        return app.response_class(stream_with_context(gerar()), mimetype=MIMETYPE_NDJSON)
+    
+    itens = [None] * (len(ceps) + len(enderecos))
+    for indice, item in lote:
+        itens[indice] = item
+    
+    adiados = [item for item in itens if item['status'] == 'pendente']
+    return jsonify({
+        'sucesso': True,
+        'total': len(itens),
+        'resolvidos': sum(1 for item in itens if item['status'] == 'ok'),
+        'itens': itens,
+        'pendentes': {
+            'ceps': [item['entrada'] for item in adiados if item['tipo'] == 'cep'],
+            'enderecos': [item['entrada'] for item in adiados if item['tipo'] == 'endereco']
+        }
+    })
+
+@app.route('/api/autocomplete-endereco')
+def api_autocomplete_endereco():
+    """Sugestões de logradouros da base local enquanto o usuário digita"""
+    texto = request.args.get('q', '').strip()
+    cidade = request.args.get('cidade', '').strip() or None
+    limite = min(request.args.get('limite', 10, type=int), 50)
+    
+    registros = autocompletar_logradouros(texto, cidade=cidade, limite=limite)
+    
+    response = jsonify({
+        'sucesso': True,
+        'resultados': [r.to_dict() for r in registros]
+    })
+    # A base só muda quando um CSV é importado
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response
+
+@app.route('/api/geocodificacao/estatisticas')
+@login_required
+def api_estatisticas_geocodificacao():
+    """Acertos e falhas do cache de geocodificação neste processo"""
+    with _geocode_lock:
+        dados = dict(estatisticas_geocodificacao)
+        dados['itens_memoria'] = len(_geocode_lru)
+    dados['disjuntores'] = {
+        disjuntor.nome: {'estado': disjuntor.estado, 'falhas': disjuntor.falhas}
+        for disjuntor in (disjuntor_viacep, disjuntor_nominatim)
+    }
+    return jsonify(dados)
+
 @app.route('/api/buscar-propostas', methods=['GET'])
 def api_buscar_propostas():
     """API para buscar propostas por localização"""
     latitude = request.args.get('lat', type=float)
     longitude = request.args.get('lng', type=float)
     raio = request.args.get('raio', 1.0, type=float)  # raio em km
+    limite = request.args.get('limite', type=int)
     
-    if not latitude or not longitude:
+    if latitude is None or longitude is None:
         return jsonify({'erro': 'Latitude e longitude são obrigatórios'}), 400
     
-    # Buscar propostas próximas (simplificado - em produção usar PostGIS)
-    propostas = Proposal.query.all()
-    propostas_proximas = []
+    if raio <= 0:
+        return jsonify({'erro': 'Raio deve ser maior que zero'}), 400
     
-    for proposta in propostas:
-        # Cálculo simples de distância (em produção usar fórmula de Haversine)
-        distancia = ((proposta.latitude - latitude) ** 2 + (proposta.longitude - longitude) ** 2) ** 0.5
+    # Pré-filtro pelo retângulo que envolve o círculo (usa o índice espacial)
+    query = Proposal.query.options(joinedload(Proposal.author))
+    query = filtrar_por_area(query, *calcular_area(latitude, longitude, raio))
+    
+    # Verificação exata da distância apenas para os candidatos do retângulo
+    propostas_proximas = []
+    for proposta in query.all():
+        distancia = distancia_haversine(latitude, longitude, proposta.latitude, proposta.longitude)
         if distancia <= raio:
-            propostas_proximas.append(proposta.to_dict())
+            propostas_proximas.append((distancia, proposta))
+    
+    propostas_proximas.sort(key=lambda item: item[0])
+    if limite and limite > 0:
+        propostas_proximas = propostas_proximas[:limite]
+    aplicar_votos_pendentes([proposta for _, proposta in propostas_proximas])
+    
+    resultado = []
+    for distancia, proposta in propostas_proximas:
+        dados = proposta.to_dict()
+        dados['distancia_km'] = round(distancia, 3)
+        resultado.append(dados)
     
     return jsonify({
         'sucesso': True,
-        'propostas': propostas_proximas,
-        'total': len(propostas_proximas)
+        'propostas': resultado,
+        'total': len(resultado)
     })
 
+def criar_indices():
+    """Criar índices declarados nos modelos que ainda não existem no banco.
+    
+    db.create_all() não altera tabelas existentes, então bancos criados antes
+    dos índices (SQLite ou PostgreSQL) recebem os índices aqui, na inicialização.
+    """
+    for tabela in db.metadata.sorted_tables:
+        for indice in tabela.indexes:
+            try:
+                indice.create(bind=db.engine, checkfirst=True)
+            except Exception as e:
+                app.logger.warning(f'Não foi possível criar o índice {indice.name}: {str(e)}')
+
 def init_database():
     """Inicializar banco de dados com dados padrão"""
     with app.app_context():
@@ -692,40 +3195,216 @@ def init_database():
                     db.session.add(category)
                 
                 db.session.commit()
+
+            criar_indices()
+            try:
+                if EstatisticaProposta.query.first() is None:
+                    reconstruir_estatisticas()
+            except Exception as e:
+                # Só o resumo do dashboard fica vazio; o except abaixo apagaria as tabelas.
+                # `flask reconciliar-contadores` reconstrói depois
+                db.session.rollback()
+                app.logger.warning(f'Não foi possível reconstruir as estatísticas: {str(e)}')
+            limpar_cache_geocodificacao()
+            configurar_busca_textual(reconstruir=category_count == 0)
+            configurar_indice_espacial(reconstruir=category_count == 0)
         except Exception as e:
             db.drop_all()
             db.create_all()
+            configurar_busca_textual(reconstruir=True)
+            configurar_indice_espacial(reconstruir=True)
+
+# ===== CACHE DOS RELATÓRIOS EM PDF =====
+
+# Tabelas lidas pelo relatório; escritas nelas tornam o PDF em cache desatualizado
+TABELAS_RELATORIO = {'proposal', 'comment', 'vote', 'user'}
+
+def versao_dados():
+    """Versão atual dos dados do relatório (opaca, compartilhada entre os workers)"""
+    try:
+        with open(os.path.join(app.config['RELATORIO_CACHE_DIR'], 'versao')) as f:
+            return f.read().strip() or '0'
+    except FileNotFoundError:
+        return '0'
+
+def avancar_versao_dados():
+    diretorio = app.config['RELATORIO_CACHE_DIR']
+    versao = f'{time.time_ns():x}'
+    try:
+        os.makedirs(diretorio, exist_ok=True)
+        temporario = os.path.join(diretorio, f'versao.{os.getpid()}.tmp')
+        with open(temporario, 'w') as f:
+            f.write(versao)
+        os.replace(temporario, os.path.join(diretorio, 'versao'))
+    except OSError as e:
+        app.logger.warning(f'Não foi possível avançar a versão dos relatórios: {str(e)}')
+    return versao
+
+def caminho_relatorio_pdf(variante, versao):
+    return os.path.join(app.config['RELATORIO_CACHE_DIR'], f'relatorio-{variante}-{versao}.pdf')
+
+def relatorio_pdf_mais_recente(variante):
+    """PDF em cache mais recente da variante, de qualquer versão, ou None"""
+    diretorio = app.config['RELATORIO_CACHE_DIR']
+    prefixo = f'relatorio-{variante}-'
+    try:
+        arquivos = [os.path.join(diretorio, nome) for nome in os.listdir(diretorio)
+                    if nome.startswith(prefixo) and nome.endswith('.pdf')]
+        return max(arquivos, key=os.path.getmtime, default=None)
+    except OSError:
+        return None
+
+def gerar_relatorio_pdf_em_cache(variante, dias_atividade):
+    """Gerar e gravar o PDF da versão atual dos dados, se ainda não existir.
+    
+    A geração é serializada por flock entre os workers: quem espera encontra
+    o arquivo pronto em vez de gerar de novo. A versão é lida antes das
+    consultas, então o PDF nunca tem dados mais antigos que o nome indica.
+    """
+    diretorio = app.config['RELATORIO_CACHE_DIR']
+    os.makedirs(diretorio, exist_ok=True)
+    with open(os.path.join(diretorio, f'relatorio-{variante}.lock'), 'a') as trava:
+        if fcntl is not None:
+            fcntl.flock(trava, fcntl.LOCK_EX)
+        
+        destino = caminho_relatorio_pdf(variante, versao_dados())
+        if os.path.exists(destino):
+            return destino
+        
+        temporario = f'{destino}.{os.getpid()}.tmp'
+        gerar_relatorio_pdf(temporario, dias_atividade)
+        os.replace(temporario, destino)
+        
+        # Gerações são serializadas, então as versões anteriores ficaram obsoletas
+        prefixo = f'relatorio-{variante}-'
+        for nome in os.listdir(diretorio):
+            caminho = os.path.join(diretorio, nome)
+            if nome.startswith(prefixo) and nome.endswith('.pdf') and caminho != destino:
+                try:
+                    os.remove(caminho)
+                except OSError:
+                    pass
+        return destino
+
+def regenerar_relatorios_em_cache():
+    """Roda num processo do pool do despachante: atualiza os PDFs para a versão atual.
+    
+    Só as variantes que alguém já baixou (as que têm arquivo em cache); as
+    já atualizadas custam só o exists dentro de gerar_relatorio_pdf_em_cache.
+    """
+    with app.app_context():
+        try:
+            nomes = os.listdir(app.config['RELATORIO_CACHE_DIR'])
+        except OSError:
+            return
+        try:
+            for variante in sorted({nome[len('relatorio-'):].split('-', 1)[0] for nome in nomes
+                                    if nome.startswith('relatorio-') and nome.endswith('.pdf')}):
+                dias_atividade = None if variante == 'geral' else int(variante[:-1])
+                gerar_relatorio_pdf_em_cache(variante, dias_atividade)
+        finally:
+            db.session.remove()
+
+@event.listens_for(Session, 'after_flush')
+def marcar_relatorio_desatualizado(session, flush_context):
+    # Usuários só entram pelo total e pelos nomes: atualizações de perfil não contam
+    alterados = list(session.new) + list(session.deleted)
+    if any(isinstance(obj, (Proposal, Comment, Vote, User)) for obj in alterados) or \
+       any(isinstance(obj, (Proposal, Comment, Vote)) for obj in session.dirty):
+        session.info['relatorio_desatualizado'] = True
+
+@event.listens_for(Session, 'do_orm_execute')
+def marcar_relatorio_desatualizado_dml(estado):
+    # INSERT/UPDATE/DELETE diretos (votos, contadores, write-behind) não passam pelo flush
+    if estado.is_insert or estado.is_update or estado.is_delete:
+        tabela = getattr(estado.statement, 'table', None)
+        if tabela is not None and tabela.name in TABELAS_RELATORIO:
+            estado.session.info['relatorio_desatualizado'] = True
+
+@event.listens_for(Session, 'after_commit')
+def avancar_versao_apos_commit(session):
+    # A regeneração fica com o despachante da fila, que acompanha a versão
+    if session.info.pop('relatorio_desatualizado', False):
+        avancar_versao_dados()
+
+@event.listens_for(Session, 'after_rollback')
+def descartar_versao_apos_rollback(session):
+    session.info.pop('relatorio_desatualizado', None)
 
 # ===== RELATÓRIOS =====
 
-def obter_dados_relatorio():
-    """Coleta todos os dados necessários para o relatório"""
+ResumoCategoria = namedtuple('ResumoCategoria', 'name total aprovadas pendentes em_andamento')
+
+def usuarios_mais_ativos(limite=10, desde=None, ate=None, incluir_votos=False):
+    """Ranking de usuários por propostas, depois comentários (e votos, se pedido).
+    
+    Cada tabela é agregada por usuário em uma subconsulta própria antes do
+    join com User; juntar propostas e comentários direto multiplicaria as
+    linhas (propostas x comentários) e inflaria as duas contagens.
+    desde/ate limitam a atividade considerada pela data de criação.
+    Retorna tuplas (usuario, total_propostas, total_comentarios[, total_votos]).
+    """
+    def por_usuario(coluna_usuario, coluna_data):
+        consulta = select(coluna_usuario.label('user_id'), func.count().label('total'))
+        if desde is not None:
+            consulta = consulta.where(coluna_data >= desde)
+        if ate is not None:
+            consulta = consulta.where(coluna_data <= ate)
+        return consulta.group_by(coluna_usuario).subquery()
+    
+    agregados = [
+        por_usuario(Proposal.author_id, Proposal.created_at),
+        por_usuario(Comment.user_id, Comment.created_at)
+    ]
+    if incluir_votos:
+        agregados.append(por_usuario(Vote.user_id, Vote.created_at))
+    
+    totais = [func.coalesce(agregado.c.total, 0) for agregado in agregados]
+    query = db.session.query(User, *totais)
+    for agregado in agregados:
+        query = query.outerjoin(agregado, agregado.c.user_id == User.id)
+    
+    # Usuários sem nenhuma atividade no período não entram no ranking
+    return query.filter(or_(*[agregado.c.total.isnot(None) for agregado in agregados]))\
+        .order_by(*[total.desc() for total in totais], User.id)\
+        .limit(limite).all()
+
+def obter_dados_relatorio(dias_atividade=None):
+    """Coleta todos os dados necessários para o relatório.
+    
+    dias_atividade limita o ranking de usuários mais ativos aos últimos N dias.
+    """
     
     # Estatísticas gerais
-    total_propostas = Proposal.query.count()
-    total_usuarios = User.query.count()
-    total_comentarios = Comment.query.count()
-    total_votos = Vote.query.count()
+    resumo = resumo_estatisticas()
+    total_propostas = resumo['total_propostas']
+    total_usuarios = resumo['total_usuarios']
+    total_comentarios = resumo['total_comentarios']
+    total_votos = resumo['total_votos']
     
     # Propostas por status
-    propostas_aprovadas = Proposal.query.filter_by(status='approved').count()
-    propostas_pendentes = Proposal.query.filter_by(status='pending').count()
-    propostas_em_andamento = Proposal.query.filter_by(status='in_progress').count()
+    propostas_aprovadas = resumo['por_status']['approved']
+    propostas_pendentes = resumo['por_status']['pending']
+    propostas_em_andamento = resumo['por_status']['in_progress']
     
     taxa_aprovacao = round((propostas_aprovadas / total_propostas * 100), 1) if total_propostas > 0 else 0
     
     # Propostas por categoria
-    propostas_por_categoria = db.session.query(
-        Category.name,
-        func.count(Proposal.id).label('total'),
-        func.sum(case((Proposal.status == 'approved', 1), else_=0)).label('aprovadas'),
-        func.sum(case((Proposal.status == 'pending', 1), else_=0)).label('pendentes'),
-        func.sum(case((Proposal.status == 'in_progress', 1), else_=0)).label('em_andamento')
-    ).join(Proposal, Category.id == Proposal.category)\
-     .group_by(Category.id, Category.name).all()
+    propostas_por_categoria = []
+    for category in Category.query.order_by(Category.id):
+        por_status = resumo['por_categoria'].get(category.id)
+        if por_status:
+            propostas_por_categoria.append(ResumoCategoria(
+                name=category.name,
+                total=sum(por_status.values()),
+                aprovadas=por_status.get('approved', 0),
+                pendentes=por_status.get('pending', 0),
+                em_andamento=por_status.get('in_progress', 0)
+            ))
     
     # Propostas recentes (últimas 10)
-    propostas_recentes = Proposal.query.order_by(Proposal.created_at.desc()).limit(10).all()
+    propostas_recentes = Proposal.query.options(joinedload(Proposal.author))\
+        .order_by(Proposal.created_at.desc()).limit(10).all()
     
     # Comentários em destaque (mais recentes)
     comentarios_destaque = Comment.query.join(User).order_by(
@@ -733,15 +3412,8 @@ def obter_dados_relatorio():
     ).limit(5).all()
     
     # Usuários mais ativos
-    usuarios_ativos = db.session.query(
-        User,
-        func.count(Proposal.id).label('total_propostas'),
-        func.count(Comment.id).label('total_comentarios')
-    ).outerjoin(Proposal, User.id == Proposal.author_id)\
-     .outerjoin(Comment, User.id == Comment.user_id)\
-     .group_by(User.id)\
-     .order_by(func.count(Proposal.id).desc())\
-     .limit(10).all()
+    desde = datetime.utcnow() - timedelta(days=dias_atividade) if dias_atividade else None
+    usuarios_ativos = usuarios_mais_ativos(desde=desde, incluir_votos=True)
     
     # Propostas mais votadas
     propostas_mais_votadas = Proposal.query.order_by(Proposal.votes_count.desc()).limit(5).all()
@@ -767,6 +3439,7 @@ def obter_dados_relatorio():
         'propostas_recentes': propostas_recentes,
         'comentarios_destaque': comentarios_destaque,
         'usuarios_ativos': usuarios_ativos,
+        'dias_atividade': dias_atividade,
         'propostas_mais_votadas': propostas_mais_votadas
     }
 
@@ -774,66 +3447,192 @@ def obter_dados_relatorio():
 @login_required
 def relatorios():
     """Página principal de relatórios"""
-    dados = obter_dados_relatorio()
-    return render_template('relatorios.html', **dados)
+    dados = obter_dados_relatorio(dias_atividade=request.args.get('dias', type=int))
+    return render_template('relatorios.html', fila_relatorios=despachante_relatorios_ativo(), **dados)
 
-@app.route('/relatorios/pdf')
-@login_required
-def relatorio_pdf():
-    """Gerar relatório em PDF usando ReportLab"""
-    dados = obter_dados_relatorio()
-    
-    # Criar buffer para o PDF
-    buffer = BytesIO()
-    
-    # Criar documento PDF
-    doc = SimpleDocTemplate(buffer, pagesize=A4, 
-                          rightMargin=72, leftMargin=72, 
-                          topMargin=72, bottomMargin=18)
-    
-    # Estilos
-    styles = getSampleStyleSheet()
-    
-    # Estilo personalizado para título
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        spaceAfter=30,
-        alignment=TA_CENTER,
-        textColor=colors.HexColor('#1f2937')
-    )
+CAMPOS_FILTRO_RELATORIO = ('data_inicio', 'data_fim', 'categoria', 'status')
+
+def ler_data_filtro(campo, valor):
+    """Data AAAA-MM-DD de um filtro, à meia-noite; ValueError com mensagem se malformada"""
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        raise ValueError(f'{campo} inválida: use o formato AAAA-MM-DD')
+
+def ler_filtros_relatorio(origem):
+    """Filtros do relatório personalizado (form, query string ou JSON), com as datas validadas"""
+    filtros = {campo: origem.get(campo) or None for campo in CAMPOS_FILTRO_RELATORIO}
+    for campo in ('data_inicio', 'data_fim'):
+        if filtros[campo]:
+            ler_data_filtro(campo, filtros[campo])
+    return filtros
+
+def filtrar_propostas_relatorio(filtros):
+    """Query de propostas com os filtros do relatório personalizado"""
+    query = Proposal.query
     
-    # Estilo para subtítulos
-    subtitle_style = ParagraphStyle(
-        'CustomSubtitle',
-        parent=styles['Heading2'],
-        fontSize=14,
-        spaceAfter=12,
-        textColor=colors.HexColor('#374151')
-    )
+    if filtros.get('data_inicio'):
+        query = query.filter(Proposal.created_at >= ler_data_filtro('data_inicio', filtros['data_inicio']))
+    if filtros.get('data_fim'):
+        # data_fim inclui o dia inteiro: tudo antes da meia-noite seguinte
+        fim = ler_data_filtro('data_fim', filtros['data_fim']) + timedelta(days=1)
+        query = query.filter(Proposal.created_at < fim)
+    if filtros.get('categoria'):
+        query = query.filter(Proposal.category == filtros['categoria'])
+    if filtros.get('status'):
+        query = query.filter(Proposal.status == filtros['status'])
     
-    # Estilo para parágrafos
-    normal_style = ParagraphStyle(
-        'CustomNormal',
-        parent=styles['Normal'],
-        fontSize=10,
-        spaceAfter=6
-    )
+    return query
+
+_estilos_relatorio = None
+
+def estilos_relatorio():
+    """Estilos do PDF, criados uma vez por processo e compartilhados entre as gerações"""
+    global _estilos_relatorio
+    if _estilos_relatorio is None:
+        styles = getSampleStyleSheet()
+        tabela = [
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f8fafc')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#374151')),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ]
+        _estilos_relatorio = {
+            'normal': styles['Normal'],
+            # Estilo personalizado para título
+            'titulo': ParagraphStyle(
+                'CustomTitle',
+                parent=styles['Heading1'],
+                fontSize=18,
+                spaceAfter=30,
+                alignment=TA_CENTER,
+                textColor=colors.HexColor('#1f2937')
+            ),
+            # Estilo para subtítulos
+            'subtitulo': ParagraphStyle(
+                'CustomSubtitle',
+                parent=styles['Heading2'],
+                fontSize=14,
+                spaceAfter=12,
+                textColor=colors.HexColor('#374151')
+            ),
+            # Tabelas de resumo (estatísticas e status)
+            'tabela_resumo': TableStyle(tabela + [('FONTSIZE', (0, 0), (-1, 0), 12)]),
+            'tabela_categorias': TableStyle(tabela + [('FONTSIZE', (0, 0), (-1, 0), 10),
+                                                      ('FONTSIZE', (0, 1), (-1, -1), 9)]),
+            # Listas de propostas e usuários
+            'tabela': TableStyle(tabela + [('FONTSIZE', (0, 0), (-1, 0), 10),
+                                           ('FONTSIZE', (0, 1), (-1, -1), 8)]),
+        }
+    return _estilos_relatorio
+
+class DocumentoRelatorio(SimpleDocTemplate):
+    """SimpleDocTemplate que consome a story de um gerador durante a paginação.
+    
+    build() recebe a lista inteira de flowables; aqui ela guarda só os
+    próximos e filterFlowables, chamado antes de cada flowable ser
+    posicionado, a reabastece. Cada flowable desenhado é descartado, então
+    a memória não cresce com o número de linhas do relatório.
+    """
+    
+    def construir(self, flowables):
+        self._pendentes = iter(flowables)
+        self._story = []
+        self.filterFlowables(self._story)
+        self.build(self._story)
+    
+    def filterFlowables(self, flowables):
+        # Também é chamado para os flowables pendentes do fim de página; só a story é reabastecida
+        if flowables is not self._story:
+            return
+        # build() termina quando a lista esvazia: manter um flowable além do atual
+        while len(flowables) < 2:
+            proximo = next(self._pendentes, None)
+            if proximo is None:
+                break
+            flowables.append(proximo)
+
+def tabela_em_blocos(linhas, cabecalho, larguras, estilo, linhas_por_bloco=200):
+    """LongTables de até linhas_por_bloco linhas, repetindo o cabeçalho a cada página.
+    
+    Uma única tabela com milhares de linhas é medida inteira e redividida a
+    cada página; em blocos o custo fica linear e só um bloco existe por vez.
+    """
+    bloco = [cabecalho]
+    vazia = True
+    for linha in linhas:
+        bloco.append(linha)
+        if len(bloco) > linhas_por_bloco:
+            yield _tabela_relatorio(bloco, larguras, estilo)
+            bloco = [cabecalho]
+            vazia = False
+    # Sem nenhuma linha a tabela sai só com o cabeçalho, como antes
+    if len(bloco) > 1 or vazia:
+        yield _tabela_relatorio(bloco, larguras, estilo)
+
+def _tabela_relatorio(dados, larguras, estilo):
+    tabela = LongTable(dados, colWidths=larguras, repeatRows=1)
+    tabela.setStyle(estilo)
+    return tabela
+
+def _linha_proposta_relatorio(titulo, autor, criado_em, status, votos):
+    return [
+        titulo[:30] + '...' if len(titulo) > 30 else titulo,
+        (autor or '')[:20],
+        criado_em.strftime('%d/%m/%Y'),
+        status.title(),
+        str(votos)
+    ]
+
+def linhas_propostas_filtradas(filtros, tamanho_lote=1000):
+    """Linhas da tabela de propostas filtradas, lidas do banco em lotes"""
+    resultado = filtrar_propostas_relatorio(filtros)\
+        .outerjoin(User, User.id == Proposal.author_id)\
+        .order_by(Proposal.created_at.desc())\
+        .with_entities(Proposal.title,
+                       func.coalesce(func.nullif(User.nome_completo, ''), User.name),
+                       Proposal.created_at, Proposal.status, Proposal.votes_count)\
+        .yield_per(tamanho_lote)
+    for linha in resultado:
+        yield _linha_proposta_relatorio(*linha)
+
+def gerar_relatorio_pdf(destino, dias_atividade=None, filtros=None):
+    """Gerar relatório em PDF usando ReportLab e gravá-lo em destino.
     
-    # Lista de elementos do PDF
-    story = []
+    Com filtros (relatório personalizado) a lista de propostas recentes dá
+    lugar às propostas que atendem aos filtros, lidas em lotes enquanto as
+    páginas são montadas.
+    """
+    dados = obter_dados_relatorio(dias_atividade=dias_atividade)
+    if filtros is not None:
+        dados['titulo_personalizado'] = (f"Relatório Personalizado - {filtros.get('data_inicio') or 'início'} "
+                                         f"a {filtros.get('data_fim') or 'hoje'}")
+    
+    # O documento é escrito direto no arquivo, com as páginas comprimidas
+    doc = DocumentoRelatorio(destino, pagesize=A4,
+                             rightMargin=72, leftMargin=72,
+                             topMargin=72, bottomMargin=18,
+                             pageCompression=1)
+    doc.construir(_story_relatorio(dados, filtros))
+
+def _story_relatorio(dados, filtros):
+    """Flowables do relatório, na ordem em que aparecem no PDF"""
+    estilos = estilos_relatorio()
+    normal_style = estilos['normal']
+    subtitle_style = estilos['subtitulo']
     
     # Cabeçalho
-    story.append(Paragraph("Relatório de Engajamento Comunitário", title_style))
-    story.append(Paragraph("Meu Bairro Melhor - Sistema de Participação Cidadã", styles['Normal']))
-    story.append(Paragraph(f"Gerado em: {dados['data_atual']} | Responsável: {dados['responsavel']}", styles['Normal']))
-    story.append(Spacer(1, 20))
+    yield Paragraph(dados.get('titulo_personalizado', "Relatório de Engajamento Comunitário"), estilos['titulo'])
+    yield Paragraph("Meu Bairro Melhor - Sistema de Participação Cidadã", normal_style)
+    yield Paragraph(f"Gerado em: {dados['data_atual']} | Responsável: {dados['responsavel']}", normal_style)
+    yield Spacer(1, 20)
     
     # Estatísticas Gerais
-    story.append(Paragraph("📊 Estatísticas Gerais", subtitle_style))
+    yield Paragraph("📊 Estatísticas Gerais", subtitle_style)
     
-    # Tabela de estatísticas
     stats_data = [
         ['Métrica', 'Valor'],
         ['Total de Propostas', str(dados['total_propostas'])],
@@ -841,24 +3640,11 @@ def relatorio_pdf():
         ['Total de Comentários', str(dados['total_comentarios'])],
         ['Total de Votos', str(dados['total_votos'])]
     ]
-    
-    stats_table = Table(stats_data, colWidths=[3*inch, 2*inch])
-    stats_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f8fafc')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#374151')),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    
-    story.append(stats_table)
-    story.append(Spacer(1, 20))
+    yield _tabela_relatorio(stats_data, [3*inch, 2*inch], estilos['tabela_resumo'])
+    yield Spacer(1, 20)
     
     # Status das Propostas
-    story.append(Paragraph("📈 Status das Propostas", subtitle_style))
+    yield Paragraph("📈 Status das Propostas", subtitle_style)
     
     status_data = [
         ['Status', 'Quantidade', 'Percentual'],
@@ -866,24 +3652,11 @@ def relatorio_pdf():
         ['Pendentes', str(dados['propostas_pendentes']), f"{round((dados['propostas_pendentes'] / dados['total_propostas'] * 100) if dados['total_propostas'] > 0 else 0, 1)}%"],
         ['Em Andamento', str(dados['propostas_em_andamento']), f"{round((dados['propostas_em_andamento'] / dados['total_propostas'] * 100) if dados['total_propostas'] > 0 else 0, 1)}%"]
     ]
-    
-    status_table = Table(status_data, colWidths=[2*inch, 1.5*inch, 1.5*inch])
-    status_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f8fafc')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#374151')),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    
-    story.append(status_table)
-    story.append(Spacer(1, 20))
+    yield _tabela_relatorio(status_data, [2*inch, 1.5*inch, 1.5*inch], estilos['tabela_resumo'])
+    yield Spacer(1, 20)
     
     # Propostas por Categoria
-    story.append(Paragraph("🏷️ Propostas por Categoria", subtitle_style))
+    yield Paragraph("🏷️ Propostas por Categoria", subtitle_style)
     
     categoria_data = [['Categoria', 'Total', 'Aprovadas', 'Pendentes', 'Em Andamento']]
     for categoria in dados['propostas_por_categoria']:
@@ -894,54 +3667,25 @@ def relatorio_pdf():
             str(categoria.pendentes),
             str(categoria.em_andamento)
         ])
+    yield _tabela_relatorio(categoria_data, [1.5*inch, 0.8*inch, 0.8*inch, 0.8*inch, 0.8*inch],
+                            estilos['tabela_categorias'])
+    yield PageBreak()
     
-    categoria_table = Table(categoria_data, colWidths=[1.5*inch, 0.8*inch, 0.8*inch, 0.8*inch, 0.8*inch])
-    categoria_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f8fafc')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#374151')),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTSIZE', (0, 1), (-1, -1), 9)
-    ]))
-    
-    story.append(categoria_table)
-    story.append(PageBreak())
-    
-    # Propostas Recentes
-    story.append(Paragraph("🆕 Propostas Recentes", subtitle_style))
-    
-    recentes_data = [['Título', 'Autor', 'Data', 'Status', 'Votos']]
-    for proposta in dados['propostas_recentes']:
-        recentes_data.append([
-            proposta.title[:30] + '...' if len(proposta.title) > 30 else proposta.title,
-            (proposta.author.nome_completo or proposta.author.name)[:20],
-            proposta.created_at.strftime('%d/%m/%Y'),
-            proposta.status.title(),
-            str(proposta.votes_count)
-        ])
-    
-    recentes_table = Table(recentes_data, colWidths=[2*inch, 1.2*inch, 0.8*inch, 0.8*inch, 0.5*inch])
-    recentes_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f8fafc')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#374151')),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTSIZE', (0, 1), (-1, -1), 8)
-    ]))
-    
-    story.append(recentes_table)
-    story.append(Spacer(1, 20))
+    # Propostas Recentes, ou todas as filtradas no relatório personalizado
+    if filtros is not None:
+        yield Paragraph("📋 Propostas Filtradas", subtitle_style)
+        linhas = linhas_propostas_filtradas(filtros)
+    else:
+        yield Paragraph("🆕 Propostas Recentes", subtitle_style)
+        linhas = (_linha_proposta_relatorio(proposta.title, proposta.author.nome_completo or proposta.author.name,
+                                            proposta.created_at, proposta.status, proposta.votes_count)
+                  for proposta in dados['propostas_recentes'])
+    yield from tabela_em_blocos(linhas, ['Título', 'Autor', 'Data', 'Status', 'Votos'],
+                                [2*inch, 1.2*inch, 0.8*inch, 0.8*inch, 0.5*inch], estilos['tabela'])
+    yield Spacer(1, 20)
     
     # Propostas Mais Votadas
-    story.append(Paragraph("⭐ Propostas Mais Votadas", subtitle_style))
+    yield Paragraph("⭐ Propostas Mais Votadas", subtitle_style)
     
     votadas_data = [['Posição', 'Título', 'Votos', 'Comentários', 'Status']]
     for i, proposta in enumerate(dados['propostas_mais_votadas'], 1):
@@ -952,111 +3696,514 @@ def relatorio_pdf():
             str(proposta.comments_count),
             proposta.status.title()
         ])
-    
-    votadas_table = Table(votadas_data, colWidths=[0.5*inch, 2*inch, 0.6*inch, 0.8*inch, 0.8*inch])
-    votadas_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f8fafc')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#374151')),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTSIZE', (0, 1), (-1, -1), 8)
-    ]))
-    
-    story.append(votadas_table)
-    story.append(Spacer(1, 20))
+    yield _tabela_relatorio(votadas_data, [0.5*inch, 2*inch, 0.6*inch, 0.8*inch, 0.8*inch], estilos['tabela'])
+    yield Spacer(1, 20)
     
     # Usuários Mais Ativos
-    story.append(Paragraph("🏆 Usuários Mais Ativos", subtitle_style))
+    titulo_ativos = "🏆 Usuários Mais Ativos"
+    if dados['dias_atividade']:
+        titulo_ativos += f" (últimos {dados['dias_atividade']} dias)"
+    yield Paragraph(titulo_ativos, subtitle_style)
     
-    usuarios_data = [['Posição', 'Nome', 'Email', 'Propostas', 'Comentários']]
+    usuarios_data = [['Posição', 'Nome', 'Email', 'Propostas', 'Comentários', 'Votos']]
     for i, usuario_data in enumerate(dados['usuarios_ativos'], 1):
-        usuario = usuario_data[0]
-        total_propostas = usuario_data[1]
-        total_comentarios = usuario_data[2]
+        usuario, total_propostas, total_comentarios, total_votos = usuario_data
         usuarios_data.append([
             f"{i}º",
             (usuario.nome_completo or usuario.name)[:20],
             usuario.email[:25] + '...' if len(usuario.email) > 25 else usuario.email,
             str(total_propostas),
-            str(total_comentarios)
+            str(total_comentarios),
+            str(total_votos)
         ])
-    
-    usuarios_table = Table(usuarios_data, colWidths=[0.5*inch, 1.5*inch, 1.8*inch, 0.8*inch, 0.8*inch])
-    usuarios_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f8fafc')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#374151')),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTSIZE', (0, 1), (-1, -1), 8)
-    ]))
-    
-    story.append(usuarios_table)
+    yield _tabela_relatorio(usuarios_data, [0.5*inch, 1.4*inch, 1.7*inch, 0.8*inch, 0.8*inch, 0.6*inch],
+                            estilos['tabela'])
     
     # Rodapé
-    story.append(Spacer(1, 30))
-    story.append(Paragraph("Meu Bairro Melhor - Sistema de Participação Cidadã", styles['Normal']))
-    story.append(Paragraph(f"Relatório gerado automaticamente em {dados['data_atual']}", styles['Normal']))
-    story.append(Paragraph("Para mais informações, acesse o sistema ou entre em contato com a administração", styles['Normal']))
-    
-    # Construir PDF
-    doc.build(story)
-    
-    # Obter conteúdo do buffer
-    pdf_content = buffer.getvalue()
-    buffer.close()
+    yield Spacer(1, 30)
+    yield Paragraph("Meu Bairro Melhor - Sistema de Participação Cidadã", normal_style)
+    yield Paragraph(f"Relatório gerado automaticamente em {dados['data_atual']}", normal_style)
+    yield Paragraph("Para mais informações, acesse o sistema ou entre em contato com a administração", normal_style)
+
+@app.route('/relatorios/pdf')
+@login_required
+def relatorio_pdf():
+    """Relatório em PDF, servido do cache enquanto os dados não mudarem"""
+    dias_atividade = request.args.get('dias', type=int)
+    variante = f'{dias_atividade}d' if dias_atividade else 'geral'
     
-    # Preparar resposta
-    response = make_response(pdf_content)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename="relatorio_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf"'
+    arquivo = caminho_relatorio_pdf(variante, versao_dados())
+    for tentativa in range(3):
+        if not os.path.exists(arquivo):
+            anterior = relatorio_pdf_mais_recente(variante)
+            # Um PDF de poucos minutos atrás é melhor que esperar a geração
+            if anterior and time.time() - os.path.getmtime(anterior) < app.config['RELATORIO_PDF_MAX_IDADE']:
+                arquivo = anterior
+            elif despachante_relatorios_ativo():
+                # A geração fica com a fila; a resposta traz a tarefa para acompanhamento
+                return responder_tarefa_enfileirada('pdf', {'dias': dias_atividade})
+            else:
+                # Sem despachante no ar, gerado aqui mesmo
+                arquivo = gerar_relatorio_pdf_em_cache(variante, dias_atividade)
+        try:
+            pdf = open(arquivo, 'rb')
+            break
+        except FileNotFoundError:
+            # Substituído por uma versão mais nova entre a escolha e a abertura
+            arquivo = caminho_relatorio_pdf(variante, versao_dados())
+    else:
+        abort(503)
     
+    gerado_em = datetime.fromtimestamp(os.fstat(pdf.fileno()).st_mtime)
+    response = send_file(pdf, mimetype='application/pdf', as_attachment=True,
+                         download_name=f'relatorio_{gerado_em.strftime("%Y%m%d_%H%M%S")}.pdf',
+                         etag=os.path.basename(arquivo)[:-len('.pdf')],
+                         last_modified=gerado_em, conditional=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Vary'] = 'Cookie'
     return response
 
 @app.route('/relatorios/personalizado', methods=['GET', 'POST'])
 @login_required
 def relatorio_personalizado():
     """Relatório com filtros personalizados"""
+    tarefa = None
+    status_code = 200
     if request.method == 'POST':
         # Obter filtros do formulário
-        data_inicio = request.form.get('data_inicio')
-        data_fim = request.form.get('data_fim')
-        categoria = request.form.get('categoria')
-        status = request.form.get('status')
-        
-        # Aplicar filtros na consulta
-        query = Proposal.query
-        
-        if data_inicio:
-            query = query.filter(Proposal.created_at >= data_inicio)
-        if data_fim:
-            query = query.filter(Proposal.created_at <= data_fim)
-        if categoria:
-            query = query.filter(Proposal.category == categoria)
-        if status:
-            query = query.filter(Proposal.status == status)
+        try:
+            filtros = ler_filtros_relatorio(request.form)
+        except ValueError as e:
+            flash(str(e), 'error')
+            filtros = None
+            status_code = 400
         
-        propostas_filtradas = query.all()
+        formato = request.form.get('formato') if filtros is not None else None
+        if formato in formatos_exportacao_disponiveis():
+            # Exportações longas vão para /relatorios/exportar (servido pelos workers gevent)
+            filtros_preenchidos = {campo: valor for campo, valor in filtros.items() if valor}
+            return redirect(url_exportacao(formato=formato, **filtros_preenchidos))
         
-        # Se solicitado PDF
-        if request.form.get('formato') == 'pdf':
-            dados = obter_dados_relatorio()
-            dados['propostas_recentes'] = propostas_filtradas
-            dados['titulo_personalizado'] = f"Relatório Personalizado - {data_inicio} a {data_fim}"
-            
-            # Usar a mesma lógica do relatório PDF principal
-            return relatorio_pdf()
+        # PDF: gerado pela fila de relatórios e acompanhado pela página; sem
+        # despachante no ar, gerado aqui mesmo
+        if formato == 'pdf' and not despachante_relatorios_ativo():
+            pdf = tempfile.TemporaryFile()
+            gerar_relatorio_pdf(pdf, filtros=filtros)
+            pdf.seek(0)
+            return send_file(pdf, mimetype='application/pdf', as_attachment=True,
+                             download_name=f'relatorio_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf')
+        if formato == 'pdf':
+            tarefa = enfileirar_relatorio(current_user.id, 'personalizado', filtros)
+            if tarefa is None:
+                flash('Você já tem relatórios em geração. Aguarde a conclusão para pedir outro.', 'error')
     
     # Buscar categorias para o formulário
     categorias = Category.query.all()
-    return render_template('relatorio_personalizado.html', categorias=categorias)
+    return render_template('relatorio_personalizado.html', categorias=categorias,
+                           tarefa=tarefa.to_dict() if tarefa else None,
+                           formatos_exportacao=formatos_exportacao_disponiveis()), status_code
+
+def serializador_exportacao():
+    return URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='exportacao')
+
+def url_exportacao(**params):
+    """URL de /relatorios/exportar; com EXPORTACAO_URL, no serviço de stream e assinada.
+    
+    O serviço de stream fica em outro domínio, sem o cookie da sessão: o token
+    (usuário e horário, assinados com a SECRET_KEY) autoriza o download.
+    """
+    params.pop('token', None)
+    if not app.config['EXPORTACAO_URL']:
+        return url_for('exportar_propostas', **params)
+    token = serializador_exportacao().dumps(current_user.id)
+    return app.config['EXPORTACAO_URL'] + url_for('exportar_propostas', token=token, **params)
+
+def token_exportacao_valido(token):
+    if not token:
+        return False
+    try:
+        user_id = serializador_exportacao().loads(token, max_age=app.config['EXPORTACAO_TOKEN_VALIDADE'])
+    except BadSignature:
+        return False
+    return db.session.get(User, user_id) is not None
+
+@app.route('/relatorios/exportar')
+def exportar_propostas():
+    """Exportar propostas filtradas em CSV, JSON Lines ou Parquet (para planilhas e scripts)"""
+    if not current_user.is_authenticated and not token_exportacao_valido(request.args.get('token')):
+        return login_manager.unauthorized()
+    if app.config['EXPORTACAO_URL'] and current_user.is_authenticated and not servidor_assincrono():
+        # Num worker sync o download longo passaria do timeout do gunicorn
+        return redirect(url_exportacao(**request.args.to_dict()))
+    
+    formato = request.args.get('formato', 'csv')
+    if formato not in formatos_exportacao_disponiveis():
+        return jsonify({'error': 'Formato indisponível',
+                        'formatos': formatos_exportacao_disponiveis()}), 400
+    
+    try:
+        filtros = ler_filtros_relatorio(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return resposta_exportacao(filtros, formato)
+
+# ===== FILA DE RELATÓRIOS =====
+
+# A fila é a própria tabela TarefaRelatorio: o despachante (comando
+# processar-relatorios, um por máquina) reserva tarefas pendentes com um
+# UPDATE atômico e renderiza cada uma num ProcessPoolExecutor, fora dos
+# workers web e do timeout do gunicorn.
+
+class DespachanteRelatorio(db.Model):
+    """Sinal de vida de cada despachante da fila de relatórios (um por processo)"""
+    id = db.Column(db.String(120), primary_key=True)
+    batimento_em = db.Column(db.DateTime, nullable=False, index=True)
+
+STATUS_TAREFA_ATIVOS = ('pendente', 'processando')
+_despachante_pid = None
+_despachante_lock = threading.Lock()
+
+def diretorio_tarefas_relatorio():
+    return os.path.join(app.config['RELATORIO_CACHE_DIR'], 'tarefas')
+
+def enfileirar_relatorio(user_id, tipo, parametros):
+    """Criar a tarefa, ou retornar None se o usuário já atingiu o limite de tarefas ativas"""
+    ativas = TarefaRelatorio.query.filter(
+        TarefaRelatorio.user_id == user_id,
+        TarefaRelatorio.status.in_(STATUS_TAREFA_ATIVOS)
+    ).count()
+    if ativas >= app.config['RELATORIOS_TAREFAS_POR_USUARIO']:
+        return None
+    
+    tarefa = TarefaRelatorio(user_id=user_id, tipo=tipo, parametros=json.dumps(parametros))
+    db.session.add(tarefa)
+    db.session.commit()
+    
+    if app.config['RELATORIOS_WORKER_EMBUTIDO']:
+        iniciar_despachante_embutido()
+    return tarefa
+
+def executar_tarefa_relatorio(tarefa_id, tipo, parametros):
+    """Roda num processo do pool: gera o PDF da tarefa e retorna o caminho do arquivo"""
+    with app.app_context():
+        try:
+            destino = os.path.join(diretorio_tarefas_relatorio(), f'{tarefa_id}.pdf')
+            temporario = f'{destino}.{os.getpid()}.tmp'
+            if tipo == 'pdf':
+                # O relatório geral é o mesmo para todos: reaproveita o cache por versão
+                dias_atividade = parametros.get('dias')
+                variante = f'{dias_atividade}d' if dias_atividade else 'geral'
+                shutil.copyfile(gerar_relatorio_pdf_em_cache(variante, dias_atividade), temporario)
+            else:
+                gerar_relatorio_pdf(temporario, filtros=parametros)
+            os.replace(temporario, destino)
+            return destino
+        finally:
+            db.session.remove()
+
+def _iniciar_processo_relatorios():
+    # Conexões herdadas do processo pai não podem ser usadas depois do fork
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+def limite_batimento_relatorios():
+    """Sinais de vida anteriores a este instante estão vencidos"""
+    return datetime.utcnow() - timedelta(seconds=3 * app.config['RELATORIOS_BATIMENTO'])
+
+def despachante_relatorios_ativo():
+    """Se há quem processe a fila: sem despachante, as páginas geram o PDF na própria requisição"""
+    if app.config['RELATORIOS_WORKER_EMBUTIDO']:
+        return True
+    return db.session.query(DespachanteRelatorio.id)\
+        .filter(DespachanteRelatorio.batimento_em >= limite_batimento_relatorios()).first() is not None
+
+def registrar_batimento_relatorios(despachante, tarefas):
+    """Renovar o sinal de vida do despachante e o das tarefas que ele está gerando"""
+    agora = datetime.utcnow()
+    inserir = pg_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+    db.session.execute(
+        inserir(DespachanteRelatorio.__table__)
+        .values(id=despachante, batimento_em=agora)
+        .on_conflict_do_update(index_elements=['id'], set_={'batimento_em': agora})
+    )
+    if tarefas:
+        db.session.execute(
+            TarefaRelatorio.__table__.update()
+            .where(TarefaRelatorio.id.in_(tarefas), TarefaRelatorio.status == 'processando')
+            .values(batimento_em=agora)
+        )
+    db.session.commit()
+
+def reenfileirar_tarefas_abandonadas():
+    """Devolver à fila as tarefas cujo despachante parou de renovar o sinal de vida"""
+    resultado = db.session.execute(
+        TarefaRelatorio.__table__.update()
+        .where(TarefaRelatorio.status == 'processando',
+               or_(TarefaRelatorio.batimento_em.is_(None),
+                   TarefaRelatorio.batimento_em < limite_batimento_relatorios()))
+        .values(status='pendente', batimento_em=None)
+    )
+    db.session.commit()
+    return resultado.rowcount
+
+def reservar_tarefa_relatorio():
+    """Marcar a tarefa pendente mais antiga como processando e retorná-la (ou None).
+    
+    A condição status = 'pendente' no UPDATE garante que dois despachantes
+    nunca reservem a mesma tarefa. started_at fica o da primeira reserva, para
+    que RELATORIOS_TEMPO_MAXIMO conte também as tentativas interrompidas.
+    """
+    agora = datetime.utcnow()
+    proxima = select(TarefaRelatorio.id)\
+        .where(TarefaRelatorio.status == 'pendente')\
+        .order_by(TarefaRelatorio.created_at).limit(1).scalar_subquery()
+    tarefa = db.session.execute(
+        TarefaRelatorio.__table__.update()
+        .where(TarefaRelatorio.id == proxima, TarefaRelatorio.status == 'pendente')
+        .values(status='processando', started_at=func.coalesce(TarefaRelatorio.started_at, agora),
+                batimento_em=agora)
+        .returning(TarefaRelatorio.id, TarefaRelatorio.tipo, TarefaRelatorio.parametros)
+    ).first()
+    db.session.commit()
+    return tarefa
+
+def concluir_tarefa_relatorio(tarefa_id, arquivo=None, erro=None):
+    db.session.execute(
+        TarefaRelatorio.__table__.update()
+        .where(TarefaRelatorio.id == tarefa_id)
+        .values(status='falhou' if erro else 'concluida', arquivo=arquivo, erro=erro,
+                finished_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+def limpar_tarefas_relatorio():
+    """Falhar tarefas travadas, devolver à fila as de despachantes parados e apagar as
+    antigas além da retenção e do limite de artefatos"""
+    agora = datetime.utcnow()
+    db.session.execute(
+        TarefaRelatorio.__table__.update()
+        .where(TarefaRelatorio.status.in_(STATUS_TAREFA_ATIVOS),
+               TarefaRelatorio.started_at < agora - timedelta(seconds=app.config['RELATORIOS_TEMPO_MAXIMO']))
+        .values(status='falhou', erro='Tempo máximo de geração excedido', finished_at=agora)
+    )
+    reenfileirar_tarefas_abandonadas()
+    DespachanteRelatorio.query.filter(
+        DespachanteRelatorio.batimento_em < agora - timedelta(hours=app.config['RELATORIOS_RETENCAO_HORAS'])
+    ).delete()
+    
+    finalizadas = TarefaRelatorio.query.filter(TarefaRelatorio.status.in_(('concluida', 'falhou')))
+    expiradas = finalizadas.filter(
+        TarefaRelatorio.finished_at < agora - timedelta(hours=app.config['RELATORIOS_RETENCAO_HORAS'])
+    ).all()
+    excedentes = finalizadas.order_by(TarefaRelatorio.finished_at.desc())\
+        .offset(app.config['RELATORIOS_MAX_ARTEFATOS']).all()
+    
+    for tarefa in set(expiradas) | set(excedentes):
+        if tarefa.arquivo:
+            try:
+                os.remove(tarefa.arquivo)
+            except OSError:
+                pass
+        db.session.delete(tarefa)
+    db.session.commit()
+
+def despachar_tarefas_relatorio(processos=None, intervalo=1.0, parar=None):
+    """Laço do despachante: reserva tarefas pendentes e as renderiza num pool de processos.
+    
+    Também regenera os PDFs em cache quando a versão dos dados muda: uma vez
+    por versão, RELATORIO_PDF_ATRASO segundos depois de notar a mudança (escritas
+    durante a espera não adiam, a regeneração usa a versão atual quando rodar).
+    Roda até `parar` (threading.Event) ser sinalizado; precisa de app context.
+    """
+    processos = processos or app.config['RELATORIOS_PROCESSOS']
+    os.makedirs(diretorio_tarefas_relatorio(), exist_ok=True)
+    
+    # Tarefas de despachantes que pararam; as de outros despachantes vivos continuam com eles
+    despachante = f'{socket.gethostname()}:{os.getpid()}'
+    registrar_batimento_relatorios(despachante, [])
+    reenfileirar_tarefas_abandonadas()
+    
+    def criar_pool():
+        return ProcessPoolExecutor(max_workers=processos, initializer=_iniciar_processo_relatorios)
+    
+    pool = criar_pool()
+    quebrado = False
+    em_andamento = {}
+    regeneracao = None
+    versao_regenerada = None
+    versao_mudou_em = None
+    ultima_limpeza = 0.0
+    ultimo_batimento = time.time()
+    try:
+        while parar is None or not parar.is_set():
+            if time.time() - ultimo_batimento >= app.config['RELATORIOS_BATIMENTO']:
+                registrar_batimento_relatorios(despachante, list(em_andamento.values()))
+                ultimo_batimento = time.time()
+            
+            for futuro in [futuro for futuro in em_andamento if futuro.done()]:
+                tarefa_id = em_andamento.pop(futuro)
+                try:
+                    concluir_tarefa_relatorio(tarefa_id, arquivo=futuro.result())
+                except BrokenProcessPool:
+                    # Um processo morreu (falta de memória, sinal): o pool inteiro é descartado
+                    quebrado = True
+                    concluir_tarefa_relatorio(tarefa_id, erro='O processo de geração foi interrompido')
+                except Exception as e:
+                    app.logger.warning(f'Erro ao gerar o relatório {tarefa_id}: {str(e)}')
+                    concluir_tarefa_relatorio(tarefa_id, erro=str(e))
+            
+            if regeneracao is not None and regeneracao.done():
+                try:
+                    regeneracao.result()
+                except BrokenProcessPool:
+                    quebrado = True
+                except Exception as e:
+                    app.logger.warning(f'Erro ao regenerar os relatórios em cache: {str(e)}')
+                regeneracao = None
+            
+            if quebrado and not em_andamento and regeneracao is None:
+                pool.shutdown(wait=False)
+                pool = criar_pool()
+                quebrado = False
+            
+            atraso = app.config['RELATORIO_PDF_ATRASO']
+            versao = versao_dados()
+            if atraso > 0 and versao != versao_regenerada and regeneracao is None:
+                versao_mudou_em = versao_mudou_em or time.time()
+                if not quebrado and time.time() - versao_mudou_em >= atraso:
+                    regeneracao = pool.submit(regenerar_relatorios_em_cache)
+                    versao_regenerada, versao_mudou_em = versao, None
+            
+            ocupados = len(em_andamento) + (regeneracao is not None)
+            while not quebrado and ocupados < processos:
+                tarefa = reservar_tarefa_relatorio()
+                if tarefa is None:
+                    break
+                futuro = pool.submit(executar_tarefa_relatorio, tarefa.id, tarefa.tipo,
+                                     json.loads(tarefa.parametros))
+                em_andamento[futuro] = tarefa.id
+                ocupados += 1
+            
+            if time.time() - ultima_limpeza > 60:
+                limpar_tarefas_relatorio()
+                ultima_limpeza = time.time()
+            
+            db.session.remove()
+            if em_andamento or regeneracao is not None:
+                wait([*em_andamento, *filter(None, [regeneracao])], timeout=intervalo,
+                     return_when=FIRST_COMPLETED)
+            elif parar is not None:
+                parar.wait(intervalo)
+            else:
+                time.sleep(intervalo)
+    finally:
+        pool.shutdown(wait=True)
+        # Sem o registro, as páginas voltam ao download direto na hora
+        db.session.rollback()
+        DespachanteRelatorio.query.filter_by(id=despachante).delete()
+        db.session.commit()
+
+def _laco_despachante_embutido():
+    while True:
+        with app.app_context():
+            try:
+                despachar_tarefas_relatorio()
+            except Exception as e:
+                app.logger.warning(f'Erro no despachante de relatórios: {str(e)}')
+            finally:
+                db.session.remove()
+        time.sleep(5)
+
+def iniciar_despachante_embutido():
+    """Subir o despachante numa thread deste processo (desenvolvimento / máquina única sem o comando)"""
+    global _despachante_pid
+    if _despachante_pid == os.getpid():
+        return
+    with _despachante_lock:
+        if _despachante_pid == os.getpid():
+            return
+        _despachante_pid = os.getpid()
+        threading.Thread(target=_laco_despachante_embutido, name='despachante-relatorios', daemon=True).start()
+
+@app.cli.command('processar-relatorios')
+@click.option('--processos', type=int, default=None,
+              help='Relatórios gerados ao mesmo tempo (padrão: RELATORIOS_PROCESSOS)')
+def comando_processar_relatorios(processos):
+    """Processar a fila de relatórios (rodar um por máquina)"""
+    # O serviço pode subir antes do web: garante que as tabelas existem
+    init_database()
+    click.echo(f"Processando relatórios com {processos or app.config['RELATORIOS_PROCESSOS']} processos")
+    despachar_tarefas_relatorio(processos)
+
+@app.route('/relatorios/tarefas', methods=['POST'])
+@login_required
+def criar_tarefa_relatorio():
+    """Enfileirar um relatório em PDF; responde na hora com a tarefa para acompanhamento"""
+    dados = request.get_json(silent=True) or request.form.to_dict()
+    tipo = dados.get('tipo', 'pdf')
+    
+    if tipo == 'pdf':
+        try:
+            dias_atividade = int(dados['dias']) if dados.get('dias') else None
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Parâmetro dias inválido'}), 400
+        parametros = {'dias': dias_atividade}
+    elif tipo == 'personalizado':
+        try:
+            parametros = ler_filtros_relatorio(dados)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    else:
+        return jsonify({'error': 'Tipo de relatório inválido'}), 400
+    
+    if not despachante_relatorios_ativo():
+        # Ninguém processaria a tarefa; o PDF geral continua em /relatorios/pdf
+        return jsonify({'error': 'Fila de relatórios indisponível',
+                        'download_url': url_for('relatorio_pdf', dias=parametros.get('dias'))}), 503
+    
+    return responder_tarefa_enfileirada(tipo, parametros)
+
+def responder_tarefa_enfileirada(tipo, parametros):
+    """202 com a tarefa criada para o usuário atual, ou 429 se ele já atingiu o limite"""
+    tarefa = enfileirar_relatorio(current_user.id, tipo, parametros)
+    if tarefa is None:
+        return jsonify({'error': 'Você já tem relatórios em geração'}), 429
+    
+    response = jsonify(tarefa.to_dict())
+    response.status_code = 202
+    response.headers['Location'] = url_for('status_tarefa_relatorio', id=tarefa.id)
+    return response
+
+def obter_tarefa_do_usuario(id):
+    tarefa = db.session.get(TarefaRelatorio, id)
+    # Tarefas de outros usuários também respondem 404, para não revelar IDs
+    if tarefa is None or tarefa.user_id != current_user.id:
+        abort(404)
+    return tarefa
+
+@app.route('/relatorios/tarefas/<id>')
+@login_required
+def status_tarefa_relatorio(id):
+    """Situação de uma tarefa de relatório (consultada periodicamente pela página)"""
+    response = jsonify(obter_tarefa_do_usuario(id).to_dict())
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/relatorios/tarefas/<id>/download')
+@login_required
+def baixar_tarefa_relatorio(id):
+    """Download do PDF de uma tarefa concluída"""
+    tarefa = obter_tarefa_do_usuario(id)
+    if tarefa.status != 'concluida':
+        return jsonify({'error': 'O relatório ainda não está pronto', 'status': tarefa.status}), 409
+    if not tarefa.arquivo or not os.path.exists(tarefa.arquivo):
+        return jsonify({'error': 'O relatório expirou; gere novamente'}), 410
+    
+    response = send_file(tarefa.arquivo, mimetype='application/pdf', as_attachment=True,
+                         download_name=f'relatorio_{tarefa.finished_at.strftime("%Y%m%d_%H%M%S")}.pdf',
+                         etag=tarefa.id, conditional=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 # Filtro personalizado para formatar datas no template
 @app.template_filter('strftime')
@@ -1075,4 +4222,8 @@ if __name__ == '__main__':
     port = int(os.environ.get('FLASK_PORT', 5000))
     debug = os.environ.get('FLASK_ENV', 'development') == 'development'
     
+    # Servidor de desenvolvimento é um processo só: ele mesmo processa a fila de relatórios
+    if 'RELATORIOS_WORKER_EMBUTIDO' not in os.environ:
+        app.config['RELATORIOS_WORKER_EMBUTIDO'] = True
+    
     app.run(host=host, port=port, debug=debug)
\ No newline at end of file
@@ -1,8 +1,17 @@
 #!/usr/bin/env python3
 """
 Script de inicialização para produção (Railway, Render, etc.)
+
+`python run.py stream` sobe o serviço de eventos ao vivo (/stream) com workers gevent.
 """
 import os
+import sys
+
+if sys.argv[1:] == ['stream']:
+    # O gevent precisa substituir socket/ssl antes que o app importe requests
+    from gevent import monkey
+    monkey.patch_all()
+
 from app import app, init_database
 
 # Inicializar banco de dados
@@ -18,10 +27,14 @@ if __name__ == '__main__':
         # Se gunicorn estiver disponível, usar ele
         try:
             import gunicorn.app.wsgiapp as wsgi
-            import sys
+            if sys.argv[1:] == ['stream']:
+                # Um worker gevent segura milhares de conexões SSE paradas
+                workers = ['-k', 'gevent', '-w', '1', '--worker-connections', '5000']
+            else:
+                workers = ['-w', '4']
             sys.argv = [
                 'gunicorn',
-                '-w', '4',
+                *workers,
                 '-b', f'{host}:{port}',
                 '--config', 'gunicorn.conf.py',
                 'app:app'
@@ -32,5 +45,7 @@ if __name__ == '__main__':
             print("Gunicorn não encontrado, usando Flask dev server")
             app.run(host=host, port=port, debug=False)
     else:
-        # Modo desenvolvimento
+        # Modo desenvolvimento: o próprio processo processa a fila de relatórios
+        if 'RELATORIOS_WORKER_EMBUTIDO' not in os.environ:
+            app.config['RELATORIOS_WORKER_EMBUTIDO'] = True
         app.run(host=host, port=port, debug=True)
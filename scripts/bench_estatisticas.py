@@ -0,0 +1,104 @@
+"""Benchmark das estatísticas do relatório e do dashboard.
+
+Compara as consultas antigas (um COUNT/GROUP BY sobre proposal para cada
+número) com resumo_estatisticas(), que lê EstatisticaProposta:
+
+    python scripts/bench_estatisticas.py --propostas 100000
+"""
+import argparse
+
+from dados_benchmark import caminho_padrao, gerar_banco, importar_app, melhor_tempo
+
+
+def estatisticas_antigas(m):
+    """As consultas de obter_dados_relatorio() e dashboard() antes de EstatisticaProposta"""
+    Proposal, Category, db, func, case = m.Proposal, m.Category, m.db, m.func, m.case
+
+    # Relatório
+    relatorio = {
+        'total_propostas': Proposal.query.count(),
+        'total_usuarios': m.User.query.count(),
+        'total_comentarios': m.Comment.query.count(),
+        'total_votos': m.Vote.query.count(),
+        'aprovadas': Proposal.query.filter_by(status='approved').count(),
+        'pendentes': Proposal.query.filter_by(status='pending').count(),
+        'em_andamento': Proposal.query.filter_by(status='in_progress').count(),
+        'por_categoria': {
+            linha.name: (linha.total, linha.aprovadas, linha.pendentes, linha.em_andamento)
+            for linha in db.session.query(
+                Category.name,
+                func.count(Proposal.id).label('total'),
+                func.sum(case((Proposal.status == 'approved', 1), else_=0)).label('aprovadas'),
+                func.sum(case((Proposal.status == 'pending', 1), else_=0)).label('pendentes'),
+                func.sum(case((Proposal.status == 'in_progress', 1), else_=0)).label('em_andamento')
+            ).join(Proposal, Category.id == Proposal.category).group_by(Category.id, Category.name)
+        },
+    }
+
+    # Dashboard
+    dashboard = {
+        'total_propostas': Proposal.query.count(),
+        'por_status': dict(db.session.query(Proposal.status, func.count(Proposal.id)).group_by(Proposal.status).all()),
+        'por_categoria': dict(db.session.query(Category.name, func.count(Proposal.id))
+                              .join(Proposal).group_by(Category.name).all()),
+    }
+    return relatorio, dashboard
+
+
+def estatisticas_novas(m):
+    """O mesmo conjunto de números a partir de resumo_estatisticas(), como o relatório e o dashboard"""
+    nomes = {categoria.id: categoria.name for categoria in m.Category.query}
+
+    resumo = m.resumo_estatisticas()
+    relatorio = {
+        'total_propostas': resumo['total_propostas'],
+        'total_usuarios': resumo['total_usuarios'],
+        'total_comentarios': resumo['total_comentarios'],
+        'total_votos': resumo['total_votos'],
+        'aprovadas': resumo['por_status']['approved'],
+        'pendentes': resumo['por_status']['pending'],
+        'em_andamento': resumo['por_status']['in_progress'],
+        'por_categoria': {
+            nomes[categoria]: (sum(por_status.values()), por_status.get('approved', 0),
+                               por_status.get('pending', 0), por_status.get('in_progress', 0))
+            for categoria, por_status in resumo['por_categoria'].items()
+        },
+    }
+
+    resumo = m.resumo_estatisticas()
+    dashboard = {
+        'total_propostas': resumo['total_propostas'],
+        'por_status': {status: total for status, total in resumo['por_status'].items() if total},
+        'por_categoria': {nomes[categoria]: sum(por_status.values())
+                          for categoria, por_status in resumo['por_categoria'].items()},
+    }
+    return relatorio, dashboard
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--propostas', type=int, default=100000,
+                        help='propostas; comentários e votos na mesma quantidade')
+    parser.add_argument('--banco', help='arquivo SQLite (criado se não existir)')
+    parser.add_argument('--repeticoes', type=int, default=5)
+    args = parser.parse_args()
+
+    caminho = args.banco or caminho_padrao(f'estatisticas-{args.propostas}')
+    m = importar_app(caminho)
+    gerar_banco(m, caminho, args.propostas, comentarios=args.propostas, votos=args.propostas)
+
+    with m.app.app_context():
+        antigas = estatisticas_antigas(m)
+        novas = estatisticas_novas(m)
+
+        print(f'{args.propostas} propostas, comentários e votos (menor de {args.repeticoes} execuções)')
+        print(f'  consultas antigas        {melhor_tempo(lambda: estatisticas_antigas(m), args.repeticoes):9.1f} ms')
+        print(f'  resumo_estatisticas()    {melhor_tempo(lambda: estatisticas_novas(m), args.repeticoes):9.1f} ms')
+        print(f'  reconstruir_estatisticas {melhor_tempo(m.reconstruir_estatisticas, 1):9.1f} ms')
+        print(f'  resultados iguais: {"sim" if antigas == novas else "NÃO"}')
+        if antigas != novas:
+            raise SystemExit(f'antigas: {antigas}\nnovas:   {novas}')
+
+
+if __name__ == '__main__':
+    main()
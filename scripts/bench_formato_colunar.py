@@ -0,0 +1,42 @@
+"""Benchmark do formato colunar da API do mapa (/api/map-proposals).
+
+Compara tamanho e tempo de resposta do JSON completo com ?formato=colunar:
+
+    python scripts/bench_formato_colunar.py --propostas 50000
+"""
+import argparse
+import gzip
+import time
+
+from dados_benchmark import caminho_padrao, gerar_banco, importar_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--propostas', type=int, default=50000)
+    parser.add_argument('--banco', help='arquivo SQLite (criado se não existir)')
+    parser.add_argument('--repeticoes', type=int, default=3)
+    args = parser.parse_args()
+    
+    caminho = args.banco or caminho_padrao(f'colunar-{args.propostas}')
+    m = importar_app(caminho)
+    # Descrições longas, como as digitadas no formulário
+    gerar_banco(m, caminho, args.propostas, tamanho_descricao=16)
+    
+    cliente = m.app.test_client()
+    print(f'{args.propostas} propostas, orjson {"ativo" if m.orjson is not None else "ausente"}')
+    for url in ('/api/map-proposals', '/api/map-proposals?formato=colunar',
+                '/api/proposals?cursor=', '/api/proposals?cursor=&formato=colunar'):
+        cliente.get(url)
+        tempos = []
+        for _ in range(args.repeticoes):
+            inicio = time.perf_counter()
+            resposta = cliente.get(url)
+            tempos.append(time.perf_counter() - inicio)
+        corpo = resposta.get_data()
+        print(f'{url:42} {len(corpo) / 1e3:9.1f} kB  gzip {len(gzip.compress(corpo)) / 1e3:8.1f} kB  '
+              f'{min(tempos) * 1000:8.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark do relatório personalizado em PDF com muitas propostas.
+
+Mede tempo, pico de memória (RSS) e tamanho do PDF gerado com todas as
+propostas no filtro. Cada medição roda num processo novo; --app-dir mede
+outro checkout (ex.: um `git worktree` de antes da geração em lotes):
+
+    python scripts/bench_relatorio_pdf.py --propostas 10000
+    python scripts/bench_relatorio_pdf.py --propostas 10000 --app-dir /tmp/meu-bairro-antigo
+"""
+import argparse
+import inspect
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from dados_benchmark import caminho_padrao, gerar_banco, importar_app
+
+
+def medir(caminho_banco, diretorio_app):
+    """Gerar o PDF uma vez neste processo e retornar as medidas"""
+    m = importar_app(caminho_banco, diretorio_app)
+    destino = os.path.join(tempfile.mkdtemp(prefix='meu-bairro-bench-'), 'relatorio.pdf')
+    with m.app.app_context():
+        linhas = m.filtrar_propostas_relatorio({}).count()
+        m.obter_dados_relatorio()  # aquecimento: consultas e imports do ReportLab
+        memoria_antes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        inicio = time.perf_counter()
+        if 'destino' in inspect.signature(m.gerar_relatorio_pdf).parameters:
+            m.gerar_relatorio_pdf(destino, filtros={})
+        else:
+            # Versões antigas retornam o PDF inteiro em bytes
+            with open(destino, 'wb') as arquivo:
+                arquivo.write(m.gerar_relatorio_pdf(filtros={}))
+        segundos = time.perf_counter() - inicio
+        memoria_depois = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'linhas': linhas,
+        'segundos': segundos,
+        # ru_maxrss é em kB no Linux
+        'pico_mb': (memoria_depois - memoria_antes) / 1024,
+        'pdf_mb': os.path.getsize(destino) / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--propostas', type=int, default=10000)
+    parser.add_argument('--banco', help='arquivo SQLite (criado se não existir)')
+    parser.add_argument('--app-dir', help='checkout cujo app.py gera o PDF (padrão: este)')
+    parser.add_argument('--repeticoes', type=int, default=1)
+    parser.add_argument('--medir', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    caminho = args.banco or caminho_padrao(f'relatorio-pdf-{args.propostas}')
+    if args.medir:
+        print(json.dumps(medir(caminho, args.app_dir)))
+        return
+
+    # O banco é sempre criado por este checkout; versões antigas só leem as tabelas que conhecem
+    if not os.path.exists(caminho):
+        gerar_banco(importar_app(caminho), caminho, args.propostas)
+
+    print(f'{args.propostas} propostas, app de {os.path.abspath(args.app_dir or os.path.dirname(os.path.dirname(__file__)))}')
+    for _ in range(args.repeticoes):
+        comando = [sys.executable, os.path.abspath(__file__), '--medir', '--banco', caminho]
+        if args.app_dir:
+            comando += ['--app-dir', args.app_dir]
+        saida = subprocess.run(comando, check=True, capture_output=True, text=True).stdout
+        medida = json.loads(saida.strip().splitlines()[-1])
+        print(f"  {medida['linhas']} linhas: {medida['segundos']:7.1f} s  pico de RSS +{medida['pico_mb']:6.1f} MB  "
+              f"PDF {medida['pdf_mb']:5.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark do ranking de usuários mais ativos do relatório.
+
+Compara a consulta antiga (User com outer join em Proposal e Comment antes
+do GROUP BY) com usuarios_mais_ativos(), que agrega cada tabela por usuário
+antes do join. 20 usuários escrevem 60% dos comentários:
+
+    python scripts/bench_usuarios_ativos.py --propostas 10000
+    python scripts/bench_usuarios_ativos.py --propostas 100000 --sem-antiga
+"""
+import argparse
+from datetime import datetime
+
+from dados_benchmark import caminho_padrao, gerar_banco, importar_app, melhor_tempo
+
+
+def ranking_antigo(m):
+    """A consulta de obter_dados_relatorio() antes de usuarios_mais_ativos()"""
+    return m.db.session.query(
+        m.User,
+        m.func.count(m.Proposal.id).label('total_propostas'),
+        m.func.count(m.Comment.id).label('total_comentarios')
+    ).outerjoin(m.Proposal, m.User.id == m.Proposal.author_id)\
+     .outerjoin(m.Comment, m.User.id == m.Comment.user_id)\
+     .group_by(m.User.id)\
+     .order_by(m.func.count(m.Proposal.id).desc())\
+     .limit(10).all()
+
+
+def conferir(m, ranking, desde=None):
+    """Comparar as contagens do ranking com um COUNT direto por usuário"""
+    for usuario, *totais in ranking:
+        esperado = []
+        for modelo, coluna_usuario in ((m.Proposal, m.Proposal.author_id), (m.Comment, m.Comment.user_id),
+                                       (m.Vote, m.Vote.user_id))[:len(totais)]:
+            consulta = modelo.query.filter(coluna_usuario == usuario.id)
+            if desde is not None:
+                consulta = consulta.filter(modelo.created_at >= desde)
+            esperado.append(consulta.count())
+        if esperado != totais:
+            raise SystemExit(f'usuário {usuario.id}: ranking {totais}, esperado {esperado}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--propostas', type=int, default=10000,
+                        help='propostas; 4x comentários e 2x votos')
+    parser.add_argument('--banco', help='arquivo SQLite (criado se não existir)')
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--sem-antiga', action='store_true',
+                        help='não medir a consulta antiga (minutos a partir de 100 mil propostas)')
+    args = parser.parse_args()
+
+    caminho = args.banco or caminho_padrao(f'usuarios-ativos-{args.propostas}')
+    m = importar_app(caminho)
+    gerar_banco(m, caminho, args.propostas, comentarios=4 * args.propostas, votos=2 * args.propostas,
+                concentracao=0.6)
+    # Últimos 30 dias dos dados gerados (que se espalham por 2024)
+    desde = datetime(2024, 11, 28)
+
+    with m.app.app_context():
+        variantes = [
+            ('usuarios_mais_ativos()', lambda: m.usuarios_mais_ativos(), None),
+            ('  + votos', lambda: m.usuarios_mais_ativos(incluir_votos=True), None),
+            ('  + votos, últimos 30 dias', lambda: m.usuarios_mais_ativos(desde=desde, incluir_votos=True), desde),
+        ]
+        print(f'{args.propostas} propostas, {4 * args.propostas} comentários, {2 * args.propostas} votos')
+        if not args.sem_antiga:
+            print(f'  {"consulta antiga":28} {melhor_tempo(lambda: ranking_antigo(m), 1):10.1f} ms')
+            usuario, propostas, comentarios = ranking_antigo(m)[0]
+            print(f'    1º lugar: {propostas} propostas / {comentarios} comentários (produto do join)')
+        for nome, funcao, janela in variantes:
+            print(f'  {nome:28} {melhor_tempo(funcao, args.repeticoes):10.1f} ms')
+            conferir(m, funcao(), janela)
+        usuario, propostas, comentarios = m.usuarios_mais_ativos()[0]
+        print(f'    1º lugar: {propostas} propostas / {comentarios} comentários (conferido com COUNT direto)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Banco SQLite sintético usado pelos scripts de benchmark (scripts/bench_*.py).
+
+Os scripts importam o app depois de apontar DATABASE_URL para o banco do
+benchmark, então cada um roda isolado do banco de desenvolvimento.
+"""
+import importlib
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATUS = ['pending', 'approved', 'in_progress', 'completed', 'rejected']
+# Usuários "pesados" que concentram parte das propostas e comentários
+USUARIOS_PESADOS = 20
+
+
+def caminho_padrao(nome):
+    return os.path.join(tempfile.gettempdir(), f'meu-bairro-bench-{nome}.db')
+
+
+def importar_app(caminho_banco, diretorio_app=None):
+    """Importar app.py (deste checkout ou de diretorio_app) usando o banco informado (arquivo ou URL)"""
+    if '://' in caminho_banco:
+        os.environ['DATABASE_URL'] = caminho_banco
+    else:
+        os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(caminho_banco)}'
+    os.environ.setdefault('RELATORIO_PDF_ATRASO', '0')
+    # Caches em disco fora do instance/ do projeto
+    temporario = tempfile.mkdtemp(prefix='meu-bairro-bench-')
+    for variavel, nome in (('TILE_CACHE_DIR', 'tiles'), ('RELATORIO_CACHE_DIR', 'relatorios'),
+                           ('EVENTOS_SOCKET_DIR', 'eventos'), ('VOTOS_BUFFER_PATH', 'votos_pendentes.db')):
+        os.environ.setdefault(variavel, os.path.join(temporario, nome))
+    sys.path.insert(0, os.path.abspath(diretorio_app or RAIZ))
+    return importlib.import_module('app')
+
+
+def gerar_banco(m, caminho, propostas, comentarios=0, votos=0, usuarios=None,
+                concentracao=0.0, tamanho_descricao=4, semente=1):
+    """Criar o banco com propostas, comentários e votos aleatórios, se ainda não existir.
+    
+    concentracao é a fração dos comentários escrita pelos USUARIOS_PESADOS
+    (metade disso para as propostas). As datas se espalham por 2024.
+    """
+    if os.path.exists(caminho):
+        return False
+    
+    m.init_database()
+    with m.app.app_context():
+        categorias = [c.id for c in m.Category.query.all()]
+        m.db.engine.dispose()
+    
+    aleatorio = random.Random(semente)
+    usuarios = usuarios or max(100, propostas // 20)
+    
+    def autor(fracao):
+        if aleatorio.random() < fracao:
+            return aleatorio.randint(1, min(USUARIOS_PESADOS, usuarios))
+        return aleatorio.randint(1, usuarios)
+    
+    def data():
+        return '2024-%02d-%02d %02d:%02d:%02d' % (aleatorio.randint(1, 12), aleatorio.randint(1, 28),
+                                                 aleatorio.randint(0, 23), aleatorio.randint(0, 59),
+                                                 aleatorio.randint(0, 59))
+    
+    con = sqlite3.connect(caminho)
+    con.executemany(
+        "INSERT INTO user (id, email, name, password_hash, created_at) VALUES (?, ?, ?, ?, '2024-01-01')",
+        ((i, f'usuario{i}@bench', f'Usuário {i}', 'x') for i in range(1, usuarios + 1))
+    )
+    con.executemany(
+        'INSERT INTO proposal (id, title, description, category, latitude, longitude, address, status, '
+        'priority, votes_count, comments_count, author_id, created_at, updated_at) '
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'medium', 0, 0, ?, ?, ?)",
+        ((i, f'Proposta {i} para o bairro', 'Descrição da proposta número %d. ' % i * tamanho_descricao,
+          aleatorio.choice(categorias), -23.55 + aleatorio.uniform(-0.3, 0.3), -46.63 + aleatorio.uniform(-0.3, 0.3),
+          f'Rua {i}, Centro, São Paulo - SP', aleatorio.choice(STATUS), autor(concentracao / 2), data(), data())
+         for i in range(1, propostas + 1))
+    )
+    con.executemany(
+        "INSERT INTO comment (proposal_id, user_id, content, created_at) VALUES (?, ?, 'Comentário', ?)",
+        ((aleatorio.randint(1, propostas), autor(concentracao), data()) for _ in range(comentarios))
+    )
+    con.executemany(
+        'INSERT OR IGNORE INTO vote (proposal_id, user_id, created_at) VALUES (?, ?, ?)',
+        ((aleatorio.randint(1, propostas), aleatorio.randint(1, usuarios), data()) for _ in range(votos))
+    )
+    con.execute('UPDATE proposal SET '
+                'votes_count = (SELECT count(*) FROM vote WHERE proposal_id = proposal.id), '
+                'comments_count = (SELECT count(*) FROM comment WHERE proposal_id = proposal.id)')
+    con.commit()
+    con.execute('ANALYZE')
+    con.close()
+    
+    with m.app.app_context():
+        m.reconstruir_estatisticas()
+        m.configurar_busca_textual(reconstruir=True)
+        m.configurar_indice_espacial(reconstruir=True)
+    return True
+
+
+def melhor_tempo(funcao, repeticoes=5):
+    """Menor tempo (ms) de `repeticoes` execuções, depois de uma de aquecimento"""
+    import time
+    funcao()
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos) * 1000
@@ -0,0 +1,117 @@
+"""Configuração dos testes: banco SQLite e diretórios de cache temporários por teste"""
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+# O app lê a configuração do ambiente na importação
+_DIRETORIO = tempfile.mkdtemp(prefix='meu-bairro-testes-')
+_BANCO = os.path.join(_DIRETORIO, 'testes.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{_BANCO}'
+os.environ['TILE_CACHE_DIR'] = os.path.join(_DIRETORIO, 'tiles')
+os.environ['RELATORIO_CACHE_DIR'] = os.path.join(_DIRETORIO, 'relatorios')
+os.environ['EVENTOS_SOCKET_DIR'] = os.path.join(_DIRETORIO, 'eventos')
+os.environ['VOTOS_BUFFER_PATH'] = os.path.join(_DIRETORIO, 'votos_pendentes.db')
+os.environ['RELATORIO_PDF_ATRASO'] = '0'
+os.environ.pop('VOTOS_WRITE_BEHIND', None)
+os.environ.pop('RELATORIOS_WORKER_EMBUTIDO', None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as aplicacao  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """Aplicação com um banco novo, já inicializado (categorias, índices, busca)"""
+    with aplicacao.app.app_context():
+        aplicacao.db.session.remove()
+        aplicacao.db.engine.dispose()
+    for sufixo in ('', '-wal', '-shm'):
+        if os.path.exists(_BANCO + sufixo):
+            os.remove(_BANCO + sufixo)
+    for chave in ('TILE_CACHE_DIR', 'RELATORIO_CACHE_DIR'):
+        shutil.rmtree(aplicacao.app.config[chave], ignore_errors=True)
+    
+    aplicacao.init_database()
+    aplicacao.app.config['TESTING'] = True
+    with aplicacao.app.app_context():
+        yield aplicacao.app
+        aplicacao.db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def criar_usuario(app):
+    contador = iter(range(1, 1_000_000))
+    
+    def criar(nome=None, senha='senha123'):
+        numero = next(contador)
+        usuario = aplicacao.User(email=f'usuario{numero}@teste.com', name=nome or f'Usuário {numero}')
+        usuario.set_password(senha)
+        aplicacao.db.session.add(usuario)
+        aplicacao.db.session.commit()
+        return usuario
+    
+    return criar
+
+
+@pytest.fixture
+def criar_propostas(app, criar_usuario):
+    """Criar n propostas distribuídas entre autores, categorias e status"""
+    categorias = ['iluminacao', 'arborizacao', 'seguranca', 'transporte']
+    status = ['pending', 'approved', 'in_progress']
+    
+    def criar(n, autores=3, inicio=datetime(2024, 1, 1)):
+        usuarios = [criar_usuario() for _ in range(autores)]
+        propostas = []
+        for i in range(n):
+            propostas.append(aplicacao.Proposal(
+                title=f'Proposta {i}',
+                description=f'Descrição da proposta {i}',
+                category=categorias[i % len(categorias)],
+                status=status[i % len(status)],
+                latitude=-23.55 + i * 0.0001,
+                longitude=-46.63 + i * 0.0001,
+                address=f'Rua {i}, São Paulo - SP',
+                author_id=usuarios[i % autores].id,
+                created_at=inicio + timedelta(hours=i)
+            ))
+        aplicacao.db.session.add_all(propostas)
+        aplicacao.db.session.commit()
+        return propostas
+    
+    return criar
+
+
+@pytest.fixture
+def criar_proposta(app, criar_usuario):
+    """Criar uma proposta com os campos informados (os demais com valores padrão)"""
+    autor = []
+    
+    def criar(**campos):
+        if not autor:
+            autor.append(criar_usuario())
+        valores = {
+            'title': 'Proposta', 'description': 'Descrição', 'category': 'iluminacao',
+            'status': 'pending', 'latitude': -23.55, 'longitude': -46.63,
+            'address': 'Rua Teste, São Paulo - SP', 'author_id': autor[0].id
+        }
+        valores.update(campos)
+        proposta = aplicacao.Proposal(**valores)
+        aplicacao.db.session.add(proposta)
+        aplicacao.db.session.commit()
+        return proposta
+    
+    return criar
+
+
+def login(client, usuario, senha='senha123'):
+    return client.post('/login', json={'email': usuario.email, 'password': senha})
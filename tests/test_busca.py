@@ -0,0 +1,58 @@
+"""Busca textual (FTS5): acentos, ordem por relevância e sincronização pelos gatilhos"""
+from sqlalchemy import text
+
+from app import db, filtrar_propostas
+
+
+def buscar(termo):
+    return [proposta.id for proposta in filtrar_propostas(search=termo)]
+
+
+def indexados(termo):
+    """IDs que o índice FTS encontra, direto na tabela virtual"""
+    return sorted(linha[0] for linha in db.session.execute(
+        text('SELECT rowid FROM proposal_fts WHERE proposal_fts MATCH :termo'), {'termo': termo}))
+
+
+def test_busca_ignora_acentos_nos_dois_sentidos(criar_proposta):
+    acentuada = criar_proposta(title='Iluminação da praça', description='Postes apagados')
+    sem_acento = criar_proposta(title='Calcada quebrada', description='Conserto da calcada na esquina')
+    
+    assert buscar('iluminacao') == [acentuada.id]
+    assert buscar('ILUMINAÇÃO') == [acentuada.id]
+    assert buscar('calçada') == [sem_acento.id]
+    # Prefixo enquanto o usuário digita
+    assert buscar('ilumin') == [acentuada.id]
+
+
+def test_resultados_em_ordem_de_relevancia(client, criar_proposta):
+    so_descricao = criar_proposta(title='Pedido', description='Falta arborização no canteiro, ' + 'texto ' * 40)
+    titulo = criar_proposta(title='Arborização da avenida', description='Plantio de árvores')
+    titulo_e_descricao = criar_proposta(title='Arborização urgente', description='Arborização do bairro todo')
+    
+    esperado = [titulo_e_descricao.id, titulo.id, so_descricao.id]
+    assert buscar('arborizacao') == esperado
+    
+    resposta = client.get('/api/proposals?search=arborizacao')
+    assert [proposta['id'] for proposta in resposta.get_json()['proposals']] == esperado
+
+
+def test_gatilhos_mantem_o_indice_sincronizado(criar_proposta):
+    proposta = criar_proposta(title='Buraco na rua', description='Asfalto')
+    assert indexados('buraco') == [proposta.id]
+    
+    proposta.title = 'Semáforo quebrado'
+    db.session.commit()
+    assert indexados('buraco') == []
+    assert indexados('semaforo') == [proposta.id]
+    
+    # Campos fora do índice não disparam o gatilho de atualização, e o índice continua igual
+    proposta.status = 'approved'
+    db.session.commit()
+    assert indexados('semaforo') == [proposta.id]
+    
+    db.session.delete(proposta)
+    db.session.commit()
+    assert indexados('semaforo') == []
+    # integrity-check com rank = 1 falha se o índice divergir do conteúdo de proposal
+    db.session.execute(text("INSERT INTO proposal_fts(proposal_fts, rank) VALUES ('integrity-check', 1)"))
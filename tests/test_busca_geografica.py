@@ -0,0 +1,86 @@
+"""Busca por raio: pré-filtro pelo índice espacial e distância exata por Haversine"""
+import math
+
+import pytest
+
+import app as aplicacao
+from app import Proposal, db
+
+CENTRO = (-23.55, -46.63)
+RAIO_TERRA_KM = 6371.0088
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Referência independente da do app"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin(math.radians(lat2 - lat1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2)
+    return 2 * RAIO_TERRA_KM * math.asin(math.sqrt(a))
+
+
+def ponto_a(distancia_km, direcao):
+    """Ponto a `distancia_km` do centro na direção norte, sul, leste ou oeste"""
+    lat, lng = CENTRO
+    angulo = distancia_km / RAIO_TERRA_KM
+    if direcao in ('norte', 'sul'):
+        return lat + math.degrees(angulo) * (1 if direcao == 'norte' else -1), lng
+    # Mesma latitude: sin²(Δλ/2)·cos²φ = sin²(d/2R)
+    delta = math.degrees(2 * math.asin(math.sin(angulo / 2) / math.cos(math.radians(lat))))
+    return lat, lng + delta * (1 if direcao == 'leste' else -1)
+
+
+def buscar(client, raio, **params):
+    resposta = client.get('/api/buscar-propostas', query_string={
+        'lat': CENTRO[0], 'lng': CENTRO[1], 'raio': raio, **params})
+    assert resposta.status_code == 200
+    return resposta.get_json()['propostas']
+
+
+@pytest.mark.parametrize('raio', [0.5, 2.0])
+def test_pontos_na_borda_do_raio(client, criar_proposta, raio):
+    dentro, fora = set(), set()
+    for direcao in ('norte', 'sul', 'leste', 'oeste'):
+        # Um metro para dentro e um metro para fora da circunferência
+        for distancia, grupo in ((raio - 0.001, dentro), (raio + 0.001, fora)):
+            lat, lng = ponto_a(distancia, direcao)
+            assert (haversine(*CENTRO, lat, lng) <= raio) == (grupo is dentro)
+            grupo.add(criar_proposta(title=f'{direcao} {distancia}', latitude=lat, longitude=lng).id)
+
+    propostas = buscar(client, raio)
+
+    assert {p['id'] for p in propostas} == dentro
+    for proposta in propostas:
+        esperado = haversine(*CENTRO, proposta['latitude'], proposta['longitude'])
+        assert proposta['distancia_km'] == pytest.approx(esperado, abs=0.001)
+
+
+def test_canto_do_retangulo_passa_no_indice_mas_nao_na_distancia(client, criar_proposta):
+    raio = 1.0
+    lat_min, lat_max, lng_min, lng_max = aplicacao.calcular_area(*CENTRO, raio)
+    # Perto do canto nordeste: dentro do retângulo, a ~1,4 km do centro
+    canto = criar_proposta(title='Canto', latitude=lat_max - 1e-4, longitude=lng_max - 1e-4)
+    centro = criar_proposta(title='Centro', latitude=CENTRO[0], longitude=CENTRO[1])
+    assert haversine(*CENTRO, canto.latitude, canto.longitude) > raio
+
+    candidatos = aplicacao.filtrar_por_area(Proposal.query, lat_min, lat_max, lng_min, lng_max)
+    assert {p.id for p in candidatos} == {canto.id, centro.id}
+
+    assert [p['id'] for p in buscar(client, raio)] == [centro.id]
+
+
+def test_resultado_ordenado_por_distancia_e_limitado(client, criar_proposta):
+    ids = [criar_proposta(latitude=lat, longitude=lng).id
+           for lat, lng in (ponto_a(0.3, 'leste'), ponto_a(0.1, 'sul'), ponto_a(0.2, 'norte'))]
+
+    assert [p['id'] for p in buscar(client, 1.0)] == [ids[1], ids[2], ids[0]]
+    assert [p['id'] for p in buscar(client, 1.0, limite=2)] == [ids[1], ids[2]]
+
+
+def test_pontos_movidos_acompanham_o_indice(client, criar_proposta):
+    proposta = criar_proposta(latitude=CENTRO[0], longitude=CENTRO[1])
+    assert [p['id'] for p in buscar(client, 1.0)] == [proposta.id]
+
+    proposta.latitude, proposta.longitude = ponto_a(1.5, 'norte')
+    db.session.commit()
+    assert buscar(client, 1.0) == []
+    assert [p['id'] for p in buscar(client, 2.0)] == [proposta.id]
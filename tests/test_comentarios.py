@@ -0,0 +1,85 @@
+"""Comentários de uma proposta paginados por cursor em /api/proposals/<id>/comments"""
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import Comment, db
+
+
+def cursor_de(dados):
+    return base64.urlsafe_b64encode(json.dumps(dados).encode()).decode().rstrip('=')
+
+
+def comentar(proposta, usuario, criado_em, texto='Comentário'):
+    comentario = Comment(proposal_id=proposta.id, user_id=usuario.id, content=texto, created_at=criado_em)
+    db.session.add(comentario)
+    db.session.commit()
+    return comentario
+
+
+def percorrer(client, proposta_id, entre_paginas=None):
+    ids, cursor, paginas = [], None, 0
+    while True:
+        url = f'/api/proposals/{proposta_id}/comments' + (f'?cursor={cursor}' if cursor else '')
+        dados = client.get(url).get_json()
+        ids.extend(c['id'] for c in dados['comments'])
+        paginas += 1
+        assert dados['has_next'] == (dados['next_cursor'] is not None)
+        cursor = dados['next_cursor']
+        if cursor is None:
+            return ids, paginas
+        if entre_paginas:
+            entre_paginas()
+
+
+def test_cada_comentario_uma_vez_e_em_ordem(client, criar_usuario, criar_propostas):
+    proposta, outra = criar_propostas(2)
+    usuario = criar_usuario()
+    inicio = datetime(2024, 3, 1)
+    # Grupos de três com o mesmo created_at: o id desfaz o empate entre páginas
+    comentarios = [comentar(proposta, usuario, inicio + timedelta(minutes=i // 3)) for i in range(47)]
+    comentar(outra, usuario, inicio)
+
+    ids, paginas = percorrer(client, proposta.id)
+
+    esperado = [c.id for c in sorted(comentarios, key=lambda c: (c.created_at, c.id), reverse=True)]
+    assert ids == esperado
+    assert paginas == 3  # 20 + 20 + 7
+
+
+def test_comentarios_novos_nao_repetem_nem_pulam_os_antigos(client, criar_usuario, criar_propostas):
+    proposta = criar_propostas(1)[0]
+    usuario = criar_usuario()
+    antigos = [comentar(proposta, usuario, datetime(2024, 3, 1) + timedelta(minutes=i)).id for i in range(45)]
+    novos = []
+
+    def chegar_comentario():
+        novos.append(comentar(proposta, usuario, datetime(2024, 4, 1) + timedelta(minutes=len(novos))).id)
+
+    ids, _ = percorrer(client, proposta.id, entre_paginas=chegar_comentario)
+
+    assert ids == antigos[::-1]
+    assert len(novos) == 2
+    # Uma nova leitura do início traz os novos antes dos antigos
+    assert percorrer(client, proposta.id)[0] == novos[::-1] + antigos[::-1]
+
+
+@pytest.mark.parametrize('cursor', [
+    'lixo!',
+    cursor_de([1, 2]),
+    cursor_de({'c': '2024-03-01T00:00:00'}),
+    cursor_de({'c': 'ontem', 'i': 3}),
+    cursor_de({'c': '2024-03-01T00:00:00', 'i': 'três'}),
+    cursor_de({'c': None, 'i': 3}),
+])
+def test_cursor_malformado_responde_400(client, criar_propostas, cursor):
+    proposta = criar_propostas(1)[0]
+    resposta = client.get(f'/api/proposals/{proposta.id}/comments?cursor={cursor}')
+    assert resposta.status_code == 400
+    assert resposta.get_json() == {'erro': 'Cursor inválido'}
+
+
+def test_proposta_inexistente_responde_404(client):
+    assert client.get('/api/proposals/999/comments').status_code == 404
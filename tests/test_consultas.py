@@ -0,0 +1,89 @@
+"""Número de comandos SQL por endpoint não pode crescer com o número de propostas (N+1)"""
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app import Comment, db
+from conftest import login
+
+ENDPOINTS = [
+    '/',
+    '/?category=iluminacao',
+    '/?status=approved',
+    '/api/proposals',
+    '/api/proposals?category=seguranca&status=pending',
+    '/api/proposals?cursor=',
+    '/api/proposals?cursor=&formato=colunar',
+    '/api/map-proposals',
+    '/api/map-proposals?formato=colunar',
+    '/api/map-proposals?bbox=-47,-24,-46,-23&zoom=18',
+    '/api/map-proposals?bbox=-47,-24,-46,-23&zoom=10',
+    '/mapa',
+    '/dashboard',
+    '/relatorios',
+]
+
+
+@contextmanager
+def contar_comandos():
+    comandos = []
+    
+    def registrar(conn, cursor, statement, parameters, context, executemany):
+        comandos.append(statement)
+    
+    event.listen(db.engine, 'before_cursor_execute', registrar)
+    try:
+        yield comandos
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', registrar)
+
+
+def comandos_por_endpoint(client):
+    resultado = {}
+    for url in ENDPOINTS:
+        client.get(url)  # primeira chamada aquece caches de processo
+        with contar_comandos() as comandos:
+            resposta = client.get(url)
+        assert resposta.status_code == 200, url
+        resultado[url] = len(comandos)
+    return resultado
+
+
+@pytest.mark.parametrize('pequeno,grande', [(10, 40)])
+def test_comandos_sql_nao_crescem_com_os_dados(app, client, criar_usuario, criar_propostas, pequeno, grande):
+    usuario = criar_usuario()
+    login(client, usuario)
+    
+    propostas = criar_propostas(pequeno)
+    for proposta in propostas:
+        db.session.add(Comment(proposal_id=proposta.id, user_id=usuario.id, content='Comentário'))
+    db.session.commit()
+    antes = comandos_por_endpoint(client)
+    
+    propostas = criar_propostas(grande - pequeno, autores=10)
+    for proposta in propostas:
+        db.session.add(Comment(proposal_id=proposta.id, user_id=usuario.id, content='Comentário'))
+    db.session.commit()
+    depois = comandos_por_endpoint(client)
+    
+    assert depois == antes
+
+
+def test_detalhes_da_proposta_nao_carregam_comentarios_um_a_um(app, client, criar_usuario, criar_propostas):
+    proposta = criar_propostas(1)[0]
+    usuarios = [criar_usuario() for _ in range(15)]
+    
+    def contar():
+        client.get(f'/proposta/{proposta.id}')
+        with contar_comandos() as comandos:
+            assert client.get(f'/proposta/{proposta.id}').status_code == 200
+        return len(comandos)
+    
+    db.session.add(Comment(proposal_id=proposta.id, user_id=usuarios[0].id, content='Primeiro'))
+    db.session.commit()
+    antes = contar()
+    
+    db.session.add_all([Comment(proposal_id=proposta.id, user_id=u.id, content='Outro') for u in usuarios])
+    db.session.commit()
+    assert contar() == antes
@@ -0,0 +1,23 @@
+"""Estatísticas desnormalizadas: reconstrução na inicialização"""
+import app as aplicacao
+from app import EstatisticaProposta, Proposal, db
+
+
+def test_falha_ao_reconstruir_estatisticas_nao_apaga_o_banco(app, criar_propostas, monkeypatch, caplog):
+    ids = sorted(p.id for p in criar_propostas(5))
+    EstatisticaProposta.query.delete()
+    db.session.commit()
+
+    def falhar():
+        raise RuntimeError('banco ocupado')
+
+    monkeypatch.setattr(aplicacao, 'reconstruir_estatisticas', falhar)
+    aplicacao.init_database()
+
+    assert sorted(id_ for (id_,) in db.session.query(Proposal.id)) == ids
+    assert 'Não foi possível reconstruir as estatísticas: banco ocupado' in caplog.text
+
+    # A próxima inicialização sem falha reconstrói o resumo
+    monkeypatch.undo()
+    aplicacao.init_database()
+    assert aplicacao.resumo_estatisticas()['total_propostas'] == 5
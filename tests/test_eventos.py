@@ -0,0 +1,50 @@
+"""Eventos ao vivo: /stream só em servidores assíncronos e páginas só com SSE_ATIVO"""
+import pytest
+
+from app import app as aplicacao
+
+SERVIDOR_DESENVOLVIMENTO = {'wsgi.multithread': True, 'SERVER_SOFTWARE': 'Werkzeug/3.0.1'}
+
+
+@pytest.fixture
+def sse_ativo(app):
+    app.config.update(SSE_ATIVO=True, SSE_URL='https://stream.exemplo.com')
+    yield
+    app.config.update(SSE_ATIVO=False, SSE_URL='')
+
+
+@pytest.mark.parametrize('servidor', [
+    {},  # worker sync: um processo por requisição
+    {'wsgi.multithread': True, 'SERVER_SOFTWARE': 'gunicorn/21.2.0'},  # gthread
+])
+def test_stream_em_worker_sync_responde_204(client, servidor):
+    resposta = client.get('/stream?proposta=1', environ_overrides=servidor)
+    assert resposta.status_code == 204
+    assert resposta.data == b''
+
+
+def test_stream_no_servidor_de_desenvolvimento(client):
+    resposta = client.get('/stream?proposta=1', environ_overrides=SERVIDOR_DESENVOLVIMENTO, buffered=False)
+    try:
+        assert resposta.status_code == 200
+        assert resposta.mimetype == 'text/event-stream'
+        assert resposta.headers['Access-Control-Allow-Origin'] == '*'
+        assert next(resposta.response) == b'retry: 3000\n\n'
+    finally:
+        resposta.close()
+
+
+def test_paginas_sem_sse_ativo_nao_abrem_event_source(client, criar_propostas):
+    proposta = criar_propostas(1)[0]
+    assert aplicacao.config['SSE_ATIVO'] is False
+
+    assert 'new EventSource' not in client.get(f'/proposta/{proposta.id}').get_data(as_text=True)
+    assert 'const streamUrl = null;' in client.get('/mapa').get_data(as_text=True)
+
+
+def test_paginas_com_sse_ativo_usam_o_servico_de_stream(client, criar_propostas, sse_ativo):
+    proposta = criar_propostas(1)[0]
+
+    detalhes = client.get(f'/proposta/{proposta.id}').get_data(as_text=True)
+    assert f'new EventSource("https://stream.exemplo.com/stream?proposta={proposta.id}")' in detalhes
+    assert 'const streamUrl = "https://stream.exemplo.com/stream";' in client.get('/mapa').get_data(as_text=True)
@@ -0,0 +1,342 @@
+"""Geocodificação: cache em dois níveis e lotes validados antes de qualquer consulta externa"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as aplicacao
+from app import GeocodeCache, db
+from conftest import login
+
+RESULTADO = {'sucesso': True, 'resultados': [{'endereco': 'Rua Augusta', 'latitude': -23.55, 'longitude': -46.65}]}
+
+
+@pytest.fixture(autouse=True)
+def cache_vazio(app):
+    """O cache em memória e os contadores são do processo: zerar entre os testes"""
+    aplicacao._geocode_lru.clear()
+    for evento in aplicacao.estatisticas_geocodificacao:
+        aplicacao.estatisticas_geocodificacao[evento] = 0
+    yield
+    for futuro in list(aplicacao._consultas_em_andamento.values()):
+        futuro.result(timeout=5)
+    aplicacao._geocode_lru.clear()
+
+
+class Upstream:
+    """Substituto do serviço externo que conta as chamadas"""
+
+    def __init__(self, resultado=RESULTADO):
+        self.resultado = resultado
+        self.chamadas = 0
+        self.liberar = threading.Event()
+        self.liberar.set()
+
+    def __call__(self):
+        self.chamadas += 1
+        self.liberar.wait(5)
+        return self.resultado
+
+
+def contadores():
+    return {evento: total for evento, total in aplicacao.estatisticas_geocodificacao.items() if total}
+
+
+def test_segunda_consulta_vem_da_memoria(app):
+    upstream = Upstream()
+
+    assert aplicacao.obter_geocodificacao('endereco:rua augusta', upstream, timedelta(days=7)) == RESULTADO
+    assert aplicacao.obter_geocodificacao('endereco:rua augusta', upstream, timedelta(days=7)) == RESULTADO
+
+    assert upstream.chamadas == 1
+    assert contadores() == {'miss': 1, 'hit_memoria': 1}
+
+
+def test_sem_a_memoria_cai_para_a_tabela(app):
+    upstream = Upstream()
+    aplicacao.obter_geocodificacao('cep:01310100', upstream, timedelta(days=30))
+    registro = db.session.get(GeocodeCache, 'cep:01310100')
+    assert json.loads(registro.resultado) == RESULTADO
+
+    # Outro worker: memória vazia, mesmo banco
+    aplicacao._geocode_lru.clear()
+    assert aplicacao.obter_geocodificacao('cep:01310100', upstream, timedelta(days=30)) == RESULTADO
+    assert aplicacao.obter_geocodificacao('cep:01310100', upstream, timedelta(days=30)) == RESULTADO
+
+    assert upstream.chamadas == 1
+    assert contadores() == {'miss': 1, 'hit_banco': 1, 'hit_memoria': 1}
+
+
+def test_entrada_vencida_e_servida_na_hora_e_atualizada_em_segundo_plano(app):
+    antigo = {'sucesso': True, 'resultados': [{'endereco': 'Antigo', 'latitude': 0.0, 'longitude': 0.0}]}
+    db.session.add(GeocodeCache(chave='endereco:rua augusta', resultado=json.dumps(antigo),
+                                expira_em=datetime.utcnow() - timedelta(hours=1),
+                                descartar_em=datetime.utcnow() + timedelta(days=1)))
+    db.session.commit()
+    upstream = Upstream()
+    upstream.liberar.clear()  # o serviço externo só responde quando o teste deixar
+
+    assert aplicacao.obter_geocodificacao('endereco:rua augusta', upstream, timedelta(days=7)) == antigo
+    assert contadores() == {'hit_stale': 1, 'revalidacoes': 1}
+
+    futuro = aplicacao._consultas_em_andamento['endereco:rua augusta']
+    upstream.liberar.set()
+    assert futuro.result(timeout=5) == RESULTADO
+
+    assert aplicacao.obter_geocodificacao('endereco:rua augusta', upstream, timedelta(days=7)) == RESULTADO
+    db.session.expire_all()
+    registro = db.session.get(GeocodeCache, 'endereco:rua augusta')
+    assert json.loads(registro.resultado) == RESULTADO
+    assert registro.expira_em > datetime.utcnow() + timedelta(days=6)
+    assert upstream.chamadas == 1
+
+
+def test_entrada_alem_da_janela_stale_consulta_de_novo(app):
+    db.session.add(GeocodeCache(chave='endereco:rua augusta', resultado=json.dumps({'sucesso': True}),
+                                expira_em=datetime.utcnow() - timedelta(days=2),
+                                descartar_em=datetime.utcnow() - timedelta(days=1)))
+    db.session.commit()
+    upstream = Upstream()
+
+    assert aplicacao.obter_geocodificacao('endereco:rua augusta', upstream, timedelta(days=7)) == RESULTADO
+    assert upstream.chamadas == 1
+    assert contadores() == {'miss': 1}
+
+
+def test_nao_encontrado_fica_pouco_tempo_e_erro_de_conexao_nao_fica(app):
+    nao_encontrado = Upstream({'erro': 'Endereço não encontrado'})
+    aplicacao.obter_geocodificacao('endereco:rua que nao existe', nao_encontrado, timedelta(days=7))
+    registro = db.session.get(GeocodeCache, 'endereco:rua que nao existe')
+    assert registro.expira_em < datetime.utcnow() + aplicacao.GEOCODE_TTL_NEGATIVO + timedelta(seconds=5)
+
+    conexao = Upstream({'erro': 'Erro de conexão com Nominatim'})
+    aplicacao.obter_geocodificacao('endereco:rua augusta', conexao, timedelta(days=7))
+    aplicacao.obter_geocodificacao('endereco:rua augusta', conexao, timedelta(days=7))
+    assert conexao.chamadas == 2
+    assert db.session.get(GeocodeCache, 'endereco:rua augusta') is None
+
+
+def test_enderecos_com_acento_e_caixa_diferentes_usam_a_mesma_chave(app, monkeypatch):
+    upstream = Upstream()
+    monkeypatch.setattr(aplicacao, 'consultar_nominatim', lambda endereco: upstream())
+
+    aplicacao.buscar_endereco('Rua Augusta,  São Paulo')
+    aplicacao.buscar_endereco('rua augusta, sao paulo')
+
+    assert upstream.chamadas == 1
+    assert db.session.get(GeocodeCache, 'endereco:rua augusta, sao paulo') is not None
+
+
+def test_itens_que_nao_sao_texto_sao_rejeitados_por_item(client, criar_usuario, monkeypatch):
+    login(client, criar_usuario())
+    consultas = []
+    monkeypatch.setattr(aplicacao, 'buscar_endereco',
+                        lambda valor, **_: consultas.append(valor) or {'erro': 'Endereço não encontrado'})
+    monkeypatch.setattr(aplicacao, 'buscar_cep',
+                        lambda valor, **_: consultas.append(valor) or {'erro': 'CEP não encontrado'})
+    
+    resposta = client.post('/api/geocodificar-lote', json={
+        'ceps': [None, 1310100, 'abc'],
+        'enderecos': [None, '', '   ', ['Rua A'], 'Rua Augusta, São Paulo']
+    })
+    
+    assert resposta.status_code == 200
+    itens = resposta.get_json()['itens']
+    assert [item['status'] for item in itens] == ['invalido'] * 7 + ['nao_encontrado']
+    assert itens[0]['entrada'] is None
+    assert consultas == ['Rua Augusta, São Paulo']
+
+
+class Resposta:
+    def __init__(self, status_code=200, dados=None):
+        self.status_code = status_code
+        self._dados = dados
+
+    def json(self):
+        return self._dados
+
+
+class SessaoFalsa:
+    """Substituto de requests.Session: registra as chamadas e responde com `responder(url, params)`"""
+
+    def __init__(self, responder):
+        self.responder = responder
+        self.chamadas = []
+        self._lock = threading.Lock()
+
+    def get(self, url, params=None, timeout=None):
+        with self._lock:
+            self.chamadas.append((time.monotonic(), url, params))
+        return self.responder(url, params)
+
+
+VIACEP = {'cep': '01310-100', 'logradouro': 'Avenida Paulista', 'bairro': 'Bela Vista',
+          'localidade': 'São Paulo', 'uf': 'SP'}
+NOMINATIM = [{'display_name': 'Rua Augusta, São Paulo', 'lat': '-23.55', 'lon': '-46.65'}]
+
+
+@pytest.fixture
+def disjuntores(monkeypatch):
+    """Disjuntores novos com limite e espera curtos"""
+    viacep = aplicacao.Disjuntor('viacep', limite_falhas=3, espera=0.3)
+    nominatim = aplicacao.Disjuntor('nominatim', limite_falhas=3, espera=0.3)
+    monkeypatch.setattr(aplicacao, 'disjuntor_viacep', viacep)
+    monkeypatch.setattr(aplicacao, 'disjuntor_nominatim', nominatim)
+    return viacep, nominatim
+
+
+def test_disjuntor_abre_depois_de_n_falhas_e_testa_depois_da_espera(app, monkeypatch, disjuntores):
+    viacep, _ = disjuntores
+    fora_do_ar = SessaoFalsa(lambda url, params: Resposta(503))
+    monkeypatch.setattr(aplicacao, 'sessao_geocodificacao', fora_do_ar)
+
+    for _ in range(3):
+        assert aplicacao.consultar_viacep('01310100') == {'erro': 'Erro ao consultar CEP'}
+    assert viacep.estado == 'aberto'
+    # Aberto: recusa sem chamar o serviço
+    assert 'indisponível' in aplicacao.consultar_viacep('01310100')['erro']
+    assert len(fora_do_ar.chamadas) == 3
+
+    time.sleep(0.35)
+    assert viacep.estado == 'meio-aberto'
+    # Uma única chamada de teste; enquanto ela não termina, as outras são recusadas
+    assert viacep.permitir() is True
+    assert viacep.permitir() is False
+    viacep.falha()
+    assert viacep.estado == 'aberto'
+
+    time.sleep(0.35)
+    monkeypatch.setattr(aplicacao, 'sessao_geocodificacao', SessaoFalsa(lambda url, params: Resposta(200, VIACEP)))
+    assert aplicacao.consultar_viacep('01310100')['sucesso'] is True
+    assert viacep.estado == 'fechado'
+
+
+def test_excecao_de_conexao_conta_como_falha(app, monkeypatch, disjuntores):
+    _, nominatim = disjuntores
+    monkeypatch.setitem(app.config, 'NOMINATIM_INTERVALO', 0)
+
+    def recusar(url, params):
+        raise aplicacao.requests.exceptions.ConnectionError('recusada')
+
+    monkeypatch.setattr(aplicacao, 'sessao_geocodificacao', SessaoFalsa(recusar))
+    for _ in range(3):
+        assert aplicacao.consultar_nominatim('Rua Augusta') == {'erro': 'Erro de conexão com Nominatim'}
+    assert nominatim.estado == 'aberto'
+
+
+def test_consultas_identicas_simultaneas_fazem_uma_chamada(app, monkeypatch, disjuntores):
+    liberar = threading.Event()
+
+    def responder(url, params):
+        liberar.wait(5)
+        return Resposta(200, VIACEP)
+
+    sessao = SessaoFalsa(responder)
+    monkeypatch.setattr(aplicacao, 'sessao_geocodificacao', sessao)
+    largada = threading.Barrier(8)
+
+    def buscar(_):
+        with app.app_context():
+            largada.wait()
+            return aplicacao.buscar_cep('01310-100')
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futuros = [executor.submit(buscar, i) for i in range(8)]
+        time.sleep(0.2)
+        liberar.set()
+        resultados = [futuro.result(timeout=5) for futuro in futuros]
+
+    assert len(sessao.chamadas) == 1
+    assert all(resultado['sucesso'] and resultado['cep'] == '01310-100' for resultado in resultados)
+
+
+def test_chamadas_ao_nominatim_respeitam_o_intervalo(app, monkeypatch, disjuntores):
+    assert app.config['NOMINATIM_INTERVALO'] == 1.0
+    sessao = SessaoFalsa(lambda url, params: Resposta(200, NOMINATIM))
+    monkeypatch.setattr(aplicacao, 'sessao_geocodificacao', sessao)
+
+    # Endereços diferentes, em paralelo: o single-flight não junta, o limite espaça
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        list(executor.map(aplicacao.consultar_nominatim, ['Rua A', 'Rua B', 'Rua C']))
+
+    horarios = sorted(horario for horario, _, _ in sessao.chamadas)
+    assert len(horarios) == 3
+    assert all(depois - antes >= 0.99 for antes, depois in zip(horarios, horarios[1:]))
+
+
+def test_orcamento_devolve_a_tempo_quando_o_servico_trava(app, monkeypatch, disjuntores):
+    monkeypatch.setitem(app.config, 'GEOCODE_ORCAMENTO', 0.3)
+    liberar = threading.Event()
+
+    def travar(url, params):
+        liberar.wait(5)
+        return Resposta(200, VIACEP)
+
+    monkeypatch.setattr(aplicacao, 'sessao_geocodificacao', SessaoFalsa(travar))
+
+    inicio = time.monotonic()
+    resultado = aplicacao.buscar_cep('01310100')
+    decorrido = time.monotonic() - inicio
+
+    assert 'demorando' in resultado['erro']
+    assert 0.3 <= decorrido < 1.0
+    assert aplicacao.estatisticas_geocodificacao['estouro_orcamento'] == 1
+
+    # A consulta continua e o resultado fica no cache para a próxima requisição
+    futuro = aplicacao._consultas_em_andamento['cep:01310100']
+    liberar.set()
+    futuro.result(timeout=5)
+    assert aplicacao.buscar_cep('01310100')['sucesso'] is True
+
+
+def test_lote_limita_as_consultas_e_devolve_os_pendentes(client, criar_usuario, monkeypatch, disjuntores):
+    monkeypatch.setitem(aplicacao.app.config, 'GEOCODE_LOTE_CONSULTAS', 2)
+    sessao = SessaoFalsa(lambda url, params: Resposta(200, dict(VIACEP, cep=url.split('/')[-3])))
+    monkeypatch.setattr(aplicacao, 'sessao_geocodificacao', sessao)
+    login(client, criar_usuario())
+    ceps = ['01310100', '01310200', '01310300', '01310400', '01310500']
+
+    resposta = client.post('/api/geocodificar-lote', json={'ceps': ceps}).get_json()
+    assert [item['status'] for item in resposta['itens']] == ['ok', 'ok', 'pendente', 'pendente', 'pendente']
+    assert resposta['pendentes'] == {'ceps': ceps[2:], 'enderecos': []}
+    assert len(sessao.chamadas) == 2
+
+    # Reenviando o lote inteiro: os já resolvidos vêm do cache e não gastam consultas
+    resposta = client.post('/api/geocodificar-lote', json={'ceps': ceps}).get_json()
+    assert resposta['resolvidos'] == 4
+    assert resposta['pendentes'] == {'ceps': ceps[4:], 'enderecos': []}
+    resposta = client.post('/api/geocodificar-lote', json=resposta['pendentes']).get_json()
+    assert resposta['resolvidos'] == 1 and resposta['pendentes'] == {'ceps': [], 'enderecos': []}
+    assert len(sessao.chamadas) == 5
+
+
+def test_lote_responde_dentro_do_orcamento(client, criar_usuario, monkeypatch, disjuntores):
+    monkeypatch.setitem(aplicacao.app.config, 'GEOCODE_LOTE_ORCAMENTO', 0.5)
+    monkeypatch.setitem(aplicacao.app.config, 'NOMINATIM_INTERVALO', 0)
+    liberar = threading.Event()
+
+    def responder(url, params):
+        if params['q'].startswith('Rua Lenta'):
+            liberar.wait(5)
+        return Resposta(200, NOMINATIM)
+
+    monkeypatch.setattr(aplicacao, 'sessao_geocodificacao', SessaoFalsa(responder))
+    login(client, criar_usuario())
+
+    inicio = time.monotonic()
+    resposta = client.post('/api/geocodificar-lote', json={'enderecos': ['Rua Rápida', 'Rua Lenta']},
+                           headers={'Accept': 'application/x-ndjson'})
+    itens = {item['entrada']: item for item in map(json.loads, resposta.get_data(as_text=True).splitlines())}
+    assert time.monotonic() - inicio < 1.5
+    assert itens['Rua Rápida']['status'] == 'ok'
+    assert itens['Rua Lenta'] == {'tipo': 'endereco', 'entrada': 'Rua Lenta', 'status': 'pendente', 'indice': 1}
+
+    # A consulta iniciada continua; terminada, o reenvio sai do cache
+    futuro = aplicacao._consultas_em_andamento['endereco:rua lenta']
+    liberar.set()
+    futuro.result(timeout=5)
+    resposta = client.post('/api/geocodificar-lote', json={'enderecos': ['Rua Lenta']}).get_json()
+    assert resposta['itens'][0]['status'] == 'ok'
@@ -0,0 +1,49 @@
+"""As consultas das listagens e relatórios usam os índices declarados nos modelos (SQLite)"""
+import pytest
+from sqlalchemy import func, text
+
+from app import Comment, Proposal, Vote, db, filtrar_propostas
+
+
+def plano(query):
+    sql = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    return [linha[3] for linha in db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+
+
+def pagina(query):
+    return query.order_by(Proposal.created_at.desc(), Proposal.id.desc()).limit(13)
+
+
+CONSULTAS = {
+    'listagem': (lambda: pagina(filtrar_propostas()), 'ix_proposal_created_id', True),
+    'categoria e status': (lambda: pagina(filtrar_propostas('iluminacao', 'pending')),
+                           'ix_proposal_category_status_created', True),
+    'status': (lambda: pagina(filtrar_propostas(status='approved')), 'ix_proposal_status_created', True),
+    # Só a categoria: busca pelo índice, mas a ordenação por data precisa de um sort
+    'categoria': (lambda: pagina(filtrar_propostas('iluminacao')), 'ix_proposal_category_status_created', False),
+    'mais votadas': (lambda: Proposal.query.order_by(Proposal.votes_count.desc()).limit(5),
+                     'ix_proposal_votes_count', True),
+    'comentários da proposta': (lambda: Comment.query.filter(Comment.proposal_id == 1)
+                                .order_by(Comment.created_at.desc(), Comment.id.desc()).limit(21),
+                                'ix_comment_proposal_created', True),
+    'votos do usuário': (lambda: Vote.query.filter(Vote.user_id == 1, Vote.proposal_id.in_([1, 2]))
+                         .with_entities(Vote.proposal_id), 'COVERING INDEX', True),
+    'propostas por autor': (lambda: Proposal.query.filter(Proposal.author_id == 1)
+                            .with_entities(func.count()), 'ix_proposal_author_created', True),
+    'comentários por usuário': (lambda: Comment.query.filter(Comment.user_id == 1)
+                                .with_entities(func.count()), 'ix_comment_user_created', True),
+}
+
+
+@pytest.mark.parametrize('nome', CONSULTAS)
+def test_consulta_usa_indice(app, nome):
+    montar, indice, sem_ordenacao = CONSULTAS[nome]
+    linhas = plano(montar())
+    
+    for linha in linhas:
+        if linha.startswith('SCAN '):
+            # Percorrer o índice esperado em ordem é aceitável; ler a tabela inteira não
+            assert indice in linha, linhas
+    assert any(indice in linha for linha in linhas), linhas
+    if sem_ordenacao:
+        assert not any('TEMP B-TREE' in linha for linha in linhas), linhas
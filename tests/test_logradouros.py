@@ -0,0 +1,101 @@
+"""Base local de logradouros: importação do CSV e autocompletar por prefixo"""
+import io
+import os
+
+import pytest
+
+import app as aplicacao
+from app import Logradouro
+
+CSV = os.path.join(os.path.dirname(__file__), 'dados', 'logradouros.csv')
+
+
+def importar(conteudo=None):
+    if conteudo is None:
+        with open(CSV, encoding='utf-8-sig', newline='') as arquivo:
+            return aplicacao.importar_logradouros(arquivo)
+    return aplicacao.importar_logradouros(io.StringIO(conteudo))
+
+
+def conteudo_da_base():
+    return sorted((r.cep, r.logradouro, r.bairro, r.cidade, r.estado, r.latitude, r.longitude)
+                  for r in Logradouro.query)
+
+
+def sugestoes(client, q, **params):
+    resposta = client.get('/api/autocomplete-endereco', query_string={'q': q, **params})
+    assert resposta.status_code == 200
+    return [(r['logradouro'], r['cep']) for r in resposta.get_json()['resultados']]
+
+
+@pytest.fixture
+def base(app):
+    importar()
+
+
+def test_importar_de_novo_nao_duplica(app):
+    # As duas últimas linhas (CEP curto e sem logradouro) são ignoradas
+    assert importar() == 8
+    primeira = conteudo_da_base()
+    assert len(primeira) == 8
+    assert ('01310100', 'Avenida Paulista', 'Bela Vista', 'São Paulo', 'SP', -23.5613, -46.6565) in primeira
+
+    assert importar() == 8
+    assert conteudo_da_base() == primeira
+
+
+def test_importacao_substitui_so_as_cidades_do_arquivo(app, base):
+    total = importar('cep,logradouro,cidade,uf\n01310100,Avenida Paulista,São Paulo,SP\n')
+    assert total == 1
+
+    assert sorted((r.cidade, r.logradouro) for r in Logradouro.query) == [
+        ('Rio de Janeiro', 'Avenida Atlântica'),
+        ('Rio de Janeiro', 'Rua Augusta'),
+        ('São Paulo', 'Avenida Paulista'),
+    ]
+
+
+def test_comando_de_importacao(app, tmp_path):
+    executor = app.test_cli_runner()
+    for _ in range(2):
+        resultado = executor.invoke(args=['importar-logradouros', CSV])
+        assert resultado.exit_code == 0
+        assert '8 logradouros importados' in resultado.output
+    assert Logradouro.query.count() == 8
+
+    sem_colunas = tmp_path / 'sem_colunas.csv'
+    sem_colunas.write_text('cep;rua\n01310100;Avenida Paulista\n', encoding='utf-8')
+    resultado = executor.invoke(args=['importar-logradouros', str(sem_colunas)])
+    assert resultado.exit_code != 0
+    assert 'cidade, estado' in resultado.output
+    assert Logradouro.query.count() == 8
+
+
+@pytest.mark.parametrize('q,esperado', [
+    # Prefixo do nome completo e do nome sem o tipo
+    ('aven', [('Avenida Atlântica', '22021-001'), ('Avenida Paulista', '01310-100')]),
+    ('paul', [('Avenida Paulista', '01310-100')]),
+    # Acentos e caixa ignorados nos dois sentidos
+    ('ATLÂN', [('Avenida Atlântica', '22021-001')]),
+    ('acor', [('Rua Açores', '04538-000')]),
+    ('Açô', [('Rua Açores', '04538-000')]),
+    # "Rua da" é ignorado no nome sem tipo
+    ('consol', [('Rua da Consolação', '01302-000')]),
+    ('praça da s', [('Praça da Sé', '01001-000')]),
+    # Ordenado pelo nome sem o tipo e depois pelo CEP
+    ('rua', [('Rua Açores', '04538-000'), ('Rua Augusta', '01305-000'), ('Rua Augusta', '01414-000'),
+             ('Rua Augusta', '20040-002'), ('Rua da Consolação', '01302-000')]),
+    # Prefixo de CEP
+    ('01310', [('Avenida Paulista', '01310-100')]),
+    ('0130', []),
+    ('ru', []),
+])
+def test_autocompletar(client, base, q, esperado):
+    assert sugestoes(client, q) == esperado
+
+
+def test_autocompletar_com_limite_e_cidade(client, base):
+    assert sugestoes(client, 'rua', limite=2) == [('Rua Açores', '04538-000'), ('Rua Augusta', '01305-000')]
+    assert sugestoes(client, 'augusta', cidade='rio de janeiro') == [('Rua Augusta', '20040-002')]
+    assert sugestoes(client, 'augusta', cidade='São Paulo') == [('Rua Augusta', '01305-000'),
+                                                                ('Rua Augusta', '01414-000')]
@@ -0,0 +1,125 @@
+"""API do mapa: agrupamento por área visível e resposta em pontos a partir de MAP_CLUSTER_ZOOM"""
+import json
+from collections import Counter
+
+import pytest
+
+import app as aplicacao
+from app import Proposal
+
+BBOX = (-46.8, -23.7, -46.5, -23.4)  # oeste, sul, leste, norte
+CATEGORIAS = ['iluminacao', 'arborizacao', 'seguranca', 'transporte']
+STATUS = ['pending', 'approved', 'in_progress']
+
+
+@pytest.fixture
+def propostas_na_area(criar_proposta):
+    """Grade de propostas cobrindo BBOX e algumas fora dele"""
+    propostas = []
+    for i in range(60):
+        propostas.append(criar_proposta(
+            title=f'Proposta {i}',
+            category=CATEGORIAS[i % len(CATEGORIAS)],
+            status=STATUS[i % len(STATUS)],
+            latitude=-23.69 + (i % 6) * 0.055,
+            longitude=-46.79 + (i // 6) * 0.0325,
+        ))
+    for i in range(5):
+        propostas.append(criar_proposta(title=f'Fora {i}', latitude=-22.9 - i * 0.01, longitude=-43.2))
+    return propostas
+
+
+def dentro(propostas, category=None):
+    oeste, sul, leste, norte = BBOX
+    return [p for p in propostas
+            if sul <= p.latitude <= norte and oeste <= p.longitude <= leste
+            and category in (None, p.category)]
+
+
+def mapa(client, zoom, **params):
+    resposta = client.get('/api/map-proposals', query_string={
+        'bbox': ','.join(map(str, BBOX)), 'zoom': zoom, **params})
+    assert resposta.status_code == 200
+    return resposta.get_json()
+
+
+@pytest.mark.parametrize('params', [{}, {'category': 'seguranca'}])
+@pytest.mark.parametrize('zoom', [8, 10, 12])
+def test_clusters_somam_as_propostas_da_area(client, propostas_na_area, zoom, params):
+    esperadas = dentro(propostas_na_area, params.get('category'))
+    dados = mapa(client, zoom, **params)
+
+    assert dados['modo'] == 'clusters'
+    clusters = dados['clusters']
+    assert dados['total'] == sum(c['count'] for c in clusters) == len(esperadas)
+    assert len({c['id'] for c in clusters}) == len(clusters)
+
+    por_categoria, por_status = Counter(), Counter()
+    oeste, sul, leste, norte = BBOX
+    for cluster in clusters:
+        assert sum(cluster['por_categoria'].values()) == cluster['count']
+        assert sum(cluster['por_status'].values()) == cluster['count']
+        assert sul <= cluster['latitude'] <= norte and oeste <= cluster['longitude'] <= leste
+        por_categoria.update(cluster['por_categoria'])
+        por_status.update(cluster['por_status'])
+
+    assert por_categoria == Counter(p.category for p in esperadas)
+    assert por_status == Counter(p.status for p in esperadas)
+
+
+def test_zoom_maior_divide_em_mais_clusters(client, propostas_na_area):
+    quantidades = [len(mapa(client, zoom)['clusters']) for zoom in (8, 10, 12, 14)]
+    assert quantidades == sorted(quantidades)
+    assert quantidades[0] < quantidades[-1]
+
+
+@pytest.mark.parametrize('zoom', [15, 18])
+def test_a_partir_do_limite_retorna_pontos(app, client, propostas_na_area, zoom):
+    assert app.config['MAP_CLUSTER_ZOOM'] == 15
+    dados = mapa(client, zoom)
+
+    assert dados['modo'] == 'pontos'
+    assert sorted(p['id'] for p in dados['proposals']) == sorted(p.id for p in dentro(propostas_na_area))
+    assert dados['total'] == len(dados['proposals'])
+    assert mapa(client, 14)['modo'] == 'clusters'
+
+
+def test_sem_bbox_retorna_todas_as_propostas(client, propostas_na_area):
+    dados = client.get('/api/map-proposals').get_json()
+    assert dados['modo'] == 'pontos'
+    assert dados['total'] == Proposal.query.count() == len(propostas_na_area)
+
+
+def test_bbox_malformado_responde_400(client):
+    assert client.get('/api/map-proposals?bbox=-46.8,-23.7,-46.5').status_code == 400
+    assert client.get('/api/map-proposals?bbox=a,b,c,d&zoom=10').status_code == 400
+
+
+@pytest.mark.parametrize('params', [
+    {},
+    {'category': 'seguranca', 'status': 'approved'},
+    {'bbox': ','.join(map(str, BBOX)), 'zoom': 10},  # NDJSON nunca agrupa
+])
+def test_ndjson_traz_as_mesmas_propostas_que_o_json(client, propostas_na_area, params):
+    json_ = client.get('/api/map-proposals', query_string={**params, 'zoom': 18}).get_json()['proposals']
+
+    resposta = client.get('/api/map-proposals', query_string=params, headers={'Accept': 'application/x-ndjson'})
+    assert resposta.status_code == 200
+    assert resposta.mimetype == 'application/x-ndjson'
+    corpo = resposta.get_data(as_text=True)
+    assert corpo.endswith('\n')
+    linhas = [json.loads(linha) for linha in corpo.splitlines()]
+
+    assert len(linhas) == len(json_) > 0
+    assert {p['id']: p for p in linhas} == {p['id']: p for p in json_}
+
+
+def test_ndjson_em_lotes_nao_repete_nem_corta_linhas(app, propostas_na_area):
+    with app.test_request_context():
+        resposta = aplicacao.transmitir_ndjson(Proposal.query, tamanho_lote=7)
+        partes = list(resposta.response)
+
+    assert len(partes) == -(-len(propostas_na_area) // 7)
+    assert all(parte.endswith(b'\n') for parte in partes)
+    ids = [json.loads(linha)['id'] for linha in b''.join(partes).splitlines()]
+    assert sorted(ids) == sorted(p.id for p in propostas_na_area)
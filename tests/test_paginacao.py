@@ -0,0 +1,111 @@
+"""Paginação por cursor de /api/proposals, cronológica e por relevância"""
+from datetime import datetime
+
+import pytest
+
+from app import Proposal, db
+
+
+def percorrer(client, url, inserir=None):
+    """Seguir next_cursor até o fim; inserir() é chamado entre as páginas"""
+    paginas = []
+    cursor = ''
+    while cursor is not None:
+        resposta = client.get(f'{url}&cursor={cursor}')
+        assert resposta.status_code == 200
+        dados = resposta.get_json()
+        paginas.append((dados, [proposta['id'] for proposta in dados['proposals']]))
+        cursor = dados['next_cursor']
+        if inserir and cursor:
+            inserir()
+    return paginas
+
+
+def voltar(client, url, dados):
+    """Seguir prev_cursor a partir de uma página até a primeira"""
+    paginas = []
+    while dados['prev_cursor']:
+        dados = client.get(f"{url}&cursor={dados['prev_cursor']}").get_json()
+        paginas.append([proposta['id'] for proposta in dados['proposals']])
+    return paginas
+
+
+def test_ordem_cronologica_visita_cada_proposta_uma_vez(client, criar_proposta):
+    # Grupos de propostas com o mesmo created_at: o id desfaz os empates
+    propostas = [criar_proposta(created_at=datetime(2024, 1, 1 + i // 4)) for i in range(30)]
+    esperado = [p.id for p in sorted(propostas, key=lambda p: (p.created_at, p.id), reverse=True)]
+    
+    novas = []
+    paginas = percorrer(client, '/api/proposals?x=1',
+                        inserir=lambda: novas.append(criar_proposta(created_at=datetime(2025, 1, 1)).id))
+    ids = [i for _, pagina in paginas for i in pagina]
+    assert ids == esperado
+    assert [len(pagina) for _, pagina in paginas] == [12, 12, 6]
+    
+    # Voltando, as propostas inseridas aparecem antes da primeira página
+    anteriores = voltar(client, '/api/proposals?x=1', paginas[-1][0])
+    assert anteriores == [pagina for _, pagina in paginas[-2::-1]] + [sorted(novas, reverse=True)]
+
+
+def test_busca_por_relevancia_com_insercoes_entre_paginas(client, criar_proposta):
+    lugares = [
+        {'title': 'Reforma da praça central'},
+        {'address': 'Praça da Sé, São Paulo - SP'},
+        {'description': 'Bancos quebrados na praça'},
+        {'title': 'Praça escura', 'description': 'Praça sem iluminação'},
+    ]
+    originais = {criar_proposta(**lugares[i % len(lugares)]).id for i in range(30)}
+    for i in range(10):
+        criar_proposta(title=f'Buraco na rua {i}')  # fora da busca
+    
+    def inserir():
+        # Muda as estatísticas do índice (e a pontuação bm25) de todas as propostas
+        criar_proposta(title='Praça nova', description='Praça praça praça')
+        criar_proposta(title='Calçada')
+    
+    url = '/api/proposals?search=praca'
+    paginas = percorrer(client, url, inserir=inserir)
+    ids = [i for _, pagina in paginas for i in pagina]
+    
+    assert len(ids) == len(set(ids))
+    assert originais <= set(ids)
+    assert all(db.session.get(Proposal, i).title != 'Calçada' for i in ids)
+    
+    # Relevância não cresce ao longo das páginas: título + descrição, título, endereço, descrição
+    pesos = {'title': 10, 'address': 5, 'description': 1}
+    def relevancia(proposta_id):
+        proposta = db.session.get(Proposal, proposta_id)
+        return sum(peso for coluna, peso in pesos.items() if 'praça' in getattr(proposta, coluna).lower())
+    relevancias = [relevancia(i) for i in ids]
+    assert relevancias == sorted(relevancias, reverse=True)
+
+
+def test_voltar_pelas_paginas_da_busca(client, criar_proposta):
+    for i in range(30):
+        criar_proposta(title='Praça' if i % 3 else 'Outra', description='Praça' if i % 2 else 'Rua')
+    url = '/api/proposals?search=praca'
+    paginas = percorrer(client, url)
+    assert voltar(client, url, paginas[-1][0]) == [pagina for _, pagina in paginas[-2::-1]]
+
+
+@pytest.mark.parametrize('cursor', ['lixo!', 'eyJvIjogMTJ9', 'eyJjIjoib250ZW0iLCJpIjoxfQ'])
+def test_cursor_malformado_responde_400(client, criar_proposta, cursor):
+    criar_proposta()
+    assert client.get(f'/api/proposals?search=proposta&cursor={cursor}').status_code == 400
+    assert client.get(f'/api/proposals?cursor={cursor}').status_code == 400
+
+
+def test_formato_colunar_nao_chama_o_tamanho_da_pagina_de_total(client, criar_propostas):
+    criar_propostas(20)
+
+    cursor = client.get('/api/proposals?cursor=&formato=colunar').get_json()
+    assert cursor['quantidade'] == len(cursor['colunas']['id']) == 12
+    assert 'total' not in cursor
+    com_total = client.get('/api/proposals?cursor=&formato=colunar&total=1').get_json()
+    assert (com_total['approximate_total'], com_total['total_is_exact']) == (20, True)
+
+    paginas = client.get('/api/proposals?page=1&formato=colunar').get_json()
+    assert (paginas['quantidade'], paginas['total']) == (12, 20)
+
+    mapa = client.get('/api/map-proposals?formato=colunar').get_json()
+    assert mapa['quantidade'] == mapa['total'] == 20
@@ -0,0 +1,237 @@
+"""Relatórios: PDF pela fila ou na requisição, sinal de vida das tarefas, exportação e filtros de data"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+
+from flask import g
+
+import app as aplicacao
+from app import DespachanteRelatorio, TarefaRelatorio, db
+from conftest import login
+
+
+def registrar_despachante(segundos_atras=0):
+    db.session.add(DespachanteRelatorio(id='teste:1', batimento_em=datetime.utcnow() - timedelta(seconds=segundos_atras)))
+    db.session.commit()
+
+
+def test_sem_despachante_a_pagina_usa_o_download_direto(client, criar_usuario):
+    login(client, criar_usuario())
+    registrar_despachante(segundos_atras=3600)  # parado há uma hora
+
+    pagina = client.get('/relatorios').get_data(as_text=True)
+    assert 'href="/relatorios/pdf"' in pagina
+    assert '/relatorios/tarefas' not in pagina
+
+    resposta = client.post('/relatorios/tarefas', json={'tipo': 'pdf'})
+    assert resposta.status_code == 503
+    assert resposta.get_json()['download_url'] == '/relatorios/pdf'
+    assert TarefaRelatorio.query.count() == 0
+
+
+def test_com_despachante_ativo_a_pagina_usa_a_fila(client, criar_usuario):
+    login(client, criar_usuario())
+    registrar_despachante()
+
+    assert '/relatorios/tarefas' in client.get('/relatorios').get_data(as_text=True)
+    assert client.post('/relatorios/tarefas', json={'tipo': 'pdf'}).status_code == 202
+
+
+def test_pdf_fora_do_cache_vai_para_a_fila(client, criar_usuario):
+    usuario = criar_usuario()
+    login(client, usuario)
+    registrar_despachante()
+
+    resposta = client.get('/relatorios/pdf?dias=7')
+    assert resposta.status_code == 202
+    tarefa = TarefaRelatorio.query.one()
+    assert resposta.get_json()['id'] == tarefa.id
+    assert resposta.headers['Location'] == f'/relatorios/tarefas/{tarefa.id}'
+    assert (tarefa.user_id, tarefa.tipo, json.loads(tarefa.parametros)) == (usuario.id, 'pdf', {'dias': 7})
+    # Nada foi gerado na requisição
+    assert aplicacao.relatorio_pdf_mais_recente('7d') is None
+
+
+def test_pdf_recente_de_outra_versao_e_servido_sem_enfileirar(client, criar_usuario, criar_propostas):
+    login(client, criar_usuario())
+    # Sem despachante, gerado na própria requisição
+    primeira = client.get('/relatorios/pdf')
+    assert primeira.status_code == 200
+    assert primeira.data.startswith(b'%PDF')
+
+    criar_propostas(1)  # nova versão dos dados
+    registrar_despachante()
+    resposta = client.get('/relatorios/pdf')
+    assert resposta.status_code == 200
+    assert resposta.headers['ETag'] == primeira.headers['ETag']
+    assert TarefaRelatorio.query.count() == 0
+
+
+def test_etag_do_pdf_responde_304_ate_a_versao_mudar(app, client, criar_usuario, criar_propostas, monkeypatch):
+    monkeypatch.setitem(app.config, 'RELATORIO_PDF_MAX_IDADE', 0)
+    login(client, criar_usuario())
+
+    primeira = client.get('/relatorios/pdf')
+    assert primeira.status_code == 200
+    etag = primeira.headers['ETag']
+    assert etag == f'"relatorio-geral-{aplicacao.versao_dados()}"'
+
+    repetida = client.get('/relatorios/pdf', headers={'If-None-Match': etag})
+    assert repetida.status_code == 304
+    assert repetida.data == b''
+
+    # Uma escrita avança a versão: o mesmo ETag agora recebe o PDF novo
+    criar_propostas(1)
+    nova = client.get('/relatorios/pdf', headers={'If-None-Match': etag})
+    assert nova.status_code == 200
+    assert nova.data.startswith(b'%PDF')
+    assert nova.headers['ETag'] == f'"relatorio-geral-{aplicacao.versao_dados()}"' != etag
+    assert client.get('/relatorios/pdf', headers={'If-None-Match': nova.headers['ETag']}).status_code == 304
+
+
+def test_despachante_regenera_o_pdf_em_cache_da_nova_versao(app, client, criar_usuario, criar_propostas,
+                                                           monkeypatch):
+    monkeypatch.setitem(app.config, 'RELATORIO_PDF_ATRASO', 0.2)
+    login(client, criar_usuario())
+    anterior = client.get('/relatorios/pdf').headers['ETag']
+
+    criar_propostas(1)
+    versao = aplicacao.versao_dados()
+    destino = aplicacao.caminho_relatorio_pdf('geral', versao)
+    # O commit só avança a versão; nada é gerado no worker web, nem depois do atraso
+    time.sleep(0.5)
+    assert not os.path.exists(destino)
+
+    parar = threading.Event()
+
+    def despachar():
+        with app.app_context():
+            aplicacao.despachar_tarefas_relatorio(processos=1, intervalo=0.05, parar=parar)
+
+    despachante = threading.Thread(target=despachar)
+    despachante.start()
+    try:
+        prazo = time.time() + 30
+        while not os.path.exists(destino) and time.time() < prazo:
+            time.sleep(0.05)
+    finally:
+        parar.set()
+        despachante.join()
+
+    assert os.path.exists(destino)
+    assert aplicacao.relatorio_pdf_mais_recente('geral') == destino
+    assert client.get('/relatorios/pdf').headers['ETag'] == f'"relatorio-geral-{versao}"' != anterior
+
+
+def test_personalizado_sem_despachante_gera_o_pdf_na_requisicao(client, criar_usuario, criar_propostas):
+    criar_propostas(5)
+    login(client, criar_usuario())
+
+    resposta = client.post('/relatorios/personalizado', data={'formato': 'pdf', 'categoria': 'iluminacao'})
+    assert resposta.status_code == 200
+    assert resposta.mimetype == 'application/pdf'
+    assert resposta.data.startswith(b'%PDF')
+    assert TarefaRelatorio.query.count() == 0
+
+
+def test_so_tarefas_com_sinal_de_vida_vencido_voltam_para_a_fila(app, criar_usuario):
+    usuario = criar_usuario()
+    inicio = datetime.utcnow() - timedelta(seconds=120)
+    viva = TarefaRelatorio(user_id=usuario.id, tipo='pdf', status='processando',
+                           started_at=inicio, batimento_em=datetime.utcnow())
+    abandonada = TarefaRelatorio(user_id=usuario.id, tipo='pdf', status='processando',
+                                 started_at=inicio, batimento_em=datetime.utcnow() - timedelta(seconds=300))
+    db.session.add_all([viva, abandonada])
+    db.session.commit()
+
+    assert aplicacao.reenfileirar_tarefas_abandonadas() == 1
+    db.session.expire_all()
+    assert viva.status == 'processando'
+    assert abandonada.status == 'pendente'
+
+    # Reservada de novo, mantém o início da primeira tentativa
+    assert aplicacao.reservar_tarefa_relatorio().id == abandonada.id
+    db.session.expire_all()
+    assert abandonada.started_at == inicio
+    assert abandonada.batimento_em is not None
+
+
+def test_data_fim_inclui_o_dia_inteiro(client, criar_usuario, criar_propostas):
+    propostas = criar_propostas(4)
+    for proposta, criada_em in zip(propostas, ['2024-01-04 23:59:59', '2024-01-05 00:00:00',
+                                               '2024-01-05 23:59:59', '2024-01-06 00:00:00']):
+        proposta.created_at = datetime.strptime(criada_em, '%Y-%m-%d %H:%M:%S')
+    db.session.commit()
+    login(client, criar_usuario())
+
+    resposta = client.get('/relatorios/exportar?formato=jsonl&data_inicio=2024-01-05&data_fim=2024-01-05')
+    assert resposta.status_code == 200
+    ids = [json.loads(linha)['id'] for linha in resposta.get_data(as_text=True).splitlines()]
+    assert ids == [propostas[1].id, propostas[2].id]
+
+
+STREAM = 'https://stream.exemplo.com'
+
+
+def trocar_de_cliente():
+    # Os clientes compartilham o app context da fixture, onde o flask-login guarda o usuário (g)
+    g.pop('_login_user', None)
+
+
+def test_exportacao_vai_para_o_servico_de_stream_com_link_assinado(app, client, criar_usuario, criar_propostas,
+                                                                   monkeypatch):
+    monkeypatch.setitem(app.config, 'EXPORTACAO_URL', STREAM)
+    propostas = criar_propostas(3)
+    login(client, criar_usuario())
+
+    resposta = client.get('/relatorios/exportar?formato=jsonl&categoria=iluminacao')
+    assert resposta.status_code == 302
+    destino = urlsplit(resposta.headers['Location'])
+    assert f'{destino.scheme}://{destino.netloc}{destino.path}' == f'{STREAM}/relatorios/exportar'
+    params = parse_qs(destino.query)
+    assert (params['formato'], params['categoria']) == (['jsonl'], ['iluminacao'])
+
+    # O serviço de stream não recebe o cookie da sessão: o token autoriza
+    stream = app.test_client()
+    trocar_de_cliente()
+    exportada = stream.get(f'{destino.path}?{destino.query}')
+    assert exportada.status_code == 200
+    ids = sorted(json.loads(linha)['id'] for linha in exportada.get_data(as_text=True).splitlines())
+    assert ids == sorted(p.id for p in propostas if p.category == 'iluminacao')
+
+    # O personalizado também manda a exportação para lá
+    trocar_de_cliente()
+    pedido = client.post('/relatorios/personalizado', data={'formato': 'csv', 'status': 'pending'})
+    assert pedido.status_code == 302
+    assert pedido.headers['Location'].startswith(f'{STREAM}/relatorios/exportar?')
+
+
+def test_exportacao_sem_sessao_exige_token_valido(app, client, criar_usuario, monkeypatch):
+    monkeypatch.setitem(app.config, 'EXPORTACAO_URL', STREAM)
+    login(client, criar_usuario())
+    token = parse_qs(urlsplit(client.get('/relatorios/exportar?formato=csv').headers['Location']).query)['token'][0]
+    stream = app.test_client()
+    trocar_de_cliente()
+
+    for url in ('/relatorios/exportar?formato=csv', f'/relatorios/exportar?formato=csv&token={token}x'):
+        resposta = stream.get(url)
+        assert resposta.status_code == 302
+        assert resposta.headers['Location'].startswith('/login')
+
+    monkeypatch.setitem(app.config, 'EXPORTACAO_TOKEN_VALIDADE', -1)
+    assert stream.get(f'/relatorios/exportar?formato=csv&token={token}').status_code == 302
+
+
+def test_data_malformada_responde_400(client, criar_usuario):
+    login(client, criar_usuario())
+    registrar_despachante()
+
+    assert client.get('/relatorios/exportar?formato=csv&data_fim=05/01/2024').status_code == 400
+    assert client.post('/relatorios/tarefas', json={'tipo': 'personalizado', 'data_inicio': '2024-13-01'}).status_code == 400
+    resposta = client.post('/relatorios/personalizado', data={'formato': 'pdf', 'data_fim': 'ontem'})
+    assert resposta.status_code == 400
+    assert 'data_fim inválida' in resposta.get_data(as_text=True)
+    assert TarefaRelatorio.query.count() == 0
@@ -0,0 +1,102 @@
+"""Cache em disco dos tiles do mapa e sua invalidação"""
+import os
+
+import pytest
+
+from app import app as aplicacao, db, tile_do_ponto
+from conftest import login
+
+
+def arquivos_em_cache(z, x, y):
+    diretorio = os.path.join(aplicacao.config['TILE_CACHE_DIR'], str(z), str(x), str(y))
+    return [nome for nome in os.listdir(diretorio) if nome.endswith('.json')] if os.path.isdir(diretorio) else []
+
+
+def test_tile_em_cache_e_descartado_quando_a_proposta_muda(client, criar_propostas):
+    proposta = criar_propostas(1)[0]
+    x, y = tile_do_ponto(proposta.latitude, proposta.longitude, 16)
+    
+    primeira = client.get(f'/tiles/16/{x}/{y}')
+    assert primeira.status_code == 200
+    assert len(primeira.get_json()['features']) == 1
+    assert len(arquivos_em_cache(16, x, y)) == 1
+    
+    proposta.status = 'approved'
+    db.session.commit()
+    assert arquivos_em_cache(16, x, y) == []
+    
+    segunda = client.get(f'/tiles/16/{x}/{y}')
+    assert segunda.get_json()['features'][0]['properties']['status'] == 'approved'
+
+
+def test_invalidacao_nao_cria_diretorios_de_tiles(app, criar_propostas):
+    criar_propostas(20)
+    
+    diretorios = []
+    for raiz, subdiretorios, _ in os.walk(app.config['TILE_CACHE_DIR']):
+        diretorios.extend(os.path.join(raiz, nome) for nome in subdiretorios)
+    # Só os diretórios de zoom, com o marcador de invalidação
+    assert len(diretorios) == 21
+
+
+def tile_da_proposta(proposta, z=16):
+    x, y = tile_do_ponto(proposta.latitude, proposta.longitude, z)
+    return f'/tiles/{z}/{x}/{y}'
+
+
+@pytest.mark.parametrize('z', [12, 16])  # agrupamentos e pontos
+def test_etag_repetido_responde_304_sem_corpo(client, criar_propostas, z):
+    url = tile_da_proposta(criar_propostas(3)[0], z)
+    primeira = client.get(url)
+    etag = primeira.headers['ETag']
+
+    for _ in range(2):  # do banco e depois do cache em disco
+        repetida = client.get(url, headers={'If-None-Match': etag})
+        assert repetida.status_code == 304
+        assert repetida.data == b''
+        assert repetida.headers['ETag'] == etag
+
+    assert client.get(url, headers={'If-None-Match': '"outro"'}).status_code == 200
+
+
+@pytest.mark.parametrize('z', [12, 16])
+def test_nova_proposta_no_tile_muda_o_etag(client, criar_proposta, z):
+    proposta = criar_proposta()
+    url = tile_da_proposta(proposta, z)
+    etag = client.get(url).headers['ETag']
+
+    criar_proposta(latitude=proposta.latitude + 0.0001, longitude=proposta.longitude)
+    assert tile_da_proposta(proposta, z) == url
+    resposta = client.get(url, headers={'If-None-Match': etag})
+    assert resposta.status_code == 200
+    assert resposta.headers['ETag'] != etag
+    assert len(resposta.get_json()['features']) == (2 if z == 16 else 1)
+
+
+def test_voto_muda_o_etag_dos_meus_votos_e_nao_o_do_tile(client, criar_usuario, criar_propostas):
+    # O tile não traz votos (o popup busca /api/proposals/<id>): votar não descarta tiles
+    proposta = criar_propostas(1)[0]
+    login(client, criar_usuario())
+    url = tile_da_proposta(proposta)
+    etag_tile = client.get(url).headers['ETag']
+    etag_votos = client.get('/api/meus-votos').headers['ETag']
+    assert client.get('/api/meus-votos', headers={'If-None-Match': etag_votos}).status_code == 304
+
+    assert client.post(f'/votar/{proposta.id}').get_json()['voted'] is True
+
+    votos = client.get('/api/meus-votos', headers={'If-None-Match': etag_votos})
+    assert votos.status_code == 200
+    assert votos.get_json() == {'ids': [proposta.id]}
+    assert client.get(url, headers={'If-None-Match': etag_tile}).status_code == 304
+
+
+def test_mudanca_de_status_muda_o_etag(client, criar_propostas):
+    proposta = criar_propostas(1)[0]
+    url = tile_da_proposta(proposta)
+    etag = client.get(url).headers['ETag']
+
+    proposta.status = 'in_progress'
+    db.session.commit()
+    resposta = client.get(url, headers={'If-None-Match': etag})
+    assert resposta.status_code == 200
+    assert resposta.headers['ETag'] != etag
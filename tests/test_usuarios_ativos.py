@@ -0,0 +1,112 @@
+"""Ranking de usuários mais ativos: contagens iguais a COUNT(*) direto em cada tabela"""
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as aplicacao
+from app import Comment, Proposal, Vote, db
+
+INICIO = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def atividade(app, criar_usuario):
+    """Usuários com perfis diferentes e atividade espalhada por 2024"""
+    sorteio = random.Random(7)
+    usuarios = [criar_usuario() for _ in range(12)]
+    comentaristas, autores, eleitor, sem_atividade = usuarios[:2], usuarios[2:6], usuarios[6], usuarios[7]
+    ativos = [u for u in usuarios if u is not sem_atividade]
+    # O eleitor só vota
+    escritores = [u for u in ativos if u is not eleitor]
+
+    def quando():
+        return INICIO + timedelta(days=sorteio.randrange(365), minutes=sorteio.randrange(1440))
+
+    propostas = []
+    for i in range(40):
+        autor = sorteio.choice(autores) if i % 4 else sorteio.choice(escritores)
+        propostas.append(Proposal(title=f'Proposta {i}', description='Descrição', category='iluminacao',
+                                  latitude=-23.55, longitude=-46.63, address='Rua Teste',
+                                  author_id=autor.id, created_at=quando()))
+    db.session.add_all(propostas)
+    db.session.commit()
+
+    # 60% dos comentários de dois usuários, muitos na mesma proposta
+    for i in range(250):
+        autor = sorteio.choice(comentaristas) if sorteio.random() < 0.6 else sorteio.choice(escritores)
+        proposta = propostas[0] if i % 5 == 0 else sorteio.choice(propostas)
+        db.session.add(Comment(proposal_id=proposta.id, user_id=autor.id, content='Comentário', created_at=quando()))
+
+    # O eleitor vota em tudo; os outros em algumas propostas
+    pares = {(eleitor.id, p.id) for p in propostas}
+    while len(pares) < 160:
+        pares.add((sorteio.choice(ativos).id, sorteio.choice(propostas).id))
+    for user_id, proposal_id in pares:
+        db.session.add(Vote(user_id=user_id, proposal_id=proposal_id, created_at=quando()))
+    db.session.commit()
+
+    return {'usuarios': usuarios, 'comentaristas': comentaristas, 'eleitor': eleitor,
+            'sem_atividade': sem_atividade}
+
+
+def contar(modelo, coluna_usuario, user_id, desde, ate):
+    consulta = db.session.query(db.func.count()).select_from(modelo).filter(coluna_usuario == user_id)
+    if desde is not None:
+        consulta = consulta.filter(modelo.created_at >= desde)
+    if ate is not None:
+        consulta = consulta.filter(modelo.created_at <= ate)
+    return consulta.scalar()
+
+
+def ranking_esperado(usuarios, desde, ate, incluir_votos):
+    tabelas = [(Proposal, Proposal.author_id), (Comment, Comment.user_id)]
+    if incluir_votos:
+        tabelas.append((Vote, Vote.user_id))
+    linhas = []
+    for usuario in usuarios:
+        totais = tuple(contar(modelo, coluna, usuario.id, desde, ate) for modelo, coluna in tabelas)
+        if any(totais):
+            linhas.append((usuario.id, *totais))
+    return sorted(linhas, key=lambda linha: (*[-total for total in linha[1:]], linha[0]))
+
+
+JANELAS = [
+    (None, None),
+    (datetime(2024, 7, 1), None),
+    (None, datetime(2024, 3, 31, 23, 59, 59)),
+    (datetime(2024, 5, 1), datetime(2024, 5, 31, 23, 59, 59)),
+]
+
+
+def test_contagens_iguais_ao_count_direto(atividade):
+    for desde, ate in JANELAS:
+        for incluir_votos in (False, True):
+            ranking = aplicacao.usuarios_mais_ativos(limite=100, desde=desde, ate=ate, incluir_votos=incluir_votos)
+
+            obtido = [(usuario.id, *totais) for usuario, *totais in ranking]
+            assert obtido == ranking_esperado(atividade['usuarios'], desde, ate, incluir_votos), \
+                (desde, ate, incluir_votos)
+            assert atividade['sem_atividade'].id not in [linha[0] for linha in obtido]
+
+
+def test_comentaristas_pesados_nao_inflam_as_propostas(atividade):
+    ranking = {usuario.id: totais for usuario, *totais in aplicacao.usuarios_mais_ativos(limite=100)}
+
+    for usuario in atividade['comentaristas']:
+        propostas, comentarios = ranking[usuario.id]
+        assert comentarios == Comment.query.filter_by(user_id=usuario.id).count() > 50
+        assert propostas == Proposal.query.filter_by(author_id=usuario.id).count()
+
+
+def test_quem_so_vota_entra_apenas_com_votos(atividade):
+    eleitor = atividade['eleitor']
+    assert eleitor.id not in [u.id for u, *_ in aplicacao.usuarios_mais_ativos(limite=100)]
+
+    com_votos = {u.id: totais for u, *totais in aplicacao.usuarios_mais_ativos(limite=100, incluir_votos=True)}
+    assert com_votos[eleitor.id][2] == Vote.query.filter_by(user_id=eleitor.id).count() >= 40
+
+
+def test_limite_corta_o_ranking_na_ordem(atividade):
+    completo = [u.id for u, *_ in aplicacao.usuarios_mais_ativos(limite=100)]
+    assert [u.id for u, *_ in aplicacao.usuarios_mais_ativos(limite=3)] == completo[:3]
@@ -0,0 +1,176 @@
+"""Votos simultâneos: votes_count tem que continuar igual a COUNT(vote)
+
+O número de alternâncias por thread vem de TESTE_VOTOS_ALTERNANCIAS; o padrão
+soma alguns milhares de votos por execução. Para uma rodada mais pesada:
+
+    TESTE_VOTOS_ALTERNANCIAS=2000 python -m pytest tests/test_votos.py
+"""
+import json
+import os
+import threading
+
+import pytest
+from sqlalchemy import func
+
+import app as aplicacao
+from app import Proposal, Vote, db
+
+THREADS_POR_USUARIO = 2
+USUARIOS = 8
+ALTERNANCIAS = int(os.environ.get('TESTE_VOTOS_ALTERNANCIAS', 150))
+
+
+def alternar_em_paralelo(app, proposta_ids, usuario_ids):
+    """Cada usuário alterna seus votos em duas threads ao mesmo tempo (cliques duplos, abas)"""
+    erros = []
+    largada = threading.Barrier(len(usuario_ids) * THREADS_POR_USUARIO)
+    
+    def trabalhar(usuario_id, deslocamento):
+        largada.wait()
+        for i in range(ALTERNANCIAS):
+            proposta_id = proposta_ids[(i + deslocamento) % len(proposta_ids)]
+            with app.app_context():
+                try:
+                    aplicacao.alternar_voto(proposta_id, usuario_id)
+                except Exception as e:  # noqa: BLE001 - qualquer erro falha o teste
+                    db.session.rollback()
+                    erros.append(repr(e))
+                finally:
+                    db.session.remove()
+    
+    threads = [threading.Thread(target=trabalhar, args=(usuario_id, deslocamento))
+               for usuario_id in usuario_ids for deslocamento in range(THREADS_POR_USUARIO)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return erros
+
+
+def votos_duplicados():
+    """Pares (usuário, proposta) com mais de uma linha em vote"""
+    return db.session.query(Vote.user_id, Vote.proposal_id, func.count())\
+        .group_by(Vote.user_id, Vote.proposal_id).having(func.count() > 1).all()
+
+
+def contagens(proposta_ids):
+    db.session.expire_all()
+    contadores = dict(db.session.query(Proposal.id, Proposal.votes_count).filter(Proposal.id.in_(proposta_ids)))
+    reais = dict(db.session.query(Vote.proposal_id, func.count()).group_by(Vote.proposal_id))
+    return contadores, {proposta_id: reais.get(proposta_id, 0) for proposta_id in proposta_ids}
+
+
+@pytest.mark.parametrize('write_behind', [False, True], ids=['direto', 'write-behind'])
+def test_alternancias_simultaneas_mantem_o_contador(app, criar_usuario, criar_propostas,
+                                                    monkeypatch, tmp_path, write_behind):
+    monkeypatch.setitem(app.config, 'VOTOS_WRITE_BEHIND', write_behind)
+    monkeypatch.setitem(app.config, 'VOTOS_BUFFER_PATH', str(tmp_path / 'votos_pendentes.db'))
+    proposta_ids = [p.id for p in criar_propostas(2)]
+    usuario_ids = [criar_usuario().id for _ in range(USUARIOS)]
+    
+    # Descargas concorrentes com os votos, como as threads dos outros workers
+    parar = threading.Event()
+    
+    def descarregar():
+        while not parar.is_set():
+            with app.app_context():
+                aplicacao.descarregar_votos()
+                db.session.remove()
+    
+    descarga = threading.Thread(target=descarregar)
+    if write_behind:
+        descarga.start()
+    erros = alternar_em_paralelo(app, proposta_ids, usuario_ids)
+    parar.set()
+    if write_behind:
+        descarga.join()
+        aplicacao.descarregar_votos()
+    
+    assert erros == []
+    assert votos_duplicados() == []
+    contadores, reais = contagens(proposta_ids)
+    assert contadores == reais
+    # Cada usuário termina com 0 ou 1 voto em cada proposta
+    assert sum(reais.values()) == Vote.query.count() <= USUARIOS * len(proposta_ids)
+
+
+def test_voto_pela_rota(client, criar_usuario, criar_propostas):
+    from conftest import login
+    proposta = criar_propostas(1)[0]
+    login(client, criar_usuario())
+    
+    primeiro = client.post(f'/votar/{proposta.id}').get_json()
+    segundo = client.post(f'/votar/{proposta.id}').get_json()
+    
+    assert (primeiro['voted'], primeiro['votes_count']) == (True, 1)
+    assert (segundo['voted'], segundo['votes_count']) == (False, 0)
+    assert client.post('/votar/999999').status_code == 404
+
+
+def test_recontagem_com_write_behind_nao_conta_voto_duas_vezes(app, criar_usuario, criar_propostas,
+                                                                monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'VOTOS_WRITE_BEHIND', True)
+    monkeypatch.setitem(app.config, 'VOTOS_BUFFER_PATH', str(tmp_path / 'votos_pendentes.db'))
+    monkeypatch.setitem(app.config, 'VOTOS_FLUSH_INTERVALO', 3600)
+    proposta_id = criar_propostas(1)[0].id
+    usuario_id = criar_usuario().id
+    
+    # Segurar o voto entre o commit e o registro do delta no buffer
+    gravado, liberar = threading.Event(), threading.Event()
+    registrar_original = aplicacao.registrar_delta_voto
+    
+    def registrar_devagar(proposal_id, delta):
+        gravado.set()
+        liberar.wait(5)
+        registrar_original(proposal_id, delta)
+    
+    monkeypatch.setattr(aplicacao, 'registrar_delta_voto', registrar_devagar)
+    
+    def votar():
+        with app.app_context():
+            aplicacao.alternar_voto(proposta_id, usuario_id)
+            db.session.remove()
+    
+    eleitor = threading.Thread(target=votar)
+    eleitor.start()
+    assert gravado.wait(5)
+    
+    # A recontagem espera o voto terminar; liberar logo depois que ela começar
+    threading.Timer(0.2, liberar.set).start()
+    aplicacao.reconciliar_contadores()
+    eleitor.join()
+    aplicacao.descarregar_votos()
+    
+    contadores, reais = contagens([proposta_id])
+    assert contadores == reais == {proposta_id: 1}
+
+
+def test_respostas_do_mapa_e_da_busca_somam_os_votos_pendentes(client, criar_usuario, criar_propostas,
+                                                                monkeypatch, tmp_path):
+    monkeypatch.setitem(client.application.config, 'VOTOS_WRITE_BEHIND', True)
+    monkeypatch.setitem(client.application.config, 'VOTOS_BUFFER_PATH', str(tmp_path / 'votos_pendentes.db'))
+    monkeypatch.setattr(aplicacao._buffer_votos, 'conexao', None, raising=False)
+    propostas = criar_propostas(3)
+    votada = propostas[1]
+    for _ in range(2):
+        aplicacao.alternar_voto(votada.id, criar_usuario().id)
+    assert aplicacao.votos_pendentes() == {votada.id: 2}
+    assert db.session.query(Proposal.votes_count).filter_by(id=votada.id).scalar() == 0
+
+    def votos(proposals):
+        return {p['id']: p['votes_count'] for p in proposals}
+
+    esperado = {propostas[0].id: 0, votada.id: 2, propostas[2].id: 0}
+    assert votos(client.get('/api/map-proposals').get_json()['proposals']) == esperado
+    ndjson = client.get('/api/map-proposals?formato=ndjson').get_data(as_text=True).splitlines()
+    assert votos(json.loads(linha) for linha in ndjson) == esperado
+    colunas = client.get('/api/map-proposals?formato=colunar').get_json()['colunas']
+    assert dict(zip(colunas['id'], colunas['votes_count'])) == esperado
+    perto = client.get(f'/api/buscar-propostas?lat={votada.latitude}&lng={votada.longitude}&raio=1')
+    assert votos(perto.get_json()['propostas']) == esperado
+    assert votos(client.get('/api/proposals').get_json()['proposals']) == esperado
+
+    # Depois da descarga o valor vem do banco e continua o mesmo
+    aplicacao.descarregar_votos()
+    assert aplicacao.votos_pendentes() == {}
+    assert votos(client.get('/api/map-proposals').get_json()['proposals']) == esperado